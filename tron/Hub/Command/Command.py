@@ -4,7 +4,7 @@ import re
 import time
 from collections import OrderedDict
 
-from tron import Misc, Parsing, g
+from tron import Misc, Parsing, g, hub
 from tron.Hub.Reply.Reply import Reply
 
 
@@ -43,15 +43,21 @@ class Command(Misc.Object):
         self.xid = g.xids.gimme()
         self.ctime = time.time()
 
+        # When we were handed to the actor, and when we saw our first reply. See CommandStats.
+        self.queueTime = None
+        self.replyTime = None
+
         # The source of the command.
         self.cmdrID = cmdrID
         try:
             cmdr = g.commanders[cmdrID]
             self.cmdrName = cmdr.name
+            self._cmdr = cmdr
         except BaseException:
             self.cmdrName = cmdrID
+            self._cmdr = None
             if len(cmdrID) > 0 and cmdrID[0] != '.':
-                Misc.log('Command', 'no commander %s' % (cmdrID))
+                Misc.log('Command', 'no commander %s', cmdrID)
 
         # How the caller wants the command identified.
         if cid is None:
@@ -70,8 +76,15 @@ class Command(Misc.Object):
         # Some Commands are essentially permanent.
         self.neverEnd = argv.get('neverEnd', False)
 
-        # Register ourselves in a convenient place.
-        # g.pendingCommands[self.xid] = self
+        # Identical safe commands which get copies of our replies, and the command
+        # we are attached to if we are one of those.
+        self.attached = []
+        self.attachedTo = None
+
+        # Set when the command is sent to an actor and tracked in g.pendingCommands.
+        self.pendingActor = None
+        self.deadline = None
+        self.timeoutTimer = None
 
         self.argDict = None
 
@@ -80,11 +93,16 @@ class Command(Misc.Object):
         #
         self.bcastCmdInfo = argv.get('bcastCmdInfo', True)
 
+        # Optionally trace a sample of all commands, for debugging under load.
+        #
+        sample = getattr(g, 'cmdTraceSample', 0)
+        self.traced = self.bcastCmdInfo and sample > 0 and self.xid % sample == 0
+
         if g.hubcmd is not None and self.bcastCmdInfo:
-            g.hubcmd.diag(
-                'CmdIn=%s,%s,%s' %
-                (Misc.qstr(self.cmdrCid), Misc.qstr(self.actorName), Misc.qstr(self.cmd)),
-                src='cmds')
+            self.sendCmdInfo('CmdIn', (Misc.qstr(self.cmdrCid), Misc.qstr(self.actorName),
+                                       Misc.qstr(self.cmd)))
+            if self.traced:
+                self.trace('in')
 
     def __str__(self):
         return 'Command(xid=%s, cmdr=%s, cmdrCid=%s, cmdrMid=%s, actor=%s, cmd=%s)' % \
@@ -106,12 +124,67 @@ class Command(Misc.Object):
 
         return self._names()[0]
 
-    def reportQueued(self):
+    def sendCmdInfo(self, key, values):
+        """ Generate one of the command-tracking keywords, but only if anybody would hear it.
+
+        The values are already formatted, so we build the KVs directly and skip the parser.
+        """
+
+        if hub.isHeard('cmds'):
+            g.hubcmd.diag(OrderedDict(((key, list(values)), )), src='cmds')
+
+    def trace(self, event):
+        """ Log and optionally broadcast a CmdTrace keyword for a sampled command. """
+
+        values = ['%d' % (self.xid), Misc.qstr(event), '%0.3f' % (time.time() - self.ctime),
+                  Misc.qstr(self.cmdrCid), Misc.qstr(self.actorName), Misc.qstr(self.cmd)]
+        Misc.log('hub.cmdTrace', 'CmdTrace=%s', ','.join(values))
+
+        if hub.isHeard('cmdTrace'):
+            g.hubcmd.diag(OrderedDict((('CmdTrace', values), )), src='cmdTrace')
+
+    def reportQueued(self, position=0):
+        """ Announce that we have been sent to our actor or, if position > 0, that we are
+        being held in the hub's queue for the actor at that position.
+        """
+
+        if position == 0:
+            self.queueTime = time.time()
+
         if g.hubcmd is not None and self.bcastCmdInfo:
-            g.hubcmd.diag(('CmdQueued=%d,%0.2f,%s,%s,%s,%s,%s' %
-                           (self.xid, self.ctime, Misc.qstr(self.cmdrCid), self.cmdrMid,
-                            Misc.qstr(self.actorName), self.actorMid, Misc.qstr(self.cmd))),
-                          src='cmds')
+            values = ['%d' % (self.xid), '%0.2f' % (self.ctime), Misc.qstr(self.cmdrCid),
+                      str(self.cmdrMid), Misc.qstr(self.actorName), str(self.actorMid),
+                      Misc.qstr(self.cmd)]
+            if position > 0:
+                values.append('%d' % (position))
+            self.sendCmdInfo('CmdQueued', values)
+            if self.traced:
+                self.trace('queued' if position == 0 else 'held')
+
+        # Commands attached while we were held have now been sent, too.
+        if position == 0:
+            for c in self.attached:
+                if c.queueTime is None:
+                    c.connectToActor(self.actorCid, self.actorMid)
+                    c.reportQueued()
+
+    def attach(self, cmd):
+        """ Arrange for an identical command to get copies of all our replies instead
+        of being sent to the actor itself. If we are still held in the hub's queue,
+        it is only reported as queued once we are sent. """
+
+        self.attached.append(cmd)
+        cmd.attachedTo = self
+        if self.queueTime is not None:
+            cmd.connectToActor(self.actorCid, self.actorMid)
+            cmd.reportQueued()
+
+    def detach(self, cmd):
+        """ Stop copying our replies to an attached command. """
+
+        if cmd in self.attached:
+            self.attached.remove(cmd)
+        cmd.attachedTo = None
 
     def connectToActor(self, cid, mid):
         """ Note the parts of the command we can only figure out when connected to the target. """
@@ -145,14 +218,16 @@ class Command(Misc.Object):
     def cmdr(self):
         """ Return our commander. """
 
-        for c in list(g.commanders.values()):
-            Misc.log('Command.cmdr()', 'checking %s in %s' % (self.cmdrName, c))
-            if self.cmdrName == c.name:
-                Misc.log('Command.cmdr()', 'matched %s in %s' % (self.cmdrName, c))
-                return c
+        # A commander which has since disconnected is no longer ours.
+        if self._cmdr is not None and g.commanders.get(self._cmdr.ID) is not self._cmdr:
+            self._cmdr = None
 
-        Misc.log('Command.cmdr()', 'no cmdr %s in %s' % (self.cmdrName, g.commanders))
-        return None
+        if self._cmdr is None:
+            self._cmdr = hub.findCommanderByName(self.cmdrName)
+            if self._cmdr is None:
+                Misc.log('Command.cmdr()', 'no cmdr %s in %s', self.cmdrName, g.commanders)
+
+        return self._cmdr
 
     def eatAVee(self, s):
         # Match a non-string value -- a value ended by:
@@ -259,7 +334,7 @@ class Command(Misc.Object):
             return None
 
         d = match.groupdict()
-        Misc.log('Command.parseKV', 'kv_re=%s' % (d))
+        Misc.log('Command.parseKV', 'kv_re=%s', d)
 
         rest = d['rest']
 
@@ -281,7 +356,7 @@ class Command(Misc.Object):
                     dv = self.eatAString(rest)
 
                     if dv['level'] != 0:
-                        Misc.log('parseKV', 'warning: eatAString returned with %s' % (dv))
+                        Misc.log('parseKV', 'warning: eatAString returned with %s', dv)
                 else:
                     dv = self.eatAVee(rest)
 
@@ -335,9 +410,9 @@ class Command(Misc.Object):
         """ Searches an OrderedDict for matches.
 
         Args:
-          argv - an OrderedDict of options.
           opts - a list of duples to match against. The duple parts are the option name
                  and a converter. If the converter is None, the option takes no argument.
+                 Or, better, a Parsing.ArgMatcher built once from such a list.
 
         Returns:
           matches   - an OrderedDict of the matched options, with converted arguments.
@@ -382,8 +457,8 @@ class Command(Misc.Object):
             self.parse()
 
         Misc.log('MCCommand.coverArgs',
-                 'requiredArgs=%r optionalArgs=%r ignoreFirst=%r argv=%r'
-                 % (requiredArgs, optionalArgs, ignoreFirst, self.argv))
+                 'requiredArgs=%r optionalArgs=%r ignoreFirst=%r argv=%r',
+                 requiredArgs, optionalArgs, ignoreFirst, self.argv)
 
         # Start with a copy of the command args, which we consume as we copy to
         # the matched_args dict.
@@ -417,13 +492,18 @@ class Command(Misc.Object):
                 leftovers.append((k, v))
 
         Misc.log('MCCommand.coverArgs',
-                 'raw=%r requiredMatches=%r optionalMatches=%r unmatched=%r leftovers=%r'
-                 % (self.argv, requiredMatches, optionalMatches, requiredArgs, leftovers))
+                 'raw=%r requiredMatches=%r optionalMatches=%r unmatched=%r leftovers=%r',
+                 self.argv, requiredMatches, optionalMatches, requiredArgs, leftovers)
 
         return requiredMatches, requiredArgs, optionalMatches, leftovers
 
     def addReply(self, reply, **argv):
-        self.respond(reply['flag'], KVs=reply['KVs'], **argv)
+        # Do not force a lazily decoded reply to parse its keys: let the Reply do that
+        # if and when somebody needs them.
+        if 'KVs' in reply:
+            self.respond(reply['flag'], KVs=reply['KVs'], **argv)
+        else:
+            self.respond(reply['flag'], KVs=None, rawKeys=reply['rawKeys'], **argv)
 
     def inform(self, KVs='', **argv):
         self.makeAndSendReply('i', KVs, **argv)
@@ -458,17 +538,17 @@ class Command(Misc.Object):
         bcast = argv.get('bcast', True)
 
         if self.debug > 0:
-            Misc.log('Command.makeAndSendReply',
-                     'src = %r, flag = %s, KVs = %r' % (src, flag, KVs))
+            Misc.log('Command.makeAndSendReply', 'src = %r, flag = %s, KVs = %r', src, flag, KVs)
 
-        r = Reply(self, flag, KVs, src=src, bcast=bcast)
+        r = Reply(self, flag, KVs, src=src, bcast=bcast, rawKeys=argv.get('rawKeys', None),
+                  asciiKeys=argv.get('asciiKeys', None))
         self.reply(r, **argv)
 
     def reply(self, r, **argv):
         """ Finally register a Reply's KVs and offer it to any interested parties."""
 
         if self.debug > 1:
-            Misc.log('Command.sendReply', 'reply = %r' % (r))
+            Misc.log('Command.sendReply', 'reply = %r', r)
 
         if not argv.get('noRegister', False):
             g.KVs.setKVsFromReply(r)
@@ -476,7 +556,19 @@ class Command(Misc.Object):
         for c in list(g.commanders.values()):
             c.tasteReply(r)
 
+        # The keys have already been registered and broadcast, so attached commands
+        # only need to tell their own commanders.
+        #
+        for c in list(self.attached):
+            c.makeAndSendReply(r.flag, r.KVs, src=r.src, bcast=False, noRegister=True)
+
+        if self.replyTime is None:
+            self.replyTime = r.ctime
+
         if r.finishesCommand():
-            # del g.pendingCommands[self.xid]
+            g.pendingCommands.remove(self)
             if self.bcastCmdInfo:
-                g.hubcmd.diag('CmdDone=%s,%s' % (self.xid, Misc.qstr(r.flag.lower())), src='cmds')
+                g.cmdStats.record(self, r.ctime)
+                self.sendCmdInfo('CmdDone', ('%s' % (self.xid), Misc.qstr(r.flag.lower())))
+                if self.traced:
+                    self.trace(r.flag.lower())
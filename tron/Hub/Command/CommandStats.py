@@ -0,0 +1,149 @@
+__all__ = ['CommandStats']
+
+""" CommandStats.py -- command latency histograms, per actor and command verb.
+
+    For every command which finishes we record three latencies, all measured from
+    the command's creation (Command.ctime):
+
+      queued  - until the command was handed to (or queued for) the actor,
+      reply   - until the first reply of any kind,
+      finish  - until the finishing reply.
+
+    Each (actor, verb, stage) gets a fixed, logarithmic histogram: bin i counts
+    latencies up to BIN_EDGES[i], and the last bin counts everything slower. That
+    is compact enough to keep for every verb of every actor forever, and precise
+    enough to tell a slow actor from a slow hub.
+
+    Keywords generated (by "hub cmdStats" and, optionally, every cmdStatsInterval
+    seconds on the cmdStats source):
+
+      cmdLatencyBins=edge0,edge1,...
+      cmdLatency="actor","verb","stage",N,p50,p90,max,count0,count1,...
+"""
+
+import bisect
+
+from tron import Misc, g, hub
+
+
+# 1ms to ~17 minutes, in factors of 2.
+BIN_EDGES = tuple(0.001 * 2**i for i in range(21))
+
+STAGES = ('queued', 'reply', 'finish')
+
+
+class LatencyHistogram(object):
+    """ Counts of latencies in BIN_EDGES bins, plus the total count and maximum. """
+
+    __slots__ = ('counts', 'n', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BIN_EDGES) + 1)
+        self.n = 0
+        self.max = 0.0
+
+    def add(self, t):
+        self.counts[bisect.bisect_left(BIN_EDGES, t)] += 1
+        self.n += 1
+        if t > self.max:
+            self.max = t
+
+    def quantile(self, q):
+        """ Return the upper edge of the bin containing the q'th quantile. """
+
+        if self.n == 0:
+            return 0.0
+
+        target = q * self.n
+        total = 0
+        for i, c in enumerate(self.counts):
+            total += c
+            if total >= target:
+                break
+
+        if i >= len(BIN_EDGES):
+            return self.max
+        return min(BIN_EDGES[i], self.max)
+
+
+class CommandStats(Misc.Object):
+    """ Latency histograms for all commands, indexed by actor, then verb, then stage. """
+
+    def __init__(self, **argv):
+        Misc.Object.__init__(self, **argv)
+
+        self.actors = {}
+        self.interval = 0
+        self.timer = None
+
+    def record(self, cmd, finishTime):
+        """ Add the latencies of a just-finished command. """
+
+        verbs = self.actors.get(cmd.actorName)
+        if verbs is None:
+            verbs = self.actors[cmd.actorName] = {}
+
+        verb = cmd.cmd.split(None, 1)[0] if cmd.cmd else ''
+        hists = verbs.get(verb)
+        if hists is None:
+            hists = verbs[verb] = [LatencyHistogram() for s in STAGES]
+
+        for hist, t in zip(hists, (cmd.queueTime, cmd.replyTime, finishTime)):
+            if t is not None:
+                hist.add(t - cmd.ctime)
+
+    def clear(self):
+        self.actors = {}
+
+    def listSelf(self, cmd, actors=None, src=None):
+        """ Generate cmdLatencyBins and cmdLatency keywords.
+
+        Args:
+           cmd     - the Command to reply to.
+           actors  - an optional list of actor names. The default is all actors.
+           src     - an optional source for the keywords.
+        """
+
+        argv = {}
+        if src:
+            argv['src'] = src
+
+        cmd.inform('cmdLatencyBins=%s' % (','.join(['%g' % (e) for e in BIN_EDGES])), **argv)
+
+        if actors is None:
+            actors = sorted(self.actors.keys())
+        for actor in actors:
+            verbs = self.actors.get(actor, {})
+            for verb in sorted(verbs.keys()):
+                for stage, hist in zip(STAGES, verbs[verb]):
+                    if hist.n == 0:
+                        continue
+                    cmd.inform('cmdLatency=%s,%s,%s,%d,%0.3f,%0.3f,%0.3f,%s' %
+                               (Misc.qstr(actor), Misc.qstr(verb), Misc.qstr(stage), hist.n,
+                                hist.quantile(0.5), hist.quantile(0.9), hist.max,
+                                ','.join(map(str, hist.counts))), **argv)
+
+    def setInterval(self, interval):
+        """ Generate the keywords on the cmdStats source every interval seconds. 0 stops that. """
+
+        if self.timer is not None:
+            g.poller.removeTimer(self.timer)
+            self.timer = None
+
+        self.interval = interval
+        if interval > 0:
+            self.timer = g.poller.callMeIn(self.periodic, interval)
+
+    def periodic(self):
+        self.timer = None
+        if hub.isHeard('cmdStats'):
+            self.listSelf(g.hubcmd, src='cmdStats')
+        self.setInterval(self.interval)
+
+
+if __name__ == '__main__':
+    h = LatencyHistogram()
+    for t in (0.0005, 0.003, 0.003, 0.01, 0.2, 5.0, 5000.0):
+        h.add(t)
+    print(h.counts, h.n, h.max)
+    print('p50=%g p90=%g' % (h.quantile(0.5), h.quantile(0.9)))
@@ -0,0 +1,124 @@
+__all__ = ['PendingCommands']
+
+""" PendingCommands.py -- track every command sent to an actor until it finishes.
+
+    Commands are indexed by XID. Each command can be given a deadline, counted from
+    when it is actually sent to the actor, after which we give up on the actor: the
+    command is dropped from the actor's bookkeeping and failed back to its commander
+    with a CmdTimeout keyword.
+
+    Timeouts are configured by the "commandTimeouts" entry in hub.json, which maps
+    actor names to either a number of seconds, or to a dictionary mapping command
+    verbs to seconds. The "*" entry in either dictionary is the default. A timeout of
+    0 (the default default) means that the command never times out. For example:
+
+        "commandTimeouts": {"*": 0,
+                            "tcc": {"*": 60, "track": 300},
+                            "apogee": 120}
+"""
+
+import time
+from collections import OrderedDict
+
+from tron import Misc, g
+
+
+class PendingCommands(Misc.Object):
+    """ An XID-indexed registry of in-flight actor commands. """
+
+    def __init__(self, **argv):
+        Misc.Object.__init__(self, **argv)
+
+        self.commands = OrderedDict()
+        self.timeouts = argv.get('timeouts', {})
+        self.timedOut = 0
+
+    def __len__(self):
+        return len(self.commands)
+
+    def __contains__(self, xid):
+        return xid in self.commands
+
+    def get(self, xid, default=None):
+        return self.commands.get(xid, default)
+
+    def values(self):
+        return self.commands.values()
+
+    def timeoutFor(self, actorName, cmdText):
+        """ Return the configured timeout for a command, in seconds. 0 means none. """
+
+        default = self.timeouts.get('*', 0)
+        actorTimeouts = self.timeouts.get(actorName, default)
+        if not isinstance(actorTimeouts, dict):
+            return actorTimeouts
+
+        verb = cmdText.split(None, 1)[0] if cmdText else ''
+        return actorTimeouts.get(verb, actorTimeouts.get('*', default))
+
+    def add(self, cmd, actor):
+        """ Start tracking a command which is being sent to an actor. Its timeout
+        only starts once it is sent: see .sent().
+
+        Args:
+           cmd    - the Command
+           actor  - the ActorNub the command is for.
+        """
+
+        cmd.pendingActor = actor
+        cmd.deadline = None
+        cmd.timeoutTimer = None
+
+        self.commands[cmd.xid] = cmd
+
+    def sent(self, cmd):
+        """ Start a tracked command's timeout, now that it has been sent to its actor. """
+
+        if cmd.xid not in self.commands or cmd.timeoutTimer is not None:
+            return
+
+        timeout = self.timeoutFor(cmd.actorName, cmd.cmd)
+        if timeout and timeout > 0:
+            cmd.deadline = time.time() + timeout
+            cmd.timeoutTimer = {'time': cmd.deadline, 'callback': self.expire, 'token': cmd.xid}
+            g.poller.addTimer(cmd.timeoutTimer)
+
+    def remove(self, cmd):
+        """ Stop tracking a command, typically because it has finished. Quietly
+        ignores commands that we are not tracking. """
+
+        if self.commands.pop(cmd.xid, None) is None:
+            return
+
+        if cmd.timeoutTimer is not None:
+            g.poller.removeTimer(cmd.timeoutTimer)
+            cmd.timeoutTimer = None
+
+    def expire(self, timer):
+        """ Timer callback: fail a command whose actor has not finished it in time. """
+
+        cmd = self.commands.pop(timer['token'], None)
+        if cmd is None:
+            return
+        cmd.timeoutTimer = None
+        self.timedOut += 1
+
+        age = time.time() - cmd.ctime
+        Misc.log('hub.pending', 'timing out %s after %0.1fs' % (cmd, age))
+
+        cmd.pendingActor.dropCommand(cmd)
+        cmd.fail('CmdTimeout=%d,%s,%0.1f' % (cmd.xid, Misc.qstr(cmd.actorName), age), src='hub')
+
+    def listSelf(self, cmd):
+        """ Generate keywords describing all in-flight commands. """
+
+        now = time.time()
+        cmd.inform('pendingCmds=%d,%d' % (len(self.commands), self.timedOut))
+        for xid, c in self.commands.items():
+            if c.deadline is None:
+                timeLeft = 'NaN'
+            else:
+                timeLeft = '%0.1f' % (c.deadline - now)
+            cmd.inform('pendingCmd=%d,%s,%s,%s,%s,%0.1f,%s' %
+                       (xid, Misc.qstr(c.cmdrCid), c.cmdrMid, Misc.qstr(c.actorName),
+                        Misc.qstr(c.cmd), now - c.ctime, timeLeft))
@@ -1,4 +1,6 @@
 from .Command import Command
+from .CommandStats import CommandStats
+from .PendingCommands import PendingCommands
 
 
 #from Decoders import *
@@ -1,10 +1,13 @@
-__all__ = ['KV', 'KVDict', 'kvAsASCII']
+__all__ = ['KV', 'KVDict', 'KVMeta', 'KVSource', 'kvAsASCII', 'valAsASCII']
 
+import bisect
+import fnmatch
+import re
+import sys
 import time
-from collections import OrderedDict
+from collections import OrderedDict, deque
 
 from tron import Misc
-from tron.Misc.cdict import cdict
 
 
 """ Rethought a bit.
@@ -25,6 +28,59 @@ def _doEscape(s, escape):
     """ If it exists in the string s, replace the escape string by
     an escaped version of itself. """
 
+    if not escape or s.find(escape) < 0:
+        return s
+
+    return s.replace(escape, ''.join([knownEscapes[c] for c in escape]))
+
+
+def kvAsASCII(key, val, escape=None):
+    """ Return a canonical form of a keyword + value."""
+
+    # val == None -- valueless keyword.
+    if val is None:
+        return str(key)
+
+    if isinstance(val, KV):
+        val = val.val
+        if val is None:
+            return str(key)
+
+    t = type(val)
+    if t is not list and t is not tuple:
+        if escape:
+            val = _doEscape(val, escape)
+        return '%s=%s' % (key, val)
+
+    # "grammar" misfeature: empty lists show as "key", not as "key="
+    if len(val) == 0:
+        return str(key)
+
+    if None in val:
+        val = ['' if v is None else v for v in val]
+
+    # The escape string can only span values if it contains the separator.
+    if not escape:
+        return '%s=%s' % (key, ','.join(val))
+    if ',' not in escape:
+        return '%s=%s' % (key, _doEscape(','.join(val), escape))
+    return '%s=%s' % (key, ','.join([_doEscape(v, escape) for v in val]))
+
+
+def valAsASCII(val):
+    """ Return the canonical form of just a value, as kvAsASCII() would render it. """
+
+    if val is None:
+        return ''
+    if type(val) in (list, tuple):
+        return ','.join(['' if v is None else v for v in val])
+    return val
+
+
+def _doEscapeSlow(s, escape):
+    """ If it exists in the string s, replace the escape string by
+    an escaped version of itself. """
+
     if not escape:
         return s
 
@@ -37,8 +93,8 @@ def _doEscape(s, escape):
     return s
 
 
-def kvAsASCII(key, val, escape=None):
-    """ Return a canonical form of a keyword + value."""
+def _kvAsASCIISlow(key, val, escape=None):
+    """ The original implementation of kvAsASCII(). Kept as its reference. """
 
     # val == None -- valueless keyword.
     if val is None:
@@ -48,7 +104,7 @@ def kvAsASCII(key, val, escape=None):
         val = val.val
 
     if type(val) not in (list, tuple, type(None)):
-        return '%s=%s' % (key, _doEscape(val, escape))
+        return '%s=%s' % (key, _doEscapeSlow(val, escape))
         # raise Exception("type(%s) for key(%s) value is not legit: %r" % (type(val), key, val))
 
     # "grammar" misfeature: empty lists show as "key", not as "key="
@@ -60,7 +116,7 @@ def kvAsASCII(key, val, escape=None):
         if v is None:
             values.append('')
         else:
-            values.append(_doEscape(v, escape))
+            values.append(_doEscapeSlow(v, escape))
 
     if values:
         return '%s=%s' % (key, ','.join(values))
@@ -68,16 +124,128 @@ def kvAsASCII(key, val, escape=None):
         return str(key)
 
 
+def sameValue(a, b):
+    """ Are two parsed values the same? Lists and tuples of the same values are. """
+
+    if a == b:
+        return True
+
+    sequences = (list, tuple)
+    if type(a) is type(b) or type(a) not in sequences or type(b) not in sequences:
+        return False
+    return tuple(a) == tuple(b)
+
+
+def _globPrefix(pattern):
+    """ Return the literal text which anything matching a glob pattern starts with. """
+
+    for i, c in enumerate(pattern):
+        if c in '*?[':
+            return pattern[:i]
+    return pattern
+
+
+def _regexPrefix(pattern):
+    """ Return the literal text which anything matching a regular expression starts with.
+
+    Only expressions anchored with ^ have one. We stop at the first character which is
+    not a letter, digit, _, -, or an escaped '.'.
+    """
+
+    if not pattern.startswith('^') or '|' in pattern:
+        return ''
+
+    prefix = []
+    i = 1
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\' and pattern[i + 1:i + 2] == '.':
+            prefix.append('.')
+            i += 2
+        elif c.isalnum() or c in '_-':
+            prefix.append(c)
+            i += 1
+        else:
+            # The last character might be optional or repeated.
+            if c in '?*{' and prefix:
+                prefix.pop()
+            break
+
+    return ''.join(prefix)
+
+
+def _prefixRange(index, prefix):
+    """ Return the slice of a sorted key index whose names start with prefix. """
+
+    if not prefix:
+        return 0, len(index)
+
+    end = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return bisect.bisect_left(index, (prefix, )), bisect.bisect_left(index, (end, ))
+
+
+def sizeOfValue(val):
+    """ Return roughly how many bytes a parsed value takes. """
+
+    n = sys.getsizeof(val)
+    if type(val) in (list, tuple):
+        for v in val:
+            n += sys.getsizeof(v)
+    return n
+
+
+class KVMeta(object):
+    """ Where and when some keys were last set: just enough of their Reply to say so.
+
+    Keeping the Reply itself would keep its Command, and the Command's arguments,
+    alive for as long as any of its keys went unchanged. All the keys set by one
+    reply share one KVMeta.
+    """
+
+    __slots__ = ('ctime', 'src', 'xid', 'flag')
+
+    def __init__(self, ctime, src, xid, flag):
+        self.ctime = ctime
+        self.src = src
+        self.xid = xid
+        self.flag = flag
+
+    @classmethod
+    def fromReply(cls, reply):
+        if reply is None:
+            return None
+        return cls(reply.ctime, reply.src, reply.cmd.xid, reply.flag)
+
+    def __str__(self):
+        return 'KVMeta(ctime=%0.4f, src=%s, xid=%s, flag=%s)' % \
+               (self.ctime, self.src, self.xid, self.flag)
+
+
 class KV(object):
+    """ The latest value of a single key. Updated in place when the key is set again. """
+
+    __slots__ = ('key', 'val', 'meta', 'ascii')
 
-    def __init__(self, key, val, reply):
+    def __init__(self, key, val, meta):
         """ Create a single key-value variable. The key must be a string,
         and the value is either a typed value or an uninterpreted string.
+        meta is the KVMeta of the reply which set it, if any.
         """
 
         self.key = key
         self.val = val
-        self.reply = reply
+        self.meta = meta
+
+        # Our "key=value" ASCII form, built by asASCII() and kept until the value changes.
+        self.ascii = None
+
+    def asASCII(self):
+        """ Return kvAsASCII(key, val), only building it once per value. """
+
+        ascii = self.ascii
+        if ascii is None:
+            ascii = self.ascii = kvAsASCII(self.key, self.val)
+        return ascii
 
 #    def __str__(self):
 #        return "%s=%s" % (self.key, self.val)
@@ -92,23 +260,156 @@ class KV(object):
         return converter(self.val)
 
     def __str__(self):
-        if self.reply:
-            t = self.reply.ctime
-            cmd = self.reply.cmd
+        if self.meta:
+            t = self.meta.ctime
+            xid = self.meta.xid
         else:
             t = 0.0
-            cmd = None
+            xid = None
+
+        return 'KV(key=%s, val=%s, ctime=%0.4f, xid=%s)' % (self.key, self.val, t, xid)
+
+
+class KVSource(object):
+    """ The KVs of a single source, in the order their keys were first set.
+
+    Looks like the case-insensitive dictionary of keys to KVs that each source
+    used to have.
+    """
+
+    __slots__ = ('name', 'kvs')
+
+    def __init__(self, name):
+        self.name = name
+        self.kvs = {}
+
+    def __contains__(self, key):
+        return key.lower() in self.kvs
+
+    def __getitem__(self, key):
+        return self.kvs[key.lower()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.kvs)
+
+    def get(self, key, default=None):
+        return self.kvs.get(key.lower(), default)
+
+    def fetch(self, key):
+        """ Return both the cased key and the KV. """
+
+        kv = self.kvs[key.lower()]
+        return kv.key, kv
+
+    def keys(self):
+        return [kv.key for kv in self.kvs.values()]
+
+    def values(self):
+        return list(self.kvs.values())
+
+    def items(self):
+        return [(kv.key, kv) for kv in self.kvs.values()]
+
+
+class KVSources(object):
+    """ The KVSources of a KVDict, looked up case-insensitively. """
+
+    __slots__ = ('sources', )
+
+    def __init__(self):
+        self.sources = {}
+
+    def __contains__(self, src):
+        return src.lower() in self.sources
 
-        return 'KV(key=%s, val=%s, ctime=%0.4f, cmd=%s)' % (self.key, self.val, t, cmd)
+    def __getitem__(self, src):
+        return self.sources[src.lower()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.sources)
+
+    def get(self, src, default=None):
+        return self.sources.get(src.lower(), default)
+
+    def keys(self):
+        return [source.name for source in self.sources.values()]
+
+    def values(self):
+        return list(self.sources.values())
 
 
 class KVDict(Misc.Object):
     """ The main Key=Value dictionary.
+
+    All KVs live in a single dictionary, keyed by the case-folded (src, key) names.
+    .sources also indexes them by source, for listing and clearing sources.
+
+    Optionally, the recent values of some keys can also be kept, each in a ring
+    buffer of (time, value) pairs. The history=argument (and setHistory()) takes
+    a dictionary mapping case-insensitive "src.key" glob patterns to the number
+    of values to keep. The first matching pattern wins, e.g.:
+
+        {"guider.*": 100, "tcc.AxePos": 500, "tcc.*": 0}
+
+    Keys matching any of the case-insensitive "src.key" glob patterns given by
+    the ephemeral=argument (and setEphemeral()) are high-rate telemetry which
+    nobody asks the hub for: replies carrying them are still distributed, but
+    their values are neither stored nor kept in histories, e.g.:
+
+        ["fps.robotPos*", "boss.exposureProgress"]
+
+    setKVsFromReply() notes which of a reply's keys did not change value, and
+    per-source counts of keys set, unchanged, and suppressed by commanders which
+    only want changed keys are kept for listKeyStats().
+
+    query() finds keys by glob or regular expression patterns matched against
+    "src.key" names. It uses a sorted index of the names, so that patterns with
+    a literal prefix ("tcc.Axe*", "^guider\\.") only look at the keys starting
+    with that. The index is brought up to date by the first query after keys
+    are added, and rebuilt after a source is cleared.
+
+    For KVSnapshot, we can track which keys changed and which sources were cleared
+    since the last takeChanges(), and hold stale keys loaded from a snapshot until
+    they are set again.
     """
 
     def __init__(self, **argv):
         Misc.Object.__init__(self, **argv)
-        self.sources = cdict(dictType=OrderedDict)
+        self.kvs = {}
+        self.sources = KVSources()
+
+        # Per folded source name: [source, nKeys, nUnchanged, nSuppressed]
+        self.keyStats = {}
+
+        # Folded (src, key) names of the keys changed since the last takeChanges(), and
+        # the sources cleared since then. None unless trackChanges() has been called.
+        self.dirtyKeys = None
+        self.clearedSources = None
+
+        # Folded (src, key) names of keys loaded from a snapshot and not set since,
+        # with the times they had been set.
+        self.staleKeys = {}
+
+        # Sorted (folded "src.key", folded src, folded key) entries for query(),
+        # and the names added since it was last sorted. None until first needed.
+        self.index = None
+        self.unindexed = []
+
+        self.historyPatterns = []
+        self.historyDepths = {}
+        self.histories = {}
+        self.setHistory(argv.get('history', {}))
+
+        # Per folded (src, key) name: is the key ephemeral?
+        self.ephemeralPatterns = []
+        self.ephemeralNames = {}
+        self.setEphemeral(argv.get('ephemeral', []))
 
     def keyNamesForKVs(self, KVs):
         """ Return the key names for a list of raw KVs. """
@@ -116,50 +417,291 @@ class KVDict(Misc.Object):
         return [kv[0] for kv in KVs]
 
     def setKV(self, src, key, val, reply):
-        """ Save the
+        """ Save the value of a single key. The KV for src.key is updated in place.
+
+        Returns:
+           - False if the key already had the same value, True otherwise.
         """
 
         if src is None:
             src = reply.src
 
+        return self.storeKV(src, key, val, KVMeta.fromReply(reply))
+
+    def storeKV(self, src, key, val, meta):
+        """ Save the value of a single key, with the KVMeta of the reply which set it. """
+
         if self.debug > 5:
             Misc.log('KVDict.setKV', 'src=%r, key=%r, val=%r' % (src, key, val))
 
-        if src not in self.sources:
-            self.sources[src] = cdict(dictType=OrderedDict)
+        name = (src.lower(), key.lower())
+        if self.ephemeralPatterns:
+            ephemeral = self.ephemeralNames.get(name)
+            if ephemeral is None:
+                ephemeral = self.ephemeralNames[name] = self.matchesEphemeral(name)
+            if ephemeral:
+                return True
+
+        kv = self.kvs.get(name)
+        if kv is None:
+            self.newKV(src, key, val, meta)
+            changed = True
+        else:
+            changed = val != kv.val and not sameValue(val, kv.val)
+            if changed or key != kv.key:
+                kv.key = key
+                kv.ascii = None
+            kv.val = val
+            kv.meta = meta
+
+        if changed and self.dirtyKeys is not None:
+            self.dirtyKeys.add(name)
+        if self.staleKeys:
+            self.staleKeys.pop(name, None)
+
+        if self.historyPatterns:
+            self.addHistory(src, key, val, meta)
+
+        return changed
+
+    def newKV(self, src, key, val, meta):
+        """ Create the KV for a key we have not seen before. The folded names are
+        interned, so that all sources and KVDicts share a single copy of each. """
+
+        fsrc = sys.intern(src.lower())
+        fkey = sys.intern(key.lower())
 
-        self.sources[src][key] = KV(key, val, reply)
+        source = self.sources.sources.get(fsrc)
+        if source is None:
+            source = self.sources.sources[fsrc] = KVSource(src)
+
+        kv = self.kvs[(fsrc, fkey)] = source.kvs[fkey] = KV(key, val, meta)
+        if self.index is not None:
+            self.unindexed.append(('%s.%s' % (fsrc, fkey), fsrc, fkey))
+
+        return kv
 
     def setKVsFromReply(self, reply, src=None):
+        """ Save all the keys of a reply, and set its .unchangedKeys. """
+
         if src is None:
             src = reply.src
-        self.setKVs(src, reply.KVs, reply)
+        reply.unchangedKeys = self.setKVs(src, reply.KVs, reply)
 
     def setKVs(self, src, KVs, reply):
+        """ Save some keys.
+
+        Returns:
+           - the set of the key names whose values did not change, or None if all did.
+        """
+
         if self.debug > 3:
             Misc.log('KVDict.setKVs', 'src = %r, keys = %r' % (src, KVs))
 
+        if src is None:
+            src = reply.src
+        meta = KVMeta.fromReply(reply)
+
+        unchanged = None
         for key, val in KVs.items():
-            self.setKV(src, key, val, reply)
+            if not self.storeKV(src, key, val, meta):
+                if unchanged is None:
+                    unchanged = set()
+                unchanged.add(key)
+
+        stats = self.statsFor(src)
+        stats[1] += len(KVs)
+        if unchanged:
+            stats[2] += len(unchanged)
+
+        return unchanged
+
+    def statsFor(self, src):
+        stats = self.keyStats.get(src.lower())
+        if stats is None:
+            stats = self.keyStats[src.lower()] = [src, 0, 0, 0]
+        return stats
+
+    def noteSuppressed(self, src, n):
+        """ Count n unchanged keys which were not sent to a commander. """
+
+        self.statsFor(src)[3] += n
+
+    def listKeyStats(self, cmd, sources=None):
+        """ Generate keyStats="src",nKeys,nUnchanged,nSuppressed,unchangedFraction keywords.
+
+        Args:
+           cmd     - the Command to reply to.
+           sources - an optional list of sources. The default is all sources.
+        """
+
+        if sources is None:
+            stats = sorted(self.keyStats.values())
+        else:
+            stats = [self.keyStats[s.lower()] for s in sources if s.lower() in self.keyStats]
+
+        for src, nKeys, nUnchanged, nSuppressed in stats:
+            cmd.inform('keyStats=%s,%d,%d,%d,%0.3f' %
+                       (Misc.qstr(src), nKeys, nUnchanged, nSuppressed,
+                        nUnchanged / nKeys if nKeys else 0.0))
+
+    def memStatsFor(self, source):
+        """ Return roughly how much memory a source's keys take.
+
+        Returns:
+           - the number of keys.
+           - the number of distinct KVMetas they refer to.
+           - the approximate number of bytes used by the keys, values, and KVMetas.
+        """
+
+        metas = set()
+        nBytes = sys.getsizeof(source.kvs)
+        for kv in source.kvs.values():
+            nBytes += sys.getsizeof(kv) + sys.getsizeof(kv.key) + sizeOfValue(kv.val)
+            if kv.meta is not None:
+                metas.add(id(kv.meta))
+        nBytes += len(metas) * sys.getsizeof(KVMeta(0.0, None, 0, None))
+
+        return len(source.kvs), len(metas), nBytes
+
+    def listMemStats(self, cmd, sources=None):
+        """ Generate memStats="src",nKeys,nMetas,bytes keywords and a memTotal=nSources,nKeys,bytes
+        keyword. The total includes the dictionaries and index shared by all sources.
+
+        Args:
+           cmd     - the Command to reply to.
+           sources - an optional list of sources. The default is all sources.
+        """
+
+        if sources is None:
+            sources = sorted(self.sources.values(), key=lambda s: s.name.lower())
+        else:
+            sources = [self.sources[s] for s in sources if s in self.sources]
+
+        nKeys = 0
+        nBytes = sys.getsizeof(self.kvs) + sys.getsizeof(self.staleKeys)
+        if self.index is not None:
+            nBytes += sys.getsizeof(self.index)
+            nBytes += sum([sys.getsizeof(e) + sys.getsizeof(e[0]) for e in self.index])
+        for source in sources:
+            n, nMetas, sourceBytes = self.memStatsFor(source)
+            cmd.inform('memStats=%s,%d,%d,%d' % (Misc.qstr(source.name), n, nMetas, sourceBytes))
+            nKeys += n
+            nBytes += sourceBytes
+
+        cmd.inform('memTotal=%d,%d,%d' % (len(sources), nKeys, nBytes))
+
+    def setHistory(self, history):
+        """ Set which keys have their recent values kept, and how many. See the class doc. """
+
+        self.historyPatterns = [(p.lower(), int(n)) for p, n in history.items()]
+        self.historyDepths = {}
+
+    def setEphemeral(self, patterns):
+        """ Set which keys are not stored, and drop any such keys we have. See the class doc. """
+
+        self.ephemeralPatterns = [p.lower() for p in patterns]
+        self.ephemeralNames = {}
+
+        for name in [name for name in self.kvs if self.matchesEphemeral(name)]:
+            self.dropKV(name)
+
+    def matchesEphemeral(self, name):
+        """ Does a folded (src, key) name match any ephemeral key pattern? """
+
+        fullName = '%s.%s' % name
+        for pattern in self.ephemeralPatterns:
+            if fnmatch.fnmatchcase(fullName, pattern):
+                return True
+        return False
+
+    def isEphemeral(self, src, key):
+        """ Are the values of src.key left unstored? """
+
+        return bool(self.ephemeralPatterns) and self.matchesEphemeral((src.lower(), key.lower()))
+
+    def dropKV(self, name):
+        """ Forget a single key, by folded (src, key) name. """
+
+        fsrc, fkey = name
+        del self.kvs[name]
+        del self.sources.sources[fsrc].kvs[fkey]
+        self.staleKeys.pop(name, None)
+        self.histories.pop(name, None)
+        if self.dirtyKeys is not None:
+            self.dirtyKeys.discard(name)
+        self.index = None
+        self.unindexed = []
+
+    def historyDepthFor(self, src, key):
+        """ Return the number of values to keep for src.key. 0 for none. """
+
+        name = ('%s.%s' % (src, key)).lower()
+        for pattern, depth in self.historyPatterns:
+            if fnmatch.fnmatchcase(name, pattern):
+                return depth
+
+        return 0
+
+    def addHistory(self, src, key, val, meta):
+        """ Add a new value to the history of src.key, if we keep any. """
+
+        name = (src.lower(), key.lower())
+        depth = self.historyDepths.get(name)
+        if depth is None:
+            depth = self.historyDepths[name] = self.historyDepthFor(src, key)
+        if depth <= 0:
+            return
+
+        history = self.histories.get(name)
+        if history is None or history.maxlen != depth:
+            history = self.histories[name] = deque(history or (), maxlen=depth)
+
+        if type(val) is list:
+            val = tuple(val)
+        history.append((meta.ctime if meta else time.time(), val))
+
+    def getHistory(self, src, key, since=None, n=None):
+        """ Return the kept values of src.key.
+
+        Args:
+           src, key - the key to fetch.
+           since    - if set, only return values set at or after this time.
+           n        - if set, only return the last n values.
+
+        Returns:
+           - a list of (time, value), oldest first, or None if no history is kept.
+        """
+
+        history = self.histories.get((src.lower(), key.lower()))
+        if history is None:
+            return None
+
+        if since is None:
+            values = list(history)
+        else:
+            values = [h for h in history if h[0] >= since]
+        if n is not None:
+            values = values[-n:] if n > 0 else []
+
+        return values
 
     def getKV(self, src, key, default=None):
-        if src not in self.sources:
+        kv = self.kvs.get((src.lower(), key.lower()))
+        if kv is None:
             return default
-        val = self.sources[src].get(key, default)
 
-        return val.val
+        return kv.val
 
     def getKey(self, src, key, default=None):
         if self.debug > 3:
             Misc.log('KVDict.getKey', 'get src=%s key=%s' % (src, key))
 
-        if src not in self.sources:
+        kv = self.kvs.get((src.lower(), key.lower()))
+        if kv is None:
             return default
-        val = self.sources[src].get(key, default)
 
-        if val == default:
-            return val
-        return val.val
+        return kv.val
 
     def addSource(self, source):
         """ Register the fact that a given source exists. """
@@ -168,7 +710,7 @@ class KVDict(Misc.Object):
         if source in self.sources:
             Misc.log('KVDict.addSource', 'source %s already exists' % (source))
             return
-        self.sources[source] = cdict(dictType=OrderedDict)
+        self.sources.sources[sys.intern(source.lower())] = KVSource(source)
 
     def getSources(self):
         """ Return the known sources. """
@@ -178,23 +720,135 @@ class KVDict(Misc.Object):
         return sourceList
 
     def clearSource(self, source):
-        """ Remove all keys (well, actually the entire dictionary), for the given source.
+        """ Remove all keys, and the source itself, for the given source.
 
         Args:
           source  - the name of a key source.
 
-        Does not care if the source has no dictionary.
+        Does not care if the source has no keys.
         """
 
-        try:
-            del self.sources[source]
-        except BaseException:
-            pass
+        fsrc = source.lower()
+        src = self.sources.sources.pop(fsrc, None)
+        if src is None:
+            return
+
+        if src.kvs:
+            self.index = None
+            self.unindexed = []
+
+        kvs = self.kvs
+        for fkey in src.kvs:
+            del kvs[(fsrc, fkey)]
+            self.staleKeys.pop((fsrc, fkey), None)
+            if self.dirtyKeys is not None:
+                self.dirtyKeys.discard((fsrc, fkey))
+
+        if self.clearedSources is not None:
+            self.clearedSources.append(src.name)
+
+    def trackChanges(self):
+        """ Start tracking changed keys and cleared sources. See takeChanges(). """
+
+        if self.dirtyKeys is None:
+            self.dirtyKeys = set()
+            self.clearedSources = []
+
+    def takeChanges(self):
+        """ Return what has changed since the last call, and start afresh.
+
+        Returns:
+           - a list of the names of the sources cleared, in order.
+           - a list of the KVs which were set to new values, with their source names.
+        """
+
+        dirty = self.dirtyKeys or ()
+        cleared = self.clearedSources or []
+        self.dirtyKeys = set()
+        self.clearedSources = []
+
+        changed = []
+        for name in dirty:
+            kv = self.kvs.get(name)
+            if kv is not None:
+                changed.append((self.sources.sources[name[0]].name, kv))
+
+        return cleared, changed
+
+    def loadKV(self, src, key, val, t):
+        """ Restore a key from a snapshot, as stale, unless it has already been set. """
+
+        name = (src.lower(), key.lower())
+        if name in self.kvs or self.isEphemeral(src, key):
+            return
+
+        self.newKV(src, key, val, None)
+        self.staleKeys[name] = t
+
+    def isStale(self, src, key):
+        """ Was src.key loaded from a snapshot, and not set since? """
+
+        return (src.lower(), key.lower()) in self.staleKeys
+
+    def kvTime(self, src, key, kv):
+        """ Return when a KV was last set, if we can tell. """
+
+        if kv.meta is not None:
+            return kv.meta.ctime
+        return self.staleKeys.get((src.lower(), key.lower()), None)
+
+    def keyIndex(self):
+        """ Return the sorted index of all keys, for query(). """
+
+        if self.index is None:
+            self.index = sorted([('%s.%s' % (fsrc, fkey), fsrc, fkey) for fsrc, fkey in self.kvs])
+        elif self.unindexed:
+            self.index.extend(self.unindexed)
+            self.index.sort()
+        self.unindexed = []
+
+        return self.index
+
+    def query(self, patterns, regex=False):
+        """ Find the keys whose "src.key" names match any of some patterns.
+
+        Args:
+           patterns - a list of case-insensitive glob patterns, e.g. "tcc.Axe*".
+           regex    - if True, the patterns are regular expressions, searched for
+                      in the names, e.g. "^tcc\\.axe", "pos$".
+
+        Returns:
+           - a list of (source name, KV) pairs, ordered by folded src.key name.
+        """
+
+        index = self.keyIndex()
+        found = set()
+        for pattern in patterns:
+            if regex:
+                search = re.compile(pattern, re.IGNORECASE).search
+                prefix = _regexPrefix(pattern).lower()
+            else:
+                search = re.compile(fnmatch.translate(pattern.lower())).match
+                prefix = _globPrefix(pattern.lower())
+
+            lo, hi = _prefixRange(index, prefix)
+            for i in range(lo, hi):
+                entry = index[i]
+                if entry not in found and search(entry[0]):
+                    found.add(entry)
+
+        sources = self.sources.sources
+        return [(sources[fsrc].name, self.kvs[(fsrc, fkey)])
+                for name, fsrc, fkey in sorted(found)]
 
     def getKeysForSource(self, source):
         """ Return all active keys for a given source.
         """
-        pass
+
+        src = self.sources.get(source)
+        if src is None:
+            return []
+        return src.keys()
 
     def getValues(self, src, keys):
         """ Return an OrderedDict of values for the given list of keys.
@@ -218,7 +872,7 @@ class KVDict(Misc.Object):
             return vals, keys
 
         if not keys:
-            keys = list(d.keys())
+            keys = d.keys()
 
         unmatched = []
         for k in keys:
@@ -226,40 +880,120 @@ class KVDict(Misc.Object):
                 Misc.log('getKVs', 'ignoring None key value in %r' % (keys))
                 continue
 
-            try:
-                casek, val = d.fetch(k)
-                vals[casek] = val
-            except KeyError:
+            kv = d.kvs.get(k.lower())
+            if kv is None:
                 unmatched.append(k)
+            else:
+                vals[kv.key] = kv
 
         return vals, unmatched
 
 
-if __name__ == '__main__':
+def benchmark(nKeys=100000, nSources=100):
+    """ Time setting, resetting and getting nKeys keys. """
 
     d = KVDict()
-    #    d.setKV('hub', 'a', 1)
-    d.setKVs('hub', (('b', 2), ('c', '3'), ('d', ('dfg', 123))), None)
+    sources = ['actor%d' % (i) for i in range(nSources)]
+    names = [(sources[i % nSources], 'Key%d' % (i)) for i in range(nKeys)]
+    lookups = ['key%d' % (i * nSources) for i in range(0, nKeys // nSources, 7)]
 
-    d.setKVs('xxx', (('b', 2), ('c', '3'), ('d', ('dfg', 4353))), None)
+    t0 = time.time()
+    for src, key in names:
+        d.setKV(src, key, '1', None)
+    t1 = time.time()
+    for src, key in names:
+        d.setKV(src, key, '2', None)
+    t2 = time.time()
+    for src, key in names:
+        d.getKey(src, key)
+    t3 = time.time()
+    for src in sources[:1]:
+        for i in range(nSources):
+            d.getValues(src, lookups)
+    t4 = time.time()
+
+    print('%d keys: %0.3fus per new key, %0.3fus per update, %0.3fus per getKey, '
+          '%0.3fus per getValues key' %
+          (nKeys, (t1 - t0) / nKeys * 1e6, (t2 - t1) / nKeys * 1e6, (t3 - t2) / nKeys * 1e6,
+           (t4 - t3) / (nSources * len(lookups)) * 1e6))
+
+    # Queries with a literal prefix only look at part of the index; others scan it all.
+    d.keyIndex()
+    for patterns, regex in ((['actor7.key1*'], False), (['^actor7\\.key1'], True),
+                            (['*.key1?'], False)):
+        t0 = time.time()
+        for i in range(10):
+            found = d.query(patterns, regex=regex)
+        t1 = time.time()
+        print('query %s: %d matches in %0.3fms' % (patterns[0], len(found), (t1 - t0) / 10 * 1e3))
 
-    print('\n'.join(map(str, d.listKVs(full=True))))
-    print(d.listKVs(pattern='^hub'))
-    print(d.listKVs(pattern='nomatch'))
 
-    d.clearKeys(keys=('hub.b', 'hub.xx'))
-    print(d.listKVs())
+if __name__ == '__main__':
 
-    d.clearKeys()
-    print(d.listKVs())
+    d = KVDict()
+    d.setKVs('hub', OrderedDict((('b', '2'), ('c', '"3"'), ('d', ['dfg', '123']))), None)
+    d.setKVs('xxx', OrderedDict((('b', '2'), ('c', '"3"'), ('d', ['dfg', '4353']))), None)
 
-    t0 = time.time()
-    N = 100000
-    for i in range(N):
-        d.setKV('hub', repr(i), i * 3)
-    t1 = time.time()
-    KVL = d.listKVs(pattern='^1')
-    t2 = time.time()
+    print(d.getSources())
+    for src in d.getSources():
+        matched, unmatched = d.getValues(src, ['B', 'd', 'nokey'])
+        print(src, [kvAsASCII(k, v) for k, v in matched.items()], unmatched)
 
-    print('%0.6fs per add' % ((t1 - t0) / N))
-    print('%0.6fs per list' % ((t2 - t1) / N))
+    d.clearSource('hub')
+    print(d.getSources())
+    print(d.getValues('hub', ['b']))
+
+    benchmark()
+
+    # query() must find what a brute-force scan finds.
+    #
+    d = KVDict()
+    for src in ('tcc', 'TCC2', 'guider', 'a.b', 'a'):
+        for key in ('AxePos', 'axeLim', 'Focus', 'b.c', 'x1', 'x10', 'x2'):
+            d.setKV(src, key, '1', None)
+    d.query(['*'])
+    d.setKV('mcp', 'AxePosSim', '1', None)
+    d.clearSource('TCC2')
+    names = ['%s.%s' % (src, key) for (src, key) in d.kvs]
+    for patterns, regex in ((['tcc.axe*'], False), (['TCC*', '*.x1?'], False), (['a.*'], False),
+                            (['[at]*.[ab]*'], False), (['*'], False), (['nomatch'], False),
+                            (['^tcc\\.ax'], True), (['^a\\.?b'], True), (['^tcc|^mcp'], True),
+                            (['pos'], True), (['^A.X1\\d'], True), (['^a\\.b\\.b\\.c'], True)):
+        found = ['%s.%s' % (src, kv.key) for src, kv in d.query(patterns, regex=regex)]
+        if regex:
+            matches = [[re.search(p, n, re.IGNORECASE) for p in patterns] for n in names]
+        else:
+            matches = [[fnmatch.fnmatchcase(n, p.lower()) for p in patterns] for n in names]
+        expected = [n for n, m in zip(names, matches) if any(m)]
+        assert sorted(n.lower() for n in found) == sorted(expected), (patterns, found, expected)
+    print('query matches a full scan')
+
+    # kvAsASCII() must produce exactly what the original did, for any input.
+    #
+    import random
+
+    random.seed(0)
+    tokens = ('1', '-2.5e3', '"a b"', '"say \\"hi\\""', "'x'", 'ab\ncd', '\r\n', '\n\n', '',
+              None)
+    for i in range(50000):
+        n = random.randint(0, 4)
+        vals = [random.choice(tokens) for j in range(n)]
+        if n == 0:
+            val = random.choice((None, [], ()))
+        elif n == 1 and random.random() < 0.5:
+            val = vals[0]
+        else:
+            val = random.choice((list, tuple))(vals)
+        if random.random() < 0.1:
+            val = KV('k', val, None)
+        escape = random.choice((None, '', '\n', '\r\n', '\r', '\n,'))
+        try:
+            a = kvAsASCII('k', val, escape=escape)
+        except Exception as e:
+            a = type(e)
+        try:
+            b = _kvAsASCIISlow('k', val, escape=escape)
+        except Exception as e:
+            b = type(e)
+        assert a == b, (val, escape, a, b)
+    print('kvAsASCII matches _kvAsASCIISlow')
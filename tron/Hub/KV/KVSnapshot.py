@@ -0,0 +1,265 @@
+__all__ = ['KVSnapshot']
+
+""" KVSnapshot.py -- keep a copy of the KVDict on disk, across hub restarts.
+
+    The snapshot file is a log of JSON records, one per line:
+
+      ["src", "key", time, value]  - src.key was set to value at time.
+      ["src"]                      - all of src's keys were cleared.
+
+    Every interval seconds, the keys which changed since the last write are
+    appended, in a single write. Once the file holds more than compactFactor
+    records per live key, the current keys are instead written to a new file
+    which then atomically replaces the old one. A record cut short by a crash
+    is skipped when the file is loaded, and the file is then compacted.
+
+    At hub startup, the snapshot is loaded into the KVDict as stale keys, which
+    stay stale until their sources set them again.
+"""
+
+import gc
+import json
+import os
+import time
+
+from tron import Misc, g
+
+
+_encode = json.JSONEncoder(separators=(',', ':')).encode
+
+
+class KVSnapshot(Misc.Object):
+    """ Periodically save a KVDict to disk, and restore it. """
+
+    def __init__(self, KVs, **argv):
+        """
+        Args:
+           KVs           - the KVDict to save.
+
+        KWArgs:
+           filename      - the snapshot file. If empty, nothing is saved or loaded.
+           compactFactor - compact the file when it has more than this many records per key.
+        """
+
+        Misc.Object.__init__(self, **argv)
+
+        self.KVs = KVs
+        self.filename = argv.get('filename', None)
+        self.compactFactor = argv.get('compactFactor', 4)
+        self.interval = 0
+        self.timer = None
+
+        # How many records the file holds, and how many we have written.
+        self.nRecords = 0
+        self.nWritten = 0
+        self.nCompactions = 0
+
+    def record(self, src, kv):
+        t = self.KVs.kvTime(src, kv.key, kv)
+        return _encode([src, kv.key, round(t, 3) if t else t, kv.val])
+
+    def load(self):
+        """ Load the snapshot into the KVDict, as stale keys.
+
+        Returns:
+           - the number of keys loaded.
+           - the number of seconds it took.
+        """
+
+        if not self.filename:
+            return 0, 0.0
+
+        self.KVs.trackChanges()
+        if not os.path.exists(self.filename):
+            return 0, 0.0
+
+        # Creating this many objects at once mostly keeps the cyclic GC busy.
+        t0 = time.time()
+        gcWasEnabled = gc.isenabled()
+        gc.disable()
+        try:
+            sources, nRecords, nBad = self._readRecords()
+            n = 0
+            for keys in sources.values():
+                for src, key, t, val in keys.values():
+                    self.KVs.loadKV(src, key, val, t)
+                    n += 1
+        finally:
+            if gcWasEnabled:
+                gc.enable()
+        dt = time.time() - t0
+
+        Misc.log('KVSnapshot.load', 'loaded %d keys from %d records of %s in %0.3fs' %
+                 (n, nRecords, self.filename, dt))
+
+        self.nRecords = nRecords
+        if nBad:
+            Misc.log('KVSnapshot.load', 'skipped %d bad records in %s' % (nBad, self.filename))
+            self.compact()
+
+        return n, dt
+
+    def _readRecords(self):
+        """ Replay the snapshot file, keeping only the final record of each key.
+
+        Returns:
+           - a dictionary of folded source names to dictionaries of folded key names to records.
+           - the number of records read.
+           - the number of records which could not be parsed.
+        """
+
+        with open(self.filename) as f:
+            lines = f.read().splitlines()
+
+        # Parse the whole file in one go, unless some record is broken.
+        nRecords = len(lines)
+        try:
+            records = json.loads('[%s]' % (','.join(lines)))
+        except ValueError:
+            records = None
+
+        sources = {}
+        nBad = 0
+        for i in range(nRecords):
+            try:
+                rec = json.loads(lines[i]) if records is None else records[i]
+                if len(rec) == 1:
+                    sources.pop(rec[0].lower(), None)
+                else:
+                    src, key, t, val = rec
+                    keys = sources.get(src.lower())
+                    if keys is None:
+                        keys = sources[src.lower()] = {}
+                    keys[key.lower()] = rec
+            except Exception:
+                nBad += 1
+
+        return sources, nRecords, nBad
+
+    def write(self):
+        """ Save the keys which have changed since the last write. """
+
+        if not self.filename:
+            return
+
+        # Without a record of what changed, with too many stale records, or when most keys
+        # changed anyway, rewrite it all.
+        dirty = self.KVs.dirtyKeys
+        nKeys = len(self.KVs.kvs)
+        tooLong = self.nRecords > self.compactFactor * max(nKeys, 100)
+        if dirty is None or tooLong or len(dirty) > nKeys // 2:
+            self.compact()
+            return
+
+        cleared, changed = self.KVs.takeChanges()
+        if not cleared and not changed:
+            return
+
+        lines = [_encode([src]) for src in cleared]
+        lines.extend([self.record(src, kv) for src, kv in changed])
+        lines.append('')
+
+        with open(self.filename, 'a') as f:
+            f.write('\n'.join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.nRecords += len(lines) - 1
+        self.nWritten += len(lines) - 1
+
+    def compact(self):
+        """ Atomically replace the snapshot file with one holding only the current keys. """
+
+        if not self.filename:
+            return
+
+        self.KVs.trackChanges()
+        self.KVs.takeChanges()
+
+        tmpName = '%s.tmp' % (self.filename)
+        n = 0
+        with open(tmpName, 'w') as f:
+            for source in self.KVs.sources.values():
+                lines = [self.record(source.name, kv) for kv in source.kvs.values()]
+                if lines:
+                    lines.append('')
+                    f.write('\n'.join(lines))
+                    n += len(lines) - 1
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpName, self.filename)
+
+        self.nRecords = n
+        self.nWritten += n
+        self.nCompactions += 1
+
+    def setInterval(self, interval):
+        """ Write the snapshot every interval seconds. 0 stops that. """
+
+        if self.timer is not None:
+            g.poller.removeTimer(self.timer)
+            self.timer = None
+
+        self.interval = interval
+        if interval > 0 and self.filename:
+            self.timer = g.poller.callMeIn(self.periodic, interval)
+
+    def periodic(self):
+        self.timer = None
+        try:
+            self.write()
+        except Exception as e:
+            Misc.tback('KVSnapshot.write', e)
+        self.setInterval(self.interval)
+
+
+if __name__ == '__main__':
+    import random
+    import sys
+    import tempfile
+
+    from tron.Hub.KV.KVDict import KVDict
+
+    # Snapshot a full hub's worth of keys, change some, and time reloading them all.
+    #
+    nKeys = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    nSources = 100
+    filename = os.path.join(tempfile.mkdtemp(), 'KVs.snapshot')
+
+    KVs = KVDict()
+    snap = KVSnapshot(KVs, filename=filename)
+    snap.load()
+    for i in range(nKeys):
+        KVs.setKV('actor%d' % (i % nSources), 'Key%d' % (i), ['%0.4f' % (i * 0.1), '"ok"'], None)
+
+    t0 = time.time()
+    snap.write()
+    t1 = time.time()
+    for i in range(nKeys // 10):
+        KVs.setKV('actor%d' % (i % nSources), 'Key%d' % (random.randrange(nKeys)), '"new"', None)
+    KVs.clearSource('actor7')
+    snap.write()
+    t2 = time.time()
+    snap.compact()
+    t3 = time.time()
+
+    # Simulate a crash during an append.
+    with open(filename, 'a') as f:
+        f.write('["actor1","Key1",12')
+
+    print('%d keys; %d bytes; first write %0.3fs, append %0.3fs, compaction %0.3fs' %
+          (len(KVs.kvs), os.path.getsize(filename), t1 - t0, t2 - t1, t3 - t2))
+
+    KVs2 = KVDict()
+    n, dt = KVSnapshot(KVs2, filename=filename).load()
+    print('reloaded %d keys in %0.3fs (%0.2fus per key)' % (n, dt, dt / max(n, 1) * 1e6))
+
+    assert n == len(KVs.kvs)
+    assert 'actor7' not in KVs2.sources
+    for (fsrc, fkey), kv in KVs.kvs.items():
+        kv2 = KVs2.kvs[(fsrc, fkey)]
+        assert kv2.key == kv.key and list(kv2.val) == list(kv.val), (kv, kv2)
+        assert KVs2.isStale(fsrc, fkey)
+    KVs2.setKV('actor1', 'key1', '1', None)
+    assert not KVs2.isStale('actor1', 'Key1')
+    print('reloaded keys match')
@@ -1,6 +1,10 @@
 __all__ = ['ActorNub']
 
+import heapq
+import itertools
 import re
+import time
+from collections import OrderedDict
 
 from tron import Misc, g
 from tron.Hub.Command.Command import Command
@@ -23,6 +27,21 @@ class ActorNub(CoreNub):
         replyCallback - func(cmd, reply)
             If set, called with eachreply line _instead of_ the cmd callback.
         logDir     - Log all I/O to the given directory
+        maxInFlight - the most commands we let the actor work on at once. Any more
+            are held in our queue until earlier ones finish. 0 means no limit.
+        priorityCmds - regexp of commands which bypass maxInFlight and our queue.
+            Commands matching safeCmds do not bypass the limit, but do jump the queue.
+
+        coalesceSafeCmds - if True, a command matching safeCmds which is identical to one
+            already in flight is not sent again, but gets the replies to the earlier one.
+
+        maxExternalCmds - the most commands we keep track of which the actor replied to
+            but we did not send. The least recently active ones are forgotten first.
+        maxExternalCmdAge - forget such commands after this many seconds without a reply.
+
+        maxInFlight, priorityCmds, coalesceSafeCmds, maxExternalCmds and
+        maxExternalCmdAge can also be set in the actor's entry in the location
+        configuration file.
         """
 
         self.cid = None
@@ -49,7 +68,26 @@ class ActorNub(CoreNub):
         else:
             # Let this fail grotesquely.
             self.safeCmds = re.compile(safeCmds)
-            Misc.log('ActorNub.init', 'added safeCmds %s from %s' % (self.safeCmds, safeCmds))
+            Misc.log('ActorNub.init', 'added safeCmds %s from %s', self.safeCmds, safeCmds)
+
+        actorCfg = self.actorConfig()
+        self.maxInFlight = argv.get('maxInFlight', actorCfg.get('maxInFlight', 0))
+        priorityCmds = argv.get('priorityCmds', actorCfg.get('priorityCmds', None))
+        if priorityCmds is None:
+            self.priorityCmds = None
+        else:
+            self.priorityCmds = re.compile(priorityCmds)
+
+        # In-flight safe commands which identical commands can be attached to, by command text.
+        #
+        self.coalesceSafeCmds = argv.get('coalesceSafeCmds',
+                                         actorCfg.get('coalesceSafeCmds', False))
+        self.coalescingCmds = {}
+
+        # Commands waiting for an in-flight slot: a heap of (priority, seq, cmd).
+        #
+        self.cmdQueue = []
+        self.cmdSeq = itertools.count()
 
         # All active commands that we are aware of, either because
         # we sent them, or because the actor replied to it.
@@ -60,6 +98,18 @@ class ActorNub(CoreNub):
         #
         self.ourCommands = {}
 
+        # The keys of the active commands that we did not send, least recently active
+        # first, with the time of their last reply. Actors rarely finish these
+        # reliably, so we bound the number and age of those we keep.
+        #
+        self.externalCmds = OrderedDict()
+        self.maxExternalCmds = argv.get('maxExternalCmds',
+                                        actorCfg.get('maxExternalCmds', 1000))
+        self.maxExternalCmdAge = argv.get('maxExternalCmdAge',
+                                          actorCfg.get('maxExternalCmdAge', 3600.0))
+        self.evictedCmds = 0
+        self.externalCmdTimer = None
+
     def __str__(self):
         return 'ActorNub(%s, cid=%s, mid=%s)' % (self.ID, self.cid, self.mid)
 
@@ -84,12 +134,30 @@ class ActorNub(CoreNub):
             initCmds = self.initCmds
             doRegister = True
 
-        Misc.log('ActorNub.connected', 'sending initCmds to %s (cid=%s)' % (self.ID, self.cid))
+        Misc.log('ActorNub.connected', 'sending initCmds to %s (cid=%s)', self.ID, self.cid)
         for c in initCmds:
-            Misc.log('ActorNub.connected', 'sending initCmd %s' % (c))
+            Misc.log('ActorNub.connected', 'sending initCmd %s', c)
             self.sendCommand(Command('.hub', '0', g.hubMIDs.gimme(), self.name, c),
                              doRegister=doRegister)
 
+    def actorConfig(self):
+        """ Return our entry in the location configuration, or {}. """
+
+        try:
+            return Misc.cfg.get(g.location, 'actors', {}).get(self.name, {})
+        except Exception:
+            return {}
+
+    def cmdPriority(self, c):
+        """ Return the queue priority of a command: 0 bypasses the queue entirely,
+        then 1 (safe commands) go before 2 (everything else). """
+
+        if self.priorityCmds and self.priorityCmds.match(c.cmd):
+            return 0
+        if self.safeCmds and self.safeCmds.match(c.cmd):
+            return 1
+        return 2
+
     def sendCommand(self, c, doRegister=True):
         """ Main entry point for sending a command.
 
@@ -100,6 +168,64 @@ class ActorNub(CoreNub):
           doRegister - if True (the default), keep track of replies.
         """
 
+        if doRegister:
+            g.pendingCommands.add(c, self)
+
+            if self.coalesceSafeCmds and self.safeCmds and self.safeCmds.match(c.cmd):
+                key = c.cmd.strip()
+                primary = self.coalescingCmds.get(key)
+                if primary is not None:
+                    primary.attach(c)
+                    return
+                self.coalescingCmds[key] = c
+
+            if self.maxInFlight > 0:
+                priority = self.cmdPriority(c)
+                if priority > 0 and (self.cmdQueue or
+                                     len(self.ourCommands) >= self.maxInFlight):
+                    self.queueCommand(c, priority)
+                    return
+
+        self.dispatchCommand(c, doRegister=doRegister)
+
+    def queueCommand(self, c, priority):
+        """ Hold a command until the actor has a free in-flight slot. """
+
+        entry = (priority, next(self.cmdSeq), c)
+        heapq.heappush(self.cmdQueue, entry)
+        position = 1 + sum(1 for e in self.cmdQueue if e[:2] < entry[:2])
+        c.reportQueued(position=position)
+
+    def sendQueuedCommands(self):
+        """ Send as many queued commands as we have free in-flight slots for. """
+
+        while self.cmdQueue and len(self.ourCommands) < self.maxInFlight:
+            priority, seq, c = heapq.heappop(self.cmdQueue)
+            self.dispatchCommand(c)
+
+    def failQueuedCommands(self, why):
+        """ Fail all the commands we are still holding. """
+
+        queue = self.cmdQueue
+        self.cmdQueue = []
+        for priority, seq, c in sorted(queue):
+            c.fail('NoTarget=%s' % (Misc.qstr(why)), src='hub')
+
+    def failOurCommands(self, why):
+        """ Fail all the commands we have sent which the actor has not finished. """
+
+        ourCommands = self.ourCommands
+        self.ourCommands = {}
+        for key, c in ourCommands.items():
+            if self.liveCommands.get(key) is c:
+                del self.liveCommands[key]
+            self.forgetCoalescing(c)
+            g.pendingCommands.remove(c)
+            c.fail('NoTarget=%s' % (Misc.qstr(why)), src='hub')
+
+    def dispatchCommand(self, c, doRegister=True):
+        """ Actually send a command to the actor. """
+
         # Check whether we can encode the command first:
         #
         self.__registerOurCmd(c, doRegister=doRegister)
@@ -107,6 +233,8 @@ class ActorNub(CoreNub):
         ec = self.encoder.encode(c)
 
         c.reportQueued()
+        if doRegister:
+            g.pendingCommands.sent(c)
         self.queueForOutput(ec)
         if self.log:
             self.log.log(ec, note='>')
@@ -119,7 +247,7 @@ class ActorNub(CoreNub):
         """
 
         if self.debug > 6:
-            Misc.log('Nub.copeWithInput', 'ActorNub %s read: %s' % (self.name, s))
+            Misc.log('Nub.copeWithInput', 'ActorNub %s read: %s', self.name, s)
 
         # Find and execute _every_ complete input.
         # The only time this function gets called is when new input comes in, so we
@@ -144,7 +272,7 @@ class ActorNub(CoreNub):
             # The actor had better reply to our connection...
             #
             if self.cid is None and self.grabCID:
-                Misc.log('Nub.copeWithInput', 'setting %s cid=%s' % (self.name, reply['cid']))
+                Misc.log('Nub.copeWithInput', 'setting %s cid=%s', self.name, reply['cid'])
                 self.cid = reply['cid']
                 self.connected()
 
@@ -173,7 +301,7 @@ class ActorNub(CoreNub):
         key = self.keyForCommand(cmd)
 
         if self.debug > 0:
-            Misc.log('Nub', 'registering key(ours=%s)=%s for %s' % (key, ours, cmd))
+            Misc.log('Nub', 'registering key(ours=%s)=%s for %s', key, ours, cmd)
         if ours and key in self.liveCommands:
             raise RuntimeError('Duplicate command key for %s: %s' % (self, key))
 
@@ -211,9 +339,54 @@ class ActorNub(CoreNub):
                           actorMid=mid,
                           bcastCmdInfo=False)
             self.__registerCmd(cmd, ours=False)
+            self.externalCmds[key] = time.time()
+            self.evictExternalCmds()
+            if self.externalCmdTimer is None:
+                self.scheduleExternalCmdEviction()
 
         return cmd
 
+    def evictExternalCmds(self):
+        """ Forget the least recently active external commands, until we have no more than
+        .maxExternalCmds, and none which have been silent for longer than .maxExternalCmdAge.
+        """
+
+        oldest = time.time() - self.maxExternalCmdAge
+        while self.externalCmds:
+            key, lastSeen = next(iter(self.externalCmds.items()))
+            if len(self.externalCmds) <= self.maxExternalCmds and lastSeen >= oldest:
+                break
+
+            del self.externalCmds[key]
+            self.liveCommands.pop(key, None)
+            self.evictedCmds += 1
+
+    def scheduleExternalCmdEviction(self):
+        """ Arrange to evict the least recently active external command when it gets too old,
+        so that an actor which goes quiet does not keep them forever. """
+
+        if self.externalCmdTimer is not None:
+            self.poller.removeTimer(self.externalCmdTimer)
+            self.externalCmdTimer = None
+
+        if self.externalCmds and self.maxExternalCmdAge > 0 and self.poller is not None:
+            lastSeen = next(iter(self.externalCmds.values()))
+            delay = max(lastSeen + self.maxExternalCmdAge - time.time(), 0.0) + 1.0
+            self.externalCmdTimer = self.poller.callMeIn(self.expireExternalCmds, delay)
+
+    def expireExternalCmds(self):
+        """ Timer callback: evict old external commands, then wait for the next oldest. """
+
+        self.externalCmdTimer = None
+        self.evictExternalCmds()
+        self.scheduleExternalCmdEviction()
+
+    def shutdown(self, **argv):
+        if self.externalCmdTimer is not None:
+            self.poller.removeTimer(self.externalCmdTimer)
+            self.externalCmdTimer = None
+        CoreNub.shutdown(self, **argv)
+
     def getCmdForReply(self, reply):
         """ Look for a command that matches the reply. Create one if none exists. """
 
@@ -222,18 +395,56 @@ class ActorNub(CoreNub):
         cmd = self.liveCommands.get(key, None)
         if cmd is None and self.replyCallback is None:
             cmd = self.__registerExternalCmd(reply['cid'], reply['mid'])
+        elif key in self.externalCmds:
+            self.externalCmds[key] = time.time()
+            self.externalCmds.move_to_end(key)
 
         if self.flagFinishesCommand(reply['flag']):
+            self.externalCmds.pop(key, None)
             if cmd:
                 del self.liveCommands[key]
+                self.forgetCoalescing(cmd)
 
             try:
                 del self.ourCommands[key]
             except BaseException:
                 pass
+            else:
+                # That freed an in-flight slot.
+                if self.cmdQueue:
+                    self.sendQueuedCommands()
 
         return cmd
 
+    def forgetCoalescing(self, cmd):
+        """ Stop attaching new commands to cmd. """
+
+        if cmd.cmd is not None and self.coalescingCmds.get(cmd.cmd.strip()) is cmd:
+            del self.coalescingCmds[cmd.cmd.strip()]
+
+    def dropCommand(self, cmd):
+        """ Forget about one of our commands, without waiting for the actor to finish it. """
+
+        if cmd.attachedTo is not None:
+            cmd.attachedTo.detach(cmd)
+            return
+        self.forgetCoalescing(cmd)
+
+        for i, entry in enumerate(self.cmdQueue):
+            if entry[2] is cmd:
+                del self.cmdQueue[i]
+                heapq.heapify(self.cmdQueue)
+                return
+
+        key = self.keyForCommand(cmd)
+        if self.liveCommands.get(key) is cmd:
+            del self.liveCommands[key]
+        if self.ourCommands.get(key) is cmd:
+            del self.ourCommands[key]
+
+        if self.cmdQueue:
+            self.sendQueuedCommands()
+
     def tasteReply(self, r):
         assert False, 'A reply was sent to an Actor(%s): %s' % (self, r)
 
@@ -253,7 +464,75 @@ class ActorNub(CoreNub):
 
         cmd.inform('actorCmds=%s,%d,%d' %
                    (Misc.qstr(self.name), len(self.liveCommands), len(self.ourCommands)))
+        cmd.inform('evictedCmds=%s,%d,%d' %
+                   (Misc.qstr(self.name), len(self.externalCmds), self.evictedCmds))
+        if self.maxInFlight > 0:
+            cmd.inform('actorQueue=%s,%d,%d' %
+                       (Misc.qstr(self.name), len(self.cmdQueue), self.maxInFlight))
 
         for id, ourCmd in self.ourCommands.items():
             cmd.inform('actorCmd=%s,%s,%s' %
                        (Misc.qstr(self.name), Misc.qstr(id), Misc.qstr(ourCmd)))
+
+
+if __name__ == '__main__':
+    import random
+
+    from tron.Hub.Command.Encoders.ASCIICmdEncoder import ASCIICmdEncoder
+    from tron.Hub.Reply.Decoders.ASCIIReplyDecoder import ASCIIReplyDecoder
+
+    # Soak check: three weeks of unsolicited replies, on a simulated clock. Most come
+    # from a few long-lived (cid, mid) pairs; the rest are one-offs which the actor
+    # only sometimes finishes. The external command bookkeeping must stay bounded.
+    #
+    class SimClock(object):
+        now = 0.0
+
+        def time(self):
+            return self.now
+
+    time = SimClock()  # noqa: F811 -- replaces the time module for our methods too.
+    g.xids = Misc.ID()
+    g.location = None
+    g.hubcmd = None
+
+    nub = ActorNub(None, name='soak', maxExternalCmds=500, maxExternalCmdAge=3600.0,
+                   encoder=ASCIICmdEncoder(), decoder=ASCIIReplyDecoder())
+
+    rng = random.Random(1)
+    nReplies = 0
+    maxLive = 0
+    mid = 1000
+    while time.now < 21 * 86400:
+        time.now += rng.expovariate(1 / 5.0)
+        if rng.random() < 0.8:
+            reply = {'cid': 0, 'mid': rng.randrange(5), 'flag': 'i'}
+        else:
+            mid += 1
+            reply = {'cid': 0, 'mid': mid, 'flag': rng.choice('iiiiiw:')}
+        nub.getCmdForReply(reply)
+        nReplies += 1
+        maxLive = max(maxLive, len(nub.liveCommands))
+
+    print('%d replies over %0.1f days: live=%d (max %d), external=%d, evicted=%d' %
+          (nReplies, time.now / 86400, len(nub.liveCommands), maxLive,
+           len(nub.externalCmds), nub.evictedCmds))
+    assert maxLive <= nub.maxExternalCmds + 1
+    assert len(nub.liveCommands) == len(nub.externalCmds)
+    assert all(('0', str(m)) in nub.liveCommands for m in range(5))
+
+    # And a burst of one-offs, well within maxExternalCmdAge, to exercise the LRU limit.
+    #
+    for i in range(2000):
+        time.now += 0.01
+        mid += 1
+        nub.getCmdForReply({'cid': 0, 'mid': mid, 'flag': 'i'})
+    print('after burst: live=%d, evicted=%d' % (len(nub.liveCommands), nub.evictedCmds))
+    assert len(nub.liveCommands) == nub.maxExternalCmds
+
+    # Then the actor goes quiet. The eviction timer alone must empty the bookkeeping.
+    #
+    time.now += nub.maxExternalCmdAge + 1
+    nub.expireExternalCmds()
+    print('after a quiet hour: live=%d, evicted=%d' % (len(nub.liveCommands), nub.evictedCmds))
+    assert len(nub.liveCommands) == 0 and len(nub.externalCmds) == 0
@@ -1,6 +1,9 @@
 __all__ = ['CommanderNub', 'AuthCommanderNub', 'StdinNub', 'AuthStdinNub']
 
-from tron import Misc, hub
+from collections import OrderedDict
+
+from tron import Misc, g, hub
+from tron.Hub.Reply.Reply import Reply
 from tron.Hub.Reply.ReplyTaster import ReplyTaster
 
 from .CoreNub import CoreNub
@@ -15,8 +18,10 @@ class CommanderNub(CoreNub):
         """
 
         KWArgs:
-           isUser    - if True, we should be listed as a logged-in user.
-           forceUser - override any automatically derived username.
+           isUser      - if True, we should be listed as a logged-in user.
+           forceUser   - override any automatically derived username.
+           changedOnly - if True, leave the keys whose values have not changed out of
+                         replies to other commanders' commands.
         """
 
         CoreNub.__init__(self, poller, **argv)
@@ -28,6 +33,7 @@ class CommanderNub(CoreNub):
         self.taster.setFilter((), (self.name, ), (self.name, ))
 
         self.isUser = argv.get('isUser', False)
+        self.changedOnly = argv.get('changedOnly', False)
 
         if 'forceUser' in argv:
             program, user = argv.get('forceUser').split('.')
@@ -41,7 +47,7 @@ class CommanderNub(CoreNub):
         """ Set our program and usernames. """
 
         Misc.log('CommandeNub.setNames',
-                 'setting name for %s to %s.%s' % (self, programName, username))
+                 'setting name for %s to %s.%s', self, programName, username)
 
         newName = hub.validateCommanderNames(self, programName, username)
         self.setName(newName)
@@ -49,10 +55,13 @@ class CommanderNub(CoreNub):
     def setName(self, newName):
         """ Change our username(s). """
 
+        oldName = self.name
         self.name = newName
         self.encoder.setName(self.name)
         self.decoder.setName(self.name)
 
+        hub.commanderRenamed(self, oldName)
+
     def copeWithInput(self, s):
         """ Incorporate new input: buffer it, then extract and operate each complete new command.
 
@@ -65,7 +74,7 @@ class CommanderNub(CoreNub):
         """
 
         if self.debug > 2:
-            Misc.log('Nub.copeWithInput', 'CommanderNub %s read: %r' % (self.name, s))
+            Misc.log('Nub.copeWithInput', 'CommanderNub %s read: %r', self.name, s)
 
         # Find and execute _every_ complete input.
         # The only time this function gets called is when new input comes in, so we
@@ -103,6 +112,16 @@ class CommanderNub(CoreNub):
         if intercepted:
             return
 
+        # Commanders which only want changed keys do not get the unchanged keys of
+        # other commanders' replies. Warnings and failures always go out whole.
+        #
+        if self.changedOnly and r.unchangedKeys:
+            if r.cmd.cmdrID != self.ID and r.flag not in 'wWfF!':
+                g.KVs.noteSuppressed(r.src, len(r.unchangedKeys))
+                r = r.changedReply()
+                if not r.KVs and not r.finishesCommand():
+                    return
+
         # Most replies get sent to all interested commanders. But we allow
         # the possibility of only sending to the commander; in that case,
         # the commander gets all replies and keys, but other commanders only get told
@@ -116,16 +135,57 @@ class CommanderNub(CoreNub):
             if self.log:
                 self.log.log(er, note='>')
         else:
-            Misc.log('CommanderNub.reply', 'not bcast; rID=%s selfID=%s' % (r.cmd.cmdrID, self.ID))
+            Misc.log('CommanderNub.reply', 'not bcast; rID=%s selfID=%s', r.cmd.cmdrID, self.ID)
             if r.finishesCommand():
                 er = self.encoder.encode(r, self, noKeys=True)
                 self.queueForOutput(er)
                 if self.log:
                     self.log.log(er, note='>')
 
+    def syncKeys(self, cmd, sources=None):
+        """ Send the current keys of some sources to just us, in a single write.
+
+        Each source's keys go out as one reply to cmd, from that source, so a new
+        client can fill its displays without asking each actor for them.
+
+        Args:
+           cmd     - the Command asking for the keys.
+           sources - the names of the sources to send. The default is all sources.
+
+        Returns:
+           - the number of sources sent.
+           - the number of keys sent.
+           - the list of requested sources which have no keys.
+        """
+
+        if sources is None:
+            sources = [source.name for source in g.KVs.sources.values()]
+
+        lines = []
+        nKeys = 0
+        missing = []
+        for name in sources:
+            source = g.KVs.sources.get(name)
+            if not source:
+                missing.append(name)
+                continue
+            KVs = OrderedDict([(kv.key, kv.val) for kv in source.kvs.values()])
+            r = Reply(cmd, 'i', KVs, src=source.name, bcast=False,
+                      asciiKeys='; '.join([kv.asASCII() for kv in source.kvs.values()]))
+            lines.append(self.encoder.encode(r, self))
+            nKeys += len(KVs)
+
+        if lines:
+            er = ''.join(lines)
+            self.queueForOutput(er)
+            if self.log:
+                self.log.log(er, note='>')
+
+        return len(lines), nKeys, missing
+
     def tasteReply(self, r):
         if self.debug > 3:
-            Misc.log('ActorNub.tasteReply', '%s tasting %s' % (self, r))
+            Misc.log('ActorNub.tasteReply', '%s tasting %s', self, r)
 
         if self.taster.taste(r):
             self.reply(r)
@@ -17,6 +17,13 @@ class NubAuth(object):
     NOT_CONNECTED = 'not connected'
     CONNECTING = 'connecting'
 
+    loginArgs = Parsing.ArgMatcher([('program', Parsing.dequote),
+                                    ('password', Parsing.dequote),
+                                    ('username', Parsing.dequote),
+                                    ('type', Parsing.dequote),
+                                    ('version', Parsing.dequote),
+                                    ('platform', Parsing.dequote)])
+
     def __init__(self, **argv):
         object.__init__(self)
 
@@ -62,12 +69,7 @@ class NubAuth(object):
         if self.state != self.CONNECTING or self.nonce is None:
             return 'unexpected login ignored.'
 
-        matched, unmatched, leftovers = cmd.match([('program', Parsing.dequote),
-                                                   ('password', Parsing.dequote),
-                                                   ('username', Parsing.dequote),
-                                                   ('type', Parsing.dequote),
-                                                   ('version', Parsing.dequote),
-                                                   ('platform', Parsing.dequote)])
+        matched, unmatched, leftovers = cmd.match(self.loginArgs)
 
         if 'program' not in matched or 'password' not in matched:
             return 'not all arguments to login were found.'
@@ -15,6 +15,9 @@ class ASCIIReplyDecoder(ReplyDecoder):
         self.cidFirst = argv.get('CIDfirst', True)
         self.stripChars = argv.get('stripChars', '')
 
+        # Only parse the keys when somebody needs them.
+        self.lazyKeys = argv.get('lazyKeys', True)
+
     def decode(self, buf, newData):
         """ Find and extract a single complete reply in the buf. Uses .EOL to
             recognize the end of a reply.
@@ -63,7 +66,7 @@ class ASCIIReplyDecoder(ReplyDecoder):
         # Make sure to consume unparseable junk up to the next EOL.
         #
         try:
-            r = parseASCIIReply(replyString, cidFirst=self.cidFirst)
+            r = parseASCIIReply(replyString, cidFirst=self.cidFirst, lazy=self.lazyKeys)
         except SyntaxError as e:
             Misc.log('ASCIIReplyDecoder', 'Parsing error from %s: %r' % (self.name, e))
             return None, buf
@@ -72,3 +75,49 @@ class ASCIIReplyDecoder(ReplyDecoder):
             Misc.log('Stdin.extractReply', 'extracted %r, returning %r' % (r, buf))
 
         return r, buf
+
+
+if __name__ == '__main__':
+    import time
+    from types import SimpleNamespace
+
+    from tron.Hub.KV.KVDict import KVDict
+    from tron.Hub.Reply.Encoders.ASCIIReplyEncoder import ASCIIReplyEncoder
+    from tron.Hub.Reply.Reply import Reply
+
+    # End-to-end benchmark: decode actor lines, register their keys, and encode them
+    # for a handful of commanders. Compare the eager/canonical path with the
+    # lazy/pass-through one.
+    #
+    lines = ['.hub 12 i ccdTemp=-100.2,-99.8; shutter="closed"; text="all is well"',
+             'tcc 45 i AxePos=121.234567,45.678901,12.345678; TCCStatus="TTT","NNN"',
+             'apo 3 i airTempPT=12.3; dewPoint=-2.1; humidity=34; windSpeed=5.6',
+             'jaeger 9 : fps_status=0x%x; robotIds=%s' % (1234, ','.join(map(str, range(500))))]
+    buf = '\n'.join(lines * 250) + '\n'
+    cmd = SimpleNamespace(cmdrCid='APO.Jim', cmdrMid=12, cmdrName='APO.Jim', actorName='apo',
+                          xid=1)
+
+    for lazy in False, True:
+        decoder = ASCIIReplyDecoder(CIDfirst=True, lazyKeys=lazy)
+        encoders = [ASCIIReplyEncoder(CIDfirst=True, EOL=eol, rawKeys=lazy)
+                    for eol in ('\n', '\n', '\r', '\r', '\n')]
+        kvs = KVDict()
+
+        n = 0
+        rest = buf
+        t0 = time.time()
+        while True:
+            d, rest = decoder.decode(rest, None)
+            if d is None:
+                break
+            if 'KVs' in d:
+                r = Reply(cmd, d['flag'], d['KVs'], src='apo')
+            else:
+                r = Reply(cmd, d['flag'], None, src='apo', rawKeys=d['rawKeys'])
+            kvs.setKVsFromReply(r)
+            for e in encoders:
+                e.encode(r, None)
+            n += 1
+        t1 = time.time()
+
+        print('lazy=%s: %d lines in %0.3fs: %0.0f lines/s' % (lazy, n, t1 - t0, n / (t1 - t0)))
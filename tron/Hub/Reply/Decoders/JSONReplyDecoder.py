@@ -0,0 +1,59 @@
+__all__ = ['JSONReplyDecoder']
+
+from tron import Misc
+from tron.Parsing import parseJSONReply
+
+from .ReplyDecoder import ReplyDecoder
+
+
+class JSONReplyDecoder(ReplyDecoder):
+    """ Decode replies sent as single lines of JSON, as modern actors can emit them.
+
+    The reply dictionary and its KVs are built directly from the decoded JSON,
+    without going through the ASCII keyword parser.
+    """
+
+    def __init__(self, **argv):
+        ReplyDecoder.__init__(self, **argv)
+
+        self.EOL = argv.get('EOL', '\n')
+        self.stripChars = argv.get('stripChars', '')
+
+    def decode(self, buf, newData):
+        """ Find and extract a single complete reply in the buf. Uses .EOL to
+            recognize the end of a reply.
+
+        Returns:
+          - a Reply instance. None if .EOL no found in buf.
+          - the content of buf with the first complete reply removed.
+
+        Always consumes input up to the first .EOL, if .EOL is found. If the line
+        cannot be decoded, a warning with a RawLine="full line" key is generated.
+        """
+
+        if newData:
+            buf += newData
+
+        eol = buf.find(self.EOL)
+
+        # No complete reply found. make sure to return
+        # the unmolested buffer.
+        #
+        if eol == -1:
+            return None, buf
+
+        replyString = buf[:eol]
+        buf = buf[eol + len(self.EOL):]
+
+        if self.debug > 2:
+            Misc.log('JSONReplyDecoder.decode', 'hoping to parse %r' % (replyString))
+
+        for c in self.stripChars:
+            replyString = replyString.replace(c, '')
+
+        r = parseJSONReply(replyString)
+
+        if self.debug > 3:
+            Misc.log('JSONReplyDecoder.decode', 'extracted %r, returning %r' % (r, buf))
+
+        return r, buf
@@ -1,4 +1,5 @@
 from .ASCIIReplyDecoder import ASCIIReplyDecoder
+from .JSONReplyDecoder import JSONReplyDecoder
 from .PyReplyDecoder import PyReplyDecoder
 from .RawReplyDecoder import RawReplyDecoder
 from .ReplyDecoder import ReplyDecoder
@@ -31,6 +31,11 @@ class ASCIIReplyEncoder(ReplyEncoder):
 
         self.CIDfirst = argv.get('CIDfirst', False)
 
+        # Should the keys text from actors be passed through as is, when it can be?
+        # If not, all keys are sent in their canonical form.
+        #
+        self.rawKeys = argv.get('rawKeys', False)
+
     def encodeSimple(self, r, nub, noKeys=False):
         """ Encode a reply for a given nub.
 
@@ -60,7 +65,7 @@ class ASCIIReplyEncoder(ReplyEncoder):
         if noKeys:
             keys = ''
         else:
-            keys = self.encodeKeys(r.src, r.KVs)
+            keys = r.keysAsASCII(self.EOL, raw=self.rawKeys)
 
         if self.noSrc:
             return '%s %s %s%s' % (id_s,
@@ -80,7 +85,7 @@ class ASCIIReplyEncoder(ReplyEncoder):
         if noKeys:
             keys = ''
         else:
-            keys = self.encodeKeys(r.src, r.KVs)
+            keys = r.keysAsASCII(self.EOL, raw=self.rawKeys)
 
         return '%s %s %s %s %s %s %s %s %s%s' % (cmd.cmdrName, cmd.cmdrMid, cmd.cmdrCid,
                                                  cmd.actorName, cmd.actorMid, cmd.actorCid, r.src,
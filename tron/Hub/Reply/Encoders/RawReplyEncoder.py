@@ -31,7 +31,7 @@ class RawReplyEncoder(ReplyEncoder):
             val = dequote(rawVal)
             Misc.log('RAWDEQUOTE', 'rawVal=%r val=%r' % (rawVal, val))
         else:
-            val = self.encodeKeys(r.src, r.KVs)
+            val = r.keysAsASCII()
 
         if val:
             return '%s%s' % (val, self.EOL)
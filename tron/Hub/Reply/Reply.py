@@ -4,6 +4,7 @@ import time
 from collections import OrderedDict
 
 from tron import Misc, Parsing
+from tron.Hub.KV.KVDict import kvAsASCII
 
 
 """
@@ -27,6 +28,12 @@ class Reply(Misc.Object):
            KVs  - parsed or unparsed keys. We accept OrderedDicts,
                   lists & tuples, and strings. The latter are parsed
                   into OrderedDicts.
+
+        Optional args:
+           rawKeys - the keys text exactly as an actor sent it. If KVs is None,
+                     rawKeys is only parsed when somebody needs .KVs
+           asciiKeys - the canonical ASCII form of KVs, if the caller already has it,
+                     e.g. from the KVs stored in the KVDict.
         """
 
         Misc.Object.__init__(self, **argv)
@@ -36,13 +43,36 @@ class Reply(Misc.Object):
         self.flag = flag
         self.bcast = bcast
 
-        if isinstance(KVs, OrderedDict):
-            self.KVs = KVs
+        # rawKeysOK gets set once we have parsed rawKeys and know that they
+        # can be passed on as they are.
+        self.rawKeys = argv.get('rawKeys', None)
+        self.rawKeysOK = False
+
+        if isinstance(KVs, OrderedDict) or (KVs is None and self.rawKeys is not None):
+            self._KVs = KVs
         else:
-            self.KVs = self.parseKVs(KVs)
+            self._KVs = self.parseKVs(KVs)
 
         self.src = argv.get('src', cmd.actorName)
 
+        # The ASCII renderings of our KVs, per escape string. Only built when
+        # some ASCII commander actually asks for them, and then only once.
+        self.asciiKeys = {}
+        if argv.get('asciiKeys', None) is not None:
+            self.asciiKeys[None] = argv['asciiKeys']
+
+        # The names of the keys whose values KVDict already had. See changedReply().
+        self.unchangedKeys = None
+        self._changedReply = None
+
+    @property
+    def KVs(self):
+        """ Our keys, as an OrderedDict. Parsed from .rawKeys the first time we are asked. """
+
+        if self._KVs is None and self.rawKeys is not None:
+            self._KVs, self.rawKeysOK = Parsing.parseReplyKeys(self.rawKeys)
+        return self._KVs
+
     def finishesCommand(self):
         """ Return true if the given flag finishes a command. """
 
@@ -51,6 +81,47 @@ class Reply(Misc.Object):
     def __str__(self):
         return 'Reply(cmd=%s flag=%s KVs=%s)' % (self.cmd, self.flag, self.KVs)
 
+    def changedReply(self):
+        """ Return a copy of ourselves without our unchanged keys, shared by all the
+        commanders which only want changed keys. """
+
+        if self._changedReply is None:
+            unchanged = self.unchangedKeys or ()
+            KVs = OrderedDict([(k, v) for k, v in self.KVs.items() if k not in unchanged])
+            self._changedReply = Reply(self.cmd, self.flag, KVs, bcast=self.bcast, src=self.src)
+
+        return self._changedReply
+
+    def keysAsASCII(self, escape=None, raw=False):
+        """ Return the canonical ASCII form of all our KVs, escaping the escape string.
+
+        The rendering is cached, so that all commanders using the same escape share it.
+
+        If raw is True and we were created from an actor's key text, return that text
+        as is, provided that it parsed cleanly and does not contain the escape string.
+        """
+
+        if raw and self.rawKeys is not None and self.KVs is not None and self.rawKeysOK:
+            if not escape or escape not in self.rawKeys:
+                return self.rawKeys
+
+        try:
+            return self.asciiKeys[escape]
+        except KeyError:
+            pass
+
+        # The unescaped form serves for any escape string which it does not contain.
+        canonical = self.asciiKeys.get(None)
+        if canonical is not None and escape not in canonical:
+            keys = canonical
+        elif self.KVs is None:
+            keys = ''
+        else:
+            keys = '; '.join([kvAsASCII(k, v, escape=escape) for k, v in self.KVs.items()])
+        self.asciiKeys[escape] = keys
+
+        return keys
+
     def parseKVs(self, kvl):
         """ Convert some form of keys to an OrderedDict.
 
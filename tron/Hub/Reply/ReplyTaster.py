@@ -1,6 +1,6 @@
 __all__ = ['ReplyTaster']
 
-from tron import Misc
+from tron import Misc, g
 
 
 class ReplyTaster(Misc.Object):
@@ -22,9 +22,16 @@ class ReplyTaster(Misc.Object):
     def listeningTo(self):
         return list(self.actors.keys()), list(self.cmdrs.keys()), list(self.sources.keys())
 
+    def filterChanged(self):
+        """ Forget the hub's cached idea of which sources anybody listens to. """
+
+        g.heardSources = {}
+
     def removeFromFilter(self, actors, cmdrs, sources):
         """ Remove a list of actors and commanders to accept Replys from. """
 
+        self.filterChanged()
+
         for i in actors:
             if i in self.actors:
                 del self.actors[i]
@@ -38,6 +45,8 @@ class ReplyTaster(Misc.Object):
     def addToFilter(self, actors, cmdrs, sources):
         """ Add a list of actors and commanders to accept Replys from. """
 
+        self.filterChanged()
+
         for i in actors:
             self.actors[i] = True
         for c in cmdrs:
@@ -57,9 +66,13 @@ class ReplyTaster(Misc.Object):
     def taste(self, reply):
         """ Do we accept the given Reply? """
 
-        cmd = reply.cmd
+        return self.tastes(reply.cmd, reply.src)
+
+    def tastes(self, cmd, src):
+        """ Would we accept a Reply to cmd from src? Lets callers ask before building one. """
+
         return cmd.cmdrName in self.cmdrs \
             or cmd.cmdrID in self.cmdrs \
             or '*' in self.sources or '*' in self.actors \
             or cmd.actorName in self.actors \
-            or reply.src in self.sources
+            or src in self.sources
@@ -32,7 +32,7 @@ class IOHandler(Misc.Object):
 
         self.poller = poller
 
-        Misc.log('IOHandler.init', 'IOHandler(argv=%s)' % (argv))
+        Misc.log('IOHandler.init', 'IOHandler(argv=%s)', argv)
 
         # The IO size tweaks would mean something for slow network links.
         #
@@ -66,7 +66,7 @@ class IOHandler(Misc.Object):
         """ Unregister ourselves """
 
         why = argv.get('why', 'just cuz')
-        Misc.log('IOhandler.ioshutdown', 'what=%s why=%s' % (self, why))
+        Misc.log('IOhandler.ioshutdown', 'what=%s why=%s', self, why)
 
         self.setOutputFile(None)
         self.setInputFile(None)
@@ -84,7 +84,7 @@ class IOHandler(Misc.Object):
         Register the new one for input. """
 
         if self.debug > 2:
-            Misc.log('IOHandler.setInput', '%s changing input %s to %s' % (self, self.in_f, f))
+            Misc.log('IOHandler.setInput', '%s changing input %s to %s', self, self.in_f, f)
 
         # Detach and possibly close existing .in_f
         #
@@ -112,8 +112,8 @@ class IOHandler(Misc.Object):
         """
 
         if self.debug > 2:
-            Misc.log('IOHandler.setOutput', '%s changing output %s to %s. queue=%s' %
-                     (self, self.out_f, f, self.outQueue))
+            Misc.log('IOHandler.setOutput',
+                     '%s changing output %s to %s. queue=%s', self, self.out_f, f, self.outQueue)
 
         if self.out_f is not None:
             self.poller.removeOutput(self)
@@ -192,8 +192,7 @@ class IOHandler(Misc.Object):
 
             if self.debug > 4:
                 Misc.log('IOHandler.queueForOutput',
-                         'appended %r to queue (len=%d) of %s' %
-                         (s, len(self.outQueue), self))
+                         'appended %r to queue (len=%d) of %s', s, len(self.outQueue), self)
             if mustRegister:
                 self.poller.addOutput(self)
         finally:
@@ -229,7 +228,7 @@ class IOHandler(Misc.Object):
             readIn = ''
 
         if self.debug > 4:
-            Misc.log('IOHandler.readInput', 'read len=%d %r' % (len(readIn), readIn[:50]))
+            Misc.log('IOHandler.readInput', 'read len=%d %r', len(readIn), readIn[:50])
 
         # I/O error: by being called, we are told that we have input. But the read
         # showed no available input.
@@ -279,21 +278,21 @@ class IOHandler(Misc.Object):
 
             wlen = min(len(qtop), self.tryToWrite)
             if self.debug > 5:
-                Misc.log('IOHandler.mayOutput', 'writing len=%d wlen=%d %r' %
-                         (len(qtop), wlen, qtop[:min(wlen, 50)]))
+                Misc.log('IOHandler.mayOutput',
+                         'writing len=%d wlen=%d %r', len(qtop), wlen, qtop[:min(wlen, 50)])
 
             try:
                 wrote = os.write(self.out_fd, qtop[:wlen].encode())
             except IOError as e:
-                Misc.log('IOHandler.mayOutput', 'socket exception %r' % (e, ))
+                Misc.log('IOHandler.mayOutput', 'socket exception %r', e)
                 self.shutdown(why=str(e))
                 return
             except OSError as e:
-                Misc.log('IOHandler.mayOutput', 'os exception %r' % (e, ))
+                Misc.log('IOHandler.mayOutput', 'os exception %r', e)
                 self.shutdown(why=str(e))
                 return
             except Exception as e:
-                Misc.log('IOHandler.mayOutput', 'unhandled exception %r' % (e, ))
+                Misc.log('IOHandler.mayOutput', 'unhandled exception %r', e)
                 self.shutdown(why=str(e))
                 return
 
@@ -324,7 +323,7 @@ class IOHandler(Misc.Object):
                     break
 
                 if self.debug > 5:
-                    Misc.log('IOHandler.mayOutput', 'queue len=%d' % (len(self.outQueue)))
+                    Misc.log('IOHandler.mayOutput', 'queue len=%d', len(self.outQueue))
 
                 # Quit if we only write one item or if we have written alot.
                 #
@@ -10,6 +10,8 @@ __all__ = ['PollHandler']
     invoked. I.e. PollHandler does not read/write.
 """
 
+import heapq
+import itertools
 import os
 import select
 import time
@@ -63,7 +65,11 @@ class PollHandler(Misc.Object):
         self.files = {}
         self.lock = Lock()
 
+        # A heap of (time, sequence, timer) tuples, and how many of those timers
+        # have been cancelled.
         self.timedCallbacks = []
+        self.timerSeq = itertools.count()
+        self.cancelledTimers = 0
         self.cbLock = Lock()
 
         self.timeout = argv.get('timeout', 0.5)
@@ -95,31 +101,51 @@ class PollHandler(Misc.Object):
            - whether we have arranged for the loop to be restarted.
         """
 
+        timer['cancelled'] = False
+        timer['queued'] = True
+
         self.cbLock.acquire()
-        self.timedCallbacks.append((timer['time'], timer))
-        self.timedCallbacks.sort()
+
+        # The sequence number keeps timers with the same time in order, and keeps
+        # heapq from ever trying to compare two timer dictionaries.
+        #
+        heapq.heappush(self.timedCallbacks, (timer['time'], next(self.timerSeq), timer))
 
         # Kick the loop if necessary
         #
-        if self.loopback and self.timedCallbacks[0][1] == timer:
-            os.write(self.loopback, 'I')
+        kicked = bool(self.loopback and self.timedCallbacks[0][2] is timer)
+        if kicked:
+            os.write(self.loopback, b'I')
         self.cbLock.release()
 
+        return kicked
+
     def removeTimer(self, timer):
         """ Remove an existing timer.
 
+        The timer is only marked as cancelled: it is dropped when it reaches the
+        head of the queue. That keeps removal cheap when many timers are live. Once
+        most of the queue is cancelled timers, it is rebuilt without them.
         """
+
         self.cbLock.acquire()
-        self.timedCallbacks.remove((timer['time'], timer))
+        if timer.get('queued') and not timer['cancelled']:
+            timer['cancelled'] = True
+            self.cancelledTimers += 1
+            if self.cancelledTimers > 100 and self.cancelledTimers > len(self.timedCallbacks) // 2:
+                self.timedCallbacks = [e for e in self.timedCallbacks if not e[2]['cancelled']]
+                heapq.heapify(self.timedCallbacks)
+                self.cancelledTimers = 0
         self.cbLock.release()
 
     def callMeIn(self, callback, delay):
-        """ Arrange to call callback after delay seconds. """
+        """ Arrange to call callback() after delay seconds. """
 
-        self.cbLock.acquire()
-        self.timedCallbacks.append((time.time() + delay, callback))
-        self.timedCallbacks.sort()
-        self.cbLock.release()
+        timer = {'time': time.time() + delay,
+                 'callback': lambda t: callback()}
+        self.addTimer(timer)
+
+        return timer
 
     def startLoopback(self):
         """ Create a pipe that the poller listens to, that we can write to when the
@@ -145,15 +171,14 @@ class PollHandler(Misc.Object):
 
         fd = obj.getInputFd()
         if fd is None or fd == -1:
-            Misc.log('IOHandler.addInput', 'fd for obj=%s was %s!' % (obj, fd))
+            Misc.log('IOHandler.addInput', 'fd for obj=%s was %s!', obj, fd)
             return
 
         self.lock.acquire()
 
         pollInfo = self.files.get(fd, None)
         if self.debug > 2:
-            Misc.log('Poll.registry',
-                     'adding input for fd=%r obj=%s info=%r' % (fd, obj, pollInfo))
+            Misc.log('Poll.registry', 'adding input for fd=%r obj=%s info=%r', fd, obj, pollInfo)
 
         if pollInfo:
             eventMask = pollInfo.get('eventMask', 0)
@@ -176,9 +201,9 @@ class PollHandler(Misc.Object):
             os.write(self.loopback, 'I')
 
         if self.debug > 2:
-            Misc.log(
-                'Poll.registry',
-                '%s added input %r(%s): %s' % (id(self), fd, self.flagNames(eventMask), repr(obj)))
+            Misc.log('Poll.registry',
+                     '%s added input %r(%s): %s',
+                     id(self), fd, self.flagNames(eventMask), repr(obj))
 
         return lastHandler
 
@@ -197,15 +222,14 @@ class PollHandler(Misc.Object):
         """
         fd = obj.getOutputFd()
         if fd is None or fd == -1:
-            Misc.log('Poll.registry', 'Cannot add output for fd=%r' % (fd, ))
+            Misc.log('Poll.registry', 'Cannot add output for fd=%r', fd)
             return
 
         self.lock.acquire()
         pollInfo = self.files.get(fd, None)
 
         if self.debug > 2:
-            Misc.log('Poll.registry',
-                     'adding output for fd=%r obj=%s info=%r' % (fd, obj, pollInfo))
+            Misc.log('Poll.registry', 'adding output for fd=%r obj=%s info=%r', fd, obj, pollInfo)
 
         if pollInfo:
             lastHandler = pollInfo.get('outputHandler', None)
@@ -232,9 +256,9 @@ class PollHandler(Misc.Object):
             os.write(self.loopback, 'O')
 
         if self.debug > 2:
-            Misc.log(
-                'Poll.registry', '%s added output %r(%s): obj=%s info=%s' %
-                (id(self), fd, self.flagNames(eventMask), obj, pollInfo))
+            Misc.log('Poll.registry',
+                     '%s added output %r(%s): obj=%s info=%s',
+                     id(self), fd, self.flagNames(eventMask), obj, pollInfo)
 
         return lastHandler
 
@@ -245,14 +269,14 @@ class PollHandler(Misc.Object):
         """ Unregister an input. """
 
         if fd is None or fd == -1:
-            Misc.log('Poll.registry', 'Cannot remove input for fd=%r' % (fd, ))
+            Misc.log('Poll.registry', 'Cannot remove input for fd=%r', fd)
             return
 
         self.lock.acquire()
 
         pollInfo = self.files.get(fd, None)
         if self.debug > 2:
-            Misc.log('Poll.registry', 'removing input for fd=%r info=%r' % (fd, pollInfo))
+            Misc.log('Poll.registry', 'removing input for fd=%r info=%r', fd, pollInfo)
 
         if fd is None:
             Misc.log('Poll.registry', 'cannot change input for fd=None')
@@ -264,7 +288,7 @@ class PollHandler(Misc.Object):
             eventMask &= ~select.POLLIN
         else:
             Misc.log('Poll.registry',
-                     'removeInput clearing all IO for unregistered object fd=%r.' % (fd))
+                     'removeInput clearing all IO for unregistered object fd=%r.', fd)
             self.lock.release()
             return
 
@@ -274,19 +298,19 @@ class PollHandler(Misc.Object):
             self.poller.register(fd, eventMask)
             if self.debug > 2:
                 Misc.log('Poll.registry',
-                         'removed input %r and set mask to %s' % (fd, self.flagNames(eventMask)))
+                         'removed input %r and set mask to %s', fd, self.flagNames(eventMask))
         else:
-            Misc.log('Poll.registry', 'entirely removed (via in) fd=%s' % (fd))
+            Misc.log('Poll.registry', 'entirely removed (via in) fd=%s', fd)
 
             try:
                 self.poller.unregister(fd)
             except Exception as e:
                 Misc.log('Poll.registry',
-                         'removeInput poller could not unregister fd=%s err=%s' % (fd, e))
+                         'removeInput poller could not unregister fd=%s err=%s', fd, e)
             try:
                 del self.files[fd]
             except Exception as e:
-                Misc.log('Poll.registry', 'removeInput could not delete fd=%s err=%s' % (fd, e))
+                Misc.log('Poll.registry', 'removeInput could not delete fd=%s err=%s', fd, e)
 
         self.lock.release()
 
@@ -304,7 +328,7 @@ class PollHandler(Misc.Object):
 
         pollInfo = self.files.get(fd, None)
         if self.debug > 2:
-            Misc.log('Poll.registry', 'removing output for fd=%r info=%r' % (fd, pollInfo))
+            Misc.log('Poll.registry', 'removing output for fd=%r info=%r', fd, pollInfo)
 
         if fd is None:
             Misc.log('Poll.registry', 'cannot change output for fd=None')
@@ -316,7 +340,7 @@ class PollHandler(Misc.Object):
             eventMask &= ~select.POLLOUT
         else:
             Misc.log('Poll.registry',
-                     'removeOutput clearing all IO for unregistered object fd=%r' % (fd))
+                     'removeOutput clearing all IO for unregistered object fd=%r', fd)
             self.lock.release()
             return
 
@@ -326,21 +350,20 @@ class PollHandler(Misc.Object):
             self.poller.register(fd, eventMask)
 
             if self.debug > 2:
-                Misc.log(
-                    'Poll.registry',
-                    'removed output fd=%s and set mask to %s' % (fd, self.flagNames(eventMask)))
+                Misc.log('Poll.registry',
+                         'removed output fd=%s and set mask to %s', fd, self.flagNames(eventMask))
         else:
-            Misc.log('Poll.registry', 'entirely removing (via out) fd=%s' % (fd))
+            Misc.log('Poll.registry', 'entirely removing (via out) fd=%s', fd)
             try:
                 self.poller.unregister(fd)
             except Exception as e:
                 Misc.log('Poll.registry',
-                         'removeOutput poller could not unregister fd=%s err=%s' % (fd, e))
+                         'removeOutput poller could not unregister fd=%s err=%s', fd, e)
 
             try:
                 del self.files[fd]
             except Exception as e:
-                Misc.log('Poll.registry', 'removeOutput could not delete fd=%s err=%s' % (fd, e))
+                Misc.log('Poll.registry', 'removeOutput could not delete fd=%s err=%s', fd, e)
 
         self.lock.release()
 
@@ -392,16 +415,16 @@ class PollHandler(Misc.Object):
         while True:
             if self.debug > 7:
                 Misc.log('PollHandler.run',
-                         'loop, threaded=%s, id=%s' % (bool(self.looper is not None), id(self)))
+                         'loop, threaded=%s, id=%s', bool(self.looper is not None), id(self))
                 if self.debug > 8:
-                    Misc.log('PollHandler.run', 'files=%s' % (self.fileNames()))
+                    Misc.log('PollHandler.run', 'files=%s', self.fileNames())
 
             # Calculate the proper timeout. Basically, use the loop default
             # or the next item in .timedCallbacks
             timeout = self.timeout
             self.cbLock.acquire()
             if self.timedCallbacks != []:
-                nextTick, nextTimer = self.timedCallbacks[0]
+                nextTick = self.timedCallbacks[0][0]
 
                 now = time.time()
                 if nextTick - now < self.timeout:
@@ -413,18 +436,17 @@ class PollHandler(Misc.Object):
             try:
                 events = self.poller.poll(timeout * 1000.0)
             except (IOError, OSError) as e:
-                Misc.log('PollHandler.run', 'poll trying to clean up: %s' % (e, ))
+                Misc.log('PollHandler.run', 'poll trying to clean up: %s', e)
                 try:
                     fd, eString = e
                     self.removeOutputFd(fd)
                     self.removeInputFd(fd)
                 except BaseException:
-                    Misc.log('PollHandler.run',
-                             'poll failed with unknown error exception: %s' % (e, ))
+                    Misc.log('PollHandler.run', 'poll failed with unknown error exception: %s', e)
             except Exception as e:
-                Misc.log('PollHandler.run', 'poll failed with: %s (%s)' % (e, type(e)))
+                Misc.log('PollHandler.run', 'poll failed with: %s (%s)', e, type(e))
                 if isinstance(e, type((), )) and len(e) == 2:
-                    Misc.log('PollHandler.run', 'poll trying to clean up mess: %s' % (e, ))
+                    Misc.log('PollHandler.run', 'poll trying to clean up mess: %s', e)
                     fd, errString = e
                     self.removeOutputFd(fd)
                     self.removeInputFd(fd)
@@ -447,20 +469,20 @@ class PollHandler(Misc.Object):
                 now = time.time()
                 timers = []
                 self.cbLock.acquire()
-                for i in range(len(self.timedCallbacks)):
-                    try:
-                        tick, timer = self.timedCallbacks[i]
-                    except IndexError:
-                        break
-
-                    if tick > now:
-                        break
-                    timers.append(timer)
-                    del self.timedCallbacks[i]
+                while self.timedCallbacks and self.timedCallbacks[0][0] <= now:
+                    tick, seq, timer = heapq.heappop(self.timedCallbacks)
+                    timer['queued'] = False
+                    if timer['cancelled']:
+                        self.cancelledTimers -= 1
+                    else:
+                        timers.append(timer)
                 self.cbLock.release()
 
                 for timer in timers:
-                    timer['callback'](timer)
+                    try:
+                        timer['callback'](timer)
+                    except Exception as e:
+                        Misc.tback('PollHandler.run', e)
 
             # Walk through all new events, and fire on all of them. Round-robinning provides
             # some simple protection against the worst starvation.
@@ -469,17 +491,16 @@ class PollHandler(Misc.Object):
                 fd, flag = event
 
                 if self.debug > 4:
-                    Misc.log('PollHandler.run', 'got fd=%s events=%s' % (fd, self.flagNames(flag)))
+                    Misc.log('PollHandler.run', 'got fd=%s events=%s', fd, self.flagNames(flag))
 
                 if flag & ~(select.POLLIN | select.POLLOUT):
-                    Misc.log(
-                        'PollHandler.run',
-                        'poll got exception flags: fd=%r, flag=%s' % (fd, self.flagNames(flag)))
+                    Misc.log('PollHandler.run',
+                             'poll got exception flags: fd=%r, flag=%s', fd, self.flagNames(flag))
 
                 try:
                     d = self.files[fd]
                 except KeyError:
-                    Misc.log('PollHandler.run', 'invalid file on poll: %s' % (repr(fd)))
+                    Misc.log('PollHandler.run', 'invalid file on poll: %s', repr(fd))
 
                     continue
 
@@ -513,7 +534,7 @@ class PollHandler(Misc.Object):
                     # discover the error and act on it.
                     #
                     Misc.log('PollHandler.run',
-                             'HUP/ERR (%s) on poll: %s' % (self.flagNames(flag), repr(fd)))
+                             'HUP/ERR (%s) on poll: %s', self.flagNames(flag), repr(fd))
                     outputHandler = d.get('outputHandler', None)
                     inputHandler = d.get('inputHandler', None)
                     if outputHandler:
@@ -525,7 +546,7 @@ class PollHandler(Misc.Object):
                     # I don't know what I'm doing here. -- Misc
                     #
                     Misc.log('PollHandler.run',
-                             'NVAL (%s) on poll: %s' % (self.flagNames(flag), repr(fd)))
+                             'NVAL (%s) on poll: %s', self.flagNames(flag), repr(fd))
 
                     outputHandler = d.get('outputHandler', None)
                     inputHandler = d.get('inputHandler', None)
@@ -1,7 +1,25 @@
-__all__ = ['setID', 'setLogdir', 'enableLoggingFor', 'disableLoggingFor',
-           'isoTS', 'log', 'error']
+__all__ = ['setID', 'setLogdir', 'enableLoggingFor', 'disableLoggingFor', 'setLoggingFor',
+           'isEnabled', 'isoTS', 'log', 'error', 'startLogWriter', 'stopLogWriter', 'flushLog']
 
+""" The hub log.
+
+    log(system, fmt, *args) only formats fmt % args if the system's lines are
+    written at all, and isEnabled(system) tells callers whether it is worth
+    computing expensive arguments. Systems are enabled unless disabled, by name
+    or by disabling 'default'.
+
+    By default every log() call writes and flushes its line before returning.
+    After startLogWriter(), log() only formats the line and queues it, and a
+    background thread writes all the queued lines in one go every flushInterval
+    seconds. If maxPending lines pile up, the next log() call writes them itself,
+    so the queue stays bounded and nothing is dropped. The queue is drained before
+    a log file is rolled over, by stopLogWriter(), and at exit.
+"""
+
+import atexit
 import os
+import threading
+from collections import deque
 from math import modf
 from time import gmtime, strftime, time
 
@@ -22,6 +40,15 @@ rolloverOffset = -0.3 * (24 * 3600)  # Fermi MJD offset.
 rolloverChunk = 24 * 3600
 rolloverTime = 0
 
+# The formatted second of the last timestamp, as (second, text).
+_stampCache = (None, '')
+
+# Lines queued for the writer thread, and the lock held while writing to logfile.
+pending = deque()
+maxPending = 10000
+writeLock = threading.RLock()
+writer = None
+
 
 def setID(newID):
     global logID
@@ -50,6 +77,15 @@ def setLoggingFor(system, level):
         systems[system] = DISABLED
 
 
+def isEnabled(system):
+    """ Would log() write a line for system? """
+
+    state = systems.get(system, UNDEFINED)
+    if state == UNDEFINED:
+        state = systems.get('default', state)
+    return state != DISABLED
+
+
 def isoTS(t=None, format='%Y-%m-%d %H:%M:%S', zone='Z'):
     """ Return a proper ISO timestamp for t, or now if t==None. """
 
@@ -63,15 +99,36 @@ def isoTS(t=None, format='%Y-%m-%d %H:%M:%S', zone='Z'):
         + '.%03d%s' % (1000 * modf(t)[0], zone)
 
 
+def _stamp(t):
+    """ Return isoTS(t), formatting the date and time only once per second. """
+
+    global _stampCache
+
+    second = int(t)
+    cachedSecond, text = _stampCache
+    if second != cachedSecond:
+        text = strftime('%Y-%m-%d %H:%M:%S', gmtime(second))
+        _stampCache = (second, text)
+
+    return '%s.%03dZ' % (text, 1000 * (t - second))
+
+
 def rollover(t):
     global logfile
     global logfileName
     global rolloverTime
 
-    if t > rolloverTime:
-        logfile = None
+    # Hold the writer thread off while we switch files.
+    with writeLock:
+        if t > rolloverTime:
+            # Queued lines belong in the old file.
+            if logfile is not None:
+                flushLog()
+            logfile = None
+
+        if logfile is not None:
+            return
 
-    if logfile is None:
         # Set next rollover time.
         rolloverTime = t - t % rolloverChunk + rolloverChunk + rolloverOffset
 
@@ -87,16 +144,12 @@ def rollover(t):
             os.symlink(logfileName, currentName)
         except BaseException:
             pass
-        log('log', 'next rollover is at %d (%s)' % (rolloverTime, isoTS(rolloverTime)))
 
+    log('log', 'next rollover is at %d (%s)' % (rolloverTime, isoTS(rolloverTime)))
 
-def log(system, detail, state=None):
-    now = time()
-    nowStamp = isoTS(now)
-    rollover(now)
 
-    # if not hasattr(globals(), 'logfile'):
-    #    logfile = sys.stderr
+def log(system, detail, *args, state=None):
+    """ Log detail, or detail % args if there are any args, for system. """
 
     # If the logging state has not explicitely been enabled or disabled,
     # print the notice, but mark the system name with a '?'
@@ -107,10 +160,151 @@ def log(system, detail, state=None):
     if state == UNDEFINED:
         state = systems.get('default', state)
 
-    if state != DISABLED:
-        logfile.write('%s %s %s %s %s\n' % (nowStamp, logID, state, system, detail))
+    if state == DISABLED:
+        return
+
+    now = time()
+    if now > rolloverTime or logfile is None:
+        rollover(now)
+
+    # if not hasattr(globals(), 'logfile'):
+    #    logfile = sys.stderr
+
+    if args:
+        detail = detail % args
+
+    line = '%s %s %s %s %s\n' % (_stamp(now), logID, state, system, detail)
+    if writer is None:
+        logfile.write(line)
         logfile.flush()
+    else:
+        pending.append(line)
+        if len(pending) >= maxPending:
+            flushLog()
+
+
+def flushLog():
+    """ Write and flush all the queued lines. """
+
+    with writeLock:
+        lines = []
+        try:
+            while True:
+                lines.append(pending.popleft())
+        except IndexError:
+            pass
+
+        if lines and logfile is not None:
+            logfile.write(''.join(lines))
+            logfile.flush()
+
+
+class LogWriter(threading.Thread):
+    """ Write the queued log lines every flushInterval seconds, until stopped. """
+
+    def __init__(self, flushInterval):
+        threading.Thread.__init__(self, name='LogWriter', daemon=True)
+        self.flushInterval = flushInterval
+        self.stopping = threading.Event()
+
+    def run(self):
+        while not self.stopping.wait(self.flushInterval):
+            try:
+                flushLog()
+            except Exception:
+                pass
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+
+def startLogWriter(flushInterval=0.2, queueSize=10000):
+    """ Write the log from a background thread. See the module doc.
+
+    Args:
+       flushInterval - how often to write the queued lines, in seconds.
+       queueSize     - how many lines may be queued before log() writes them itself.
+    """
+
+    global writer
+    global maxPending
+
+    stopLogWriter()
+
+    maxPending = queueSize
+    writer = LogWriter(flushInterval)
+    writer.start()
+
+
+def stopLogWriter():
+    """ Go back to writing each line as it is logged, after writing any queued lines. """
+
+    global writer
+
+    if writer is not None:
+        writer.stop()
+        flushLog()
+        writer = None
+    flushLog()
+
+
+atexit.register(stopLogWriter)
 
 
 def error(*args):
-    log(*args, **{'state': ERROR})
+    log(*args, state=ERROR)
+
+
+if __name__ == '__main__':
+    import sys
+    import tempfile
+
+    # Time log() as the hub's event loop sees it, writing each line itself and
+    # leaving the writing to the LogWriter thread.
+    #
+    nLines = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    setLogdir(tempfile.mkdtemp())
+    setID('logtest')
+    enableLoggingFor('test')
+
+    for mode in ('sync', 'async'):
+        if mode == 'async':
+            startLogWriter()
+        times = []
+        t0 = time()
+        for i in range(nLines):
+            t = time()
+            log('test', 'reply %d from tcc: AxePos=121.8734,63.4521,-12.0032' % (i))
+            times.append(time() - t)
+        dt = time() - t0
+        stopLogWriter()
+
+        times.sort()
+        print('%-5s: %0.2fus per line; p99 %0.2fus, max %0.0fus' %
+              (mode, dt / nLines * 1e6, times[int(nLines * 0.99)] * 1e6, times[-1] * 1e6))
+
+    with open(os.path.join(logfileDir, logID, logfileName)) as f:
+        lines = f.readlines()
+    assert len(lines) == 2 * nLines + 1, len(lines)
+    assert lines[-1].split(' ', 2)[1].endswith('Z') and 'reply %d ' % (nLines - 1) in lines[-1]
+    print('all %d lines written, in order' % (len(lines)))
+
+    for t in (1700000000.0, 1700000000.9996, 1700000001.25, 1234.5678):
+        assert _stamp(t) == isoTS(t), (t, _stamp(t), isoTS(t))
+
+    # Compare formatting the line before calling log() with leaving it to log(),
+    # for a system which is not being logged.
+    #
+    disableLoggingFor('quiet')
+    actorName, argv = 'tcc', {'cid': 12, 'mid': 345, 'cmd': 'axis status'}
+    for mode in ('eager', 'lazy'):
+        t0 = time()
+        for i in range(nLines):
+            if mode == 'eager':
+                log('quiet', 'actorName %s sending %s' % (actorName, argv))
+            else:
+                log('quiet', 'actorName %s sending %s', actorName, argv)
+        dt = time() - t0
+        print('%-5s: %0.3fus per disabled line' % (mode, dt / nLines * 1e6))
+    assert not isEnabled('quiet') and isEnabled('test')
@@ -33,7 +33,7 @@ def acceptTUI(in_f, out_f, addr=None):
     # os.system("/usr/bin/sudo /usr/local/bin/www-access add %s" % (otherIP))
 
     d = ASCIICmdDecoder(needCID=False, EOL='\r\n', debug=1)
-    e = ASCIIReplyEncoder(EOL='\r', simple=True, debug=1, CIDfirst=True)
+    e = ASCIIReplyEncoder(EOL='\r', simple=True, debug=1, CIDfirst=True, rawKeys=True)
     c = AuthStdinNub(g.poller,
                      in_f,
                      out_f,
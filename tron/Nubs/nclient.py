@@ -21,7 +21,7 @@ def acceptStdin(in_f, out_f, addr=None):
     fullname = '%s_%d' % (name, nubID)
 
     d = ASCIICmdDecoder(needCID=True, needMID=True, EOL='\n', hackEOL=True, name=name, debug=2)
-    e = ASCIIReplyEncoder(CIDfirst=True, name=name, debug=2)
+    e = ASCIIReplyEncoder(CIDfirst=True, name=name, rawKeys=True, debug=2)
     c = StdinNub(g.poller,
                  in_f,
                  out_f,
@@ -1,4 +1,5 @@
 from .args import *
 from .dequote import *
 from .Exceptions import *
+from .jsonkeys import *
 from .keys import *
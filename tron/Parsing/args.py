@@ -1,4 +1,4 @@
-__all__ = ['parseArgs', 'match']
+__all__ = ['parseArgs', 'match', 'ArgMatcher']
 
 import re
 from collections import OrderedDict
@@ -27,6 +27,28 @@ noarg_re = re.compile(
   (?P<rest>.*)                  # Match eveything after the WS""", re.IGNORECASE | re.VERBOSE)
 
 
+# The single-pass version of parseArg(), used by parseArgs(). Matches, in order:
+#   - key=value, where value is a (possibly unterminated) string or runs up to the
+#     next whitespace, which is also consumed,
+#   - a bare word,
+#   - the end of the input.
+#
+args_re = re.compile(
+    r"""
+  \s*
+  (?:
+    (?P<key>[a-z_][a-z0-9_-]*)\s*=\s*
+    (?:
+      (?P<string>"(?:[^"\\]|\\.)*"       # A complete string
+                |'(?:[^'\\]|\\.)*')
+    | (?P<open>["'])                      # The start of an unterminated string
+    | (?P<bare>[^\ \t\r\n\x0b\x0c]*)[\ \t\r\n\x0b\x0c]?
+    )
+  | (?P<word>\S+)\s*
+  | \Z
+  )""", re.IGNORECASE | re.VERBOSE | re.DOTALL)
+
+
 def eatAVee(s):
     """ Match a keyword value -- a possibly space-padded value ended by a
     whitespace, a comma, or a semicolon.
@@ -94,6 +116,28 @@ def parseArg(s):
     return K, val, rest
 
 
+def _parseArgsSlow(s):
+    """ The original, slicing, implementation of parseArgs(). Still used for text
+    containing newlines, and as the reference for parseArgs(). """
+
+    KVs = OrderedDict()
+    rest = s
+
+    while True:
+        try:
+            key, values, rest = parseArg(rest)
+        except ParseException as e:
+            e.setKVs(KVs)
+            raise
+
+        if key is None:
+            break
+
+        KVs[key] = values
+
+    return KVs
+
+
 def parseArgs(s):
     """ Parse a string of command arguments into an OrderedDict .
 
@@ -113,78 +157,167 @@ def parseArgs(s):
              }
     """
 
+    if '\n' in s:
+        return _parseArgsSlow(s)
+
     KVs = OrderedDict()
-    rest = s
+    argMatch = args_re.match
+    end = len(s)
+    pos = 0
 
     while True:
-        try:
-            key, values, rest = parseArg(rest)
-        except ParseException as e:
-            e.setKVs(KVs)
-            raise
-
-        if key is None:
+        m = argMatch(s, pos)
+        pos = m.end()
+        key, string, quote, bare, word = m.group('key', 'string', 'open', 'bare', 'word')
+
+        if key is not None:
+            if string is not None:
+                KVs[key] = string
+            elif bare is not None:
+                KVs[key] = bare
+            else:
+                # Close an unterminated string, just as eatAString() does.
+                val = s[m.start('open'):]
+                escaping = val[-1] == '\\' and (len(val) - len(val.rstrip('\\'))) % 2 == 1
+                Misc.log('eatAString', 'adding closing section (esc=%s) to string %r' %
+                         (escaping, val))
+                if escaping:
+                    val = '%s\\%s' % (val, quote)
+                else:
+                    val += quote
+                KVs[key] = val
+                pos = end
+        elif word is not None:
+            KVs[word] = None
+        else:
             break
 
-        KVs[key] = values
-
     # Misc.log('parseArgs', 'KVs: %s' % (KVs))
     return KVs
 
 
-def match(argv, opts):
-    """ Searches an OrderedDict for matches.
-
-    Args:
-      argv - an OrderedDict of options.
-      opts - a list of duples to match against. The duple parts are the option name
-             and a converter. If the converter is None, the option takes no argument.
-
-    Returns:
-      matches   - an OrderedDict of the matched options, with converted arguments.
-      unmatched - a list of unmatched options from opts.
-      leftovers - an OrderedDict of unmatched options from argv.
+class ArgMatcher(object):
+    """ A precompiled set of options to match parsed command arguments against.
 
-    Raises:
-      Error     - Any parsing or conversion error.
+    Build one per vocabulary command, once, and pass it to Command.match() instead of
+    the list of option duples.
     """
 
-    # Convert the request duples to an OrderedDict
-    want = OrderedDict()
-    for o in opts:
-        try:
-            a, b = o
-        except Exception:
-            raise Exception('the argument to Command.matchDicts must be a list of duples')
-
-        want[a] = b
-
-    # Walk over the parsed options, and categorize them
-    #
-    matches = OrderedDict()
-    leftovers = OrderedDict()
-
-    for opt, arg in argv.items():
-        # If we are looking for the option, match it and convert the argument.
-        if opt in want:
-            converter = want[opt]
-            if converter is None:
-                if arg is not None:
-                    raise Exception('option %s takes no argument' % (Misc.qstr(opt, tquote="'")))
-                matches[opt] = None
+    def __init__(self, opts):
+        """
+        Args:
+          opts - a list of duples to match against. The duple parts are the option name
+                 and a converter. If the converter is None, the option takes no argument.
+        """
+
+        self.converters = OrderedDict()
+        for o in opts:
+            try:
+                a, b = o
+            except Exception:
+                raise Exception('the argument to Command.matchDicts must be a list of duples')
+
+            self.converters[a] = b
+
+    def match(self, argv):
+        """ Searches an OrderedDict for matches.
+
+        Args:
+          argv - an OrderedDict of options.
+
+        Returns:
+          matches   - an OrderedDict of the matched options, with converted arguments.
+          unmatched - a list of unmatched options from opts.
+          leftovers - an OrderedDict of unmatched options from argv.
+
+        Raises:
+          Error     - Any parsing or conversion error.
+        """
+
+        converters = self.converters
+        matches = OrderedDict()
+        leftovers = OrderedDict()
+
+        # Walk over the parsed options, and categorize them
+        #
+        for opt, arg in argv.items():
+            # If we are looking for the option, match it and convert the argument.
+            if opt in converters:
+                converter = converters[opt]
+                if converter is None:
+                    if arg is not None:
+                        raise Exception('option %s takes no argument' %
+                                        (Misc.qstr(opt, tquote="'")))
+                    matches[opt] = None
+                else:
+                    try:
+                        convArg = converter(arg)
+                    except Exception as e:
+                        raise Exception("error with option '%s': %s" % (opt, e))
+
+                    matches[opt] = convArg
+
+            # If we are not looking for the option, return it as a leftover
             else:
-                try:
-                    convArg = converter(arg)
-                except Exception as e:
-                    raise Exception("error with option '%s': %s" % (opt, e))
+                leftovers[opt] = arg
 
-                matches[opt] = convArg
+        unmatched = [opt for opt in converters if opt not in matches]
+        return matches, unmatched, leftovers
 
-            # Remove the option from the search list.
-            del want[opt]
 
-        # If we are not looking for the option, return it as a leftover
-        else:
-            leftovers[opt] = arg
+def match(argv, opts):
+    """ Searches an OrderedDict for matches. See ArgMatcher.match().
+
+    Args:
+      argv - an OrderedDict of options.
+      opts - a list of duples to match against, or an ArgMatcher.
+    """
 
-    return matches, list(want.keys()), leftovers
+    if not isinstance(opts, ArgMatcher):
+        opts = ArgMatcher(opts)
+    return opts.match(argv)
+
+
+if __name__ == '__main__':
+    import random
+    import time
+
+    tests = ('', 'status', '  listen addActors tcc  mcp ', 'set program=APO a1 a2',
+             'getFor=tcc AxePos TCCStatus', 'login program="APO" password="x y" type=tui',
+             'a1 a2=1 a3= "2" a4=, a5=\'it\\\'s\'', 'a="unterminated', 'a="ends in \\',
+             'a=b\tc=d\x0be', 'x=1 x=2', 'two\nlines=1')
+
+    # The single-pass parser must return exactly what the original one does.
+    for t in tests:
+        assert parseArgs(t) == _parseArgsSlow(t), t
+
+    random.seed(0)
+    pieces = ('a', 'key', 'Z_9', '-', '=', ' ', '\t', '"', "'", '\\', ',', '.', '\xa0')
+    for i in range(20000):
+        t = ''.join(random.choice(pieces) for j in range(random.randint(0, 12)))
+        assert list(parseArgs(t).items()) == list(_parseArgsSlow(t).items()), repr(t)
+    print('parseArgs matches _parseArgsSlow')
+
+    matcher = ArgMatcher([('set', None), ('program', str)])
+    argv = parseArgs('set program=APO a1 a2')
+    print(matcher.match(argv))
+    assert matcher.match(argv) == match(argv, [('set', None), ('program', str)])
+
+    N = 20000
+    line = 'login program="APO" password="3f2a9c" username="jim" type=tui version=1.3 a1 a2'
+    opts = [('program', str), ('password', str), ('username', str), ('type', str),
+            ('version', str), ('platform', str)]
+    t0 = time.time()
+    for i in range(N):
+        match(_parseArgsSlow(line), opts)
+    t1 = time.time()
+    for i in range(N):
+        ArgMatcher(opts).match(parseArgs(line))
+    t2 = time.time()
+    matcher = ArgMatcher(opts)
+    for i in range(N):
+        matcher.match(parseArgs(line))
+    t3 = time.time()
+    print('original parse+match:     %0.2fus per command' % ((t1 - t0) / N * 1e6))
+    print('single-pass parse+match:  %0.2fus per command' % ((t2 - t1) / N * 1e6))
+    print('with a prebuilt matcher:  %0.2fus per command' % ((t3 - t2) / N * 1e6))
@@ -0,0 +1,173 @@
+__all__ = ['jsonValueAsKV', 'parseJSONKVs', 'parseJSONReply']
+""" JSON reply parsing.
+
+Modern actors (jaeger, cherno, hal, fliswarm, ...) can emit each reply as a single
+line of JSON:
+
+    {"header": {"commander_id": C, "command_id": M, "message_code": F, "sender": S},
+     "data": {"key1": value, "key2": [v1, v2, ...], ...}}
+
+Rather than forcing such replies through ASCII quoting and re-parsing them character
+by character, we build the reply dictionary directly from json.loads(). The values
+are converted to the same tokens that parseKVs() would have produced for the
+equivalent ASCII reply:
+
+- strings are quoted with qstr(), with any CRs and LFs escaped,
+- booleans become T or F,
+- numbers are str()-ed,
+- null and empty lists make valueless keywords,
+- one-element lists are flattened, just like parseKV() does,
+- nested objects and arrays are sent as quoted JSON strings.
+"""
+
+import json
+from collections import OrderedDict
+
+from tron import Misc
+
+
+_jsonDecoder = json.JSONDecoder()
+_jsonEncoder = json.JSONEncoder(separators=(',', ':'))
+
+
+def _jsonToken(v):
+    """ Convert a single JSON scalar to an ASCII protocol token. """
+
+    if isinstance(v, str):
+        # An ASCII reply line can never contain an EOL, so do not let a JSON one sneak in.
+        s = Misc.qstr(v)
+        if '\n' in s or '\r' in s:
+            s = s.replace('\r', '\\r').replace('\n', '\\n')
+        return s
+    if v is True:
+        return 'T'
+    if v is False:
+        return 'F'
+    if v is None:
+        return ''
+    if isinstance(v, (list, dict)):
+        return Misc.qstr(_jsonEncoder.encode(v))
+
+    return str(v)
+
+
+def _isNumber(v):
+    t = type(v)
+    return t is float or t is int
+
+
+def jsonValueAsKV(v):
+    """ Convert a JSON value to what parseKV() would return for its ASCII form.
+
+    Returns:
+      - None for a valueless keyword,
+      - a single token,
+      - or a list of tokens.
+    """
+
+    if isinstance(v, list):
+        if len(v) == 0:
+            return None
+        if len(v) == 1:
+            return _jsonToken(v[0])
+
+        # Large arrays (robot positions, fiber lists) are almost always all numbers.
+        # Let str() run at C speed over those.
+        #
+        if all(map(_isNumber, v)):
+            return list(map(str, v))
+        return [_jsonToken(x) for x in v]
+
+    if v is None:
+        return None
+
+    return _jsonToken(v)
+
+
+def parseJSONKVs(data):
+    """ Convert a decoded JSON object into a KV OrderedDict. """
+
+    KVs = OrderedDict()
+    if data is None:
+        return KVs
+
+    if not isinstance(data, dict):
+        KVs['UNPARSEDTEXT'] = [Misc.qstr(_jsonEncoder.encode(data))]
+        return KVs
+
+    for k, v in data.items():
+        KVs[k] = jsonValueAsKV(v)
+
+    return KVs
+
+
+def parseJSONReply(s):
+    """ Try to parse a JSON reply line into a dictionary containing:
+         - mid   - the ICC's MID
+         - cid   - the ICC's CID
+         - flag  - the reply's flag character
+         - KVs   - an OrderedDict of (key, value)s
+
+        As for parseASCIIReply(), a line which cannot be parsed at all is returned as a
+        warning with the entire line in the key 'RawLine'.
+    """
+
+    try:
+        msg = _jsonDecoder.decode(s)
+        header = msg['header']
+        d = {'mid': header.get('command_id', 0),
+             'cid': header.get('commander_id', 0),
+             'flag': header.get('message_code', 'i')}
+        KVs = parseJSONKVs(msg.get('data', None))
+    except Exception as e:
+        Misc.log('parseJSONReply', 'could not parse %r: %s' % (s, e))
+        d = {'mid': 0, 'cid': 0, 'flag': 'w'}
+        KVs = OrderedDict()
+        KVs['RawLine'] = [Misc.qstr(s)]
+
+    d['KVs'] = KVs
+    d['RawText'] = s
+
+    return d
+
+
+if __name__ == '__main__':
+    import time
+
+    from tron.Parsing.keys import parseASCIIReply
+
+    tests = ('{"header": {"commander_id": "APO.Jim", "command_id": 12, "message_code": ":",'
+             ' "sender": "jaeger"}, "data": {"text": "he said \\"hi\\"", "ok": true,'
+             ' "version": "1.2.3", "a": [1, 2.5, "x"], "b": [], "c": null, "d": [4],'
+             ' "e": {"f": 1}}}',
+             '{"header": {"command_id": 3}}',
+             'not json')
+    for t in tests:
+        print('t=%s\n   -> %s' % (t, parseJSONReply(t)))
+
+    # Benchmark: a jaeger-like robot position keyword, as both JSON and ASCII.
+    #
+    nRobots = 500
+    positions = []
+    for i in range(nRobots):
+        positions.extend([i + 1, 10.0 + i * 0.123456, 170.0 - i * 0.0654321])
+    jsonLine = json.dumps({'header': {'commander_id': 'APO.Jim', 'command_id': 12,
+                                      'message_code': 'i', 'sender': 'jaeger'},
+                           'data': {'robotPositions': positions}})
+    asciiLine = 'APO.Jim 12 i robotPositions=%s' % (','.join(map(str, positions)))
+
+    assert parseJSONReply(jsonLine)['KVs'] == parseASCIIReply(asciiLine, cidFirst=True)['KVs']
+
+    N = 200
+    t0 = time.time()
+    for i in range(N):
+        parseASCIIReply(asciiLine, cidFirst=True)
+    t1 = time.time()
+    for i in range(N):
+        parseJSONReply(jsonLine)
+    t2 = time.time()
+
+    print('%d robots, %d values per line' % (nRobots, len(positions)))
+    print('parseASCIIReply: %0.6fs per line' % ((t1 - t0) / N))
+    print('parseJSONReply:  %0.6fs per line (%0.2fx the speed of parseASCIIReply)' %
+          ((t2 - t1) / N, (t1 - t0) / (t2 - t1)))
@@ -1,4 +1,5 @@
-__all__ = ['eatAVee', 'eatAString', 'parseKV', 'parseKVs', 'parseASCIIReply', 'parseRawReply']
+__all__ = ['eatAVee', 'eatAString', 'parseKV', 'parseKVs', 'parseReplyKeys', 'parseASCIIReply',
+           'parseRawReply', 'LazyReply', 'FrozenKVs', 'setParseCacheSize', 'parseCacheStats']
 """ Parsing utilities.
 
 - Keywords can have zero or more comma-delimited values.
@@ -11,6 +12,7 @@ __all__ = ['eatAVee', 'eatAString', 'parseKV', 'parseKVs', 'parseASCIIReply', 'p
 
 """
 
+import functools
 import re
 from collections import OrderedDict
 
@@ -189,16 +191,45 @@ def parseKV(s):
     return K, values, rest
 
 
-def parseKVs(s):
-    """ Parse a string of key-value pairs into an OrderedDict .
+# The single-pass tokenizer used by parseKVs(). Both patterns are only ever matched
+# at a given position in the line, so the line is never re-sliced as it is consumed.
+#
+#   - key_re matches a keyword, its delimiter, and the following space. It
+#     also matches the end of the input.
+#   - value_re matches one value and the following space. A string runs up to
+#     its closing quote, or (unterminated) to the end of the line. Empty values are
+#     legal and match as an empty bare value.
+#
+key_re = re.compile(
+    r"""
+  \s*
+  (?:
+    (?P<key>[a-z_][a-z0-9_-]*)  # Keyword name
+    \s*
+    (?P<delimiter>[=;]|\Z)
+    \s*
+  | \Z                          # End of input
+  )""", re.IGNORECASE | re.VERBOSE)
+
+value_re = re.compile(
+    r"""
+  \s*
+  (?:
+    (?P<string>"(?:[^"\\]|\\.)*"       # A complete string
+              |'(?:[^'\\]|\\.)*')
+  | (?P<open>["'])                      # The start of an unterminated string
+  | (?P<bare>[^;,\ \t\r\n\x0b\x0c]*)     # Anything else, possibly empty
+  )
+  \s*
+  (?P<sep>[,;]?)                        # What ends the value""", re.DOTALL | re.VERBOSE)
 
-    Returns:
-      - an OrderedDict of keyword values.
+space_re = re.compile(r'\s*')
 
-    If a keyword has no value, the value is None
-    Otherwise the value is a list of parsed values. Note that each value can be None.
 
-    """
+def _parseKVsSlow(s):
+    """ The original, slicing, implementation of parseKVs(). Still used for
+    text containing newlines, where the regexps in parseKV() do odd things that
+    nobody should need to reproduce, and as the reference for parseKVs(). """
 
     KVs = OrderedDict()
     rest = s
@@ -219,6 +250,87 @@ def parseKVs(s):
     return KVs
 
 
+def parseKVs(s):
+    """ Parse a string of key-value pairs into an OrderedDict .
+
+    Returns:
+      - an OrderedDict of keyword values.
+
+    If a keyword has no value, the value is None
+    Otherwise the value is a list of parsed values. Note that each value can be None.
+
+    Raises:
+      - ParseException, with the unparseable text and the keys parsed up to it.
+
+    This gives exactly the same results as parsing with parseKV(), in one pass.
+    """
+
+    if '\n' in s:
+        return _parseKVsSlow(s)
+
+    KVs = OrderedDict()
+    keyMatch = key_re.match
+    valueMatch = value_re.match
+    spaceMatch = space_re.match
+    end = len(s)
+    pos = 0
+
+    while True:
+        m = keyMatch(s, pos)
+        if m is None:
+            raise ParseException(leftoverText=s[spaceMatch(s, pos).end():], KVs=KVs)
+        pos = m.end()
+
+        key = m.group('key')
+        if key is None:
+            break
+
+        # No equal sign? A valueless keyword.
+        #
+        if m.group('delimiter') != '=':
+            KVs[key] = None
+            continue
+
+        values = []
+        while pos < end:
+            m = valueMatch(s, pos)
+            string, quote, bare, sep = m.groups()
+
+            if quote is not None:
+                # We fell off the end of the string without matching the closing quote.
+                # Force the string to look OK so that nobody else needs to deal with a
+                # mangled string.
+                #
+                val = s[m.start('open'):]
+                escaping = len(val) > 1 and val[-1] == '\\' and \
+                    (len(val) - len(val.rstrip('\\'))) % 2 == 1
+                Misc.log('eatAString', 'adding closing section (esc=%s) to string %r' %
+                         (escaping, val))
+                if escaping:
+                    val = '%s\\%s' % (val, quote)
+                else:
+                    val += quote
+                values.append(val)
+                pos = end
+                break
+
+            values.append(bare if string is None else string)
+            pos = m.end()
+
+            # Keep gathering subvalues while we find commas.
+            #
+            if sep != ',':
+                break
+
+        # Flatten singleton lists.
+        if len(values) == 1:
+            values = values[0]
+
+        KVs[key] = values
+
+    return KVs
+
+
 line_midcid_re = re.compile(
     r"""
   \s*                          # Skip leading whitespace
@@ -242,7 +354,140 @@ line_cidmid_re = re.compile(
   (?P<rest>.*)""", re.VERBOSE | re.IGNORECASE)
 
 
-def parseASCIIReply(s, cidFirst=False):
+class FrozenKVs(OrderedDict):
+    """ A read-only OrderedDict of parsed keywords.
+
+    The parse cache hands the same instance to every reply with the same keys text,
+    so nobody gets to modify it, nor the value lists it holds. Copies and pickles are
+    plain OrderedDicts, with their own value lists.
+    """
+
+    def __init__(self, KVs=()):
+        setitem = OrderedDict.__setitem__
+        for k, v in OrderedDict(KVs).items():
+            setitem(self, k, v)
+
+    def _readOnly(self, *args, **argv):
+        raise TypeError('parsed keywords are shared, and cannot be modified')
+
+    __setitem__ = __delitem__ = __ior__ = _readOnly
+    clear = pop = popitem = setdefault = update = move_to_end = _readOnly
+
+    def __copy__(self):
+        return OrderedDict([(k, list(v) if isinstance(v, list) else v) for k, v in self.items()])
+
+    copy = __copy__
+
+    def __reduce__(self):
+        return (OrderedDict, (list(self.__copy__().items()), ))
+
+
+# The parse cache. Actors repeat many reply bodies verbatim, all night long, so keep
+# the most recently parsed ones. Only bodies up to parseCacheMaxLength characters
+# are cached, which bounds the cache's memory use.
+#
+parseCacheMaxLength = 1024
+_cachedParse = None
+_uncachedParses = 0
+
+
+def _parseFrozenKeys(s):
+    KVs, clean = _parseReplyKeys(s)
+    return FrozenKVs(KVs), clean
+
+
+def setParseCacheSize(n):
+    """ (Re-)create the parse cache, holding the n most recently used bodies. 0 disables it. """
+
+    global _cachedParse, _uncachedParses
+
+    _uncachedParses = 0
+    if n > 0:
+        _cachedParse = functools.lru_cache(maxsize=n)(_parseFrozenKeys)
+    else:
+        _cachedParse = None
+
+
+def parseCacheStats():
+    """ Return a dictionary of parse cache statistics. """
+
+    if _cachedParse is None:
+        hits = misses = size = maxSize = 0
+    else:
+        hits, misses, maxSize, size = _cachedParse.cache_info()
+
+    return dict(hits=hits, misses=misses, uncached=_uncachedParses, size=size, maxSize=maxSize)
+
+
+def parseReplyKeys(s):
+    """ Parse the keys part of a reply line. Never raises.
+
+    Returns:
+      - an OrderedDict of keyword values. If s cannot be completely parsed, the
+        unparsed section is inserted into the key 'UNPARSEDTEXT'. This may be a
+        shared FrozenKVs, so must not be modified.
+      - whether s is a faithful encoding of those keys: True unless some text had
+        to be put into UNPARSEDTEXT or an unterminated string had to be closed.
+    """
+
+    global _uncachedParses
+
+    if _cachedParse is not None:
+        if len(s) <= parseCacheMaxLength:
+            return _cachedParse(s)
+        _uncachedParses += 1
+
+    return _parseReplyKeys(s)
+
+
+def _parseReplyKeys(s):
+    """ The uncached parseReplyKeys(). """
+
+    clean = True
+    try:
+        KVs = parseKVs(s)
+    except ParseException as e:
+        KVs = e.KVs
+        leftoverText = e.leftoverText
+
+        # In this case, quote the offending text.
+        KVs['UNPARSEDTEXT'] = [Misc.qstr(leftoverText)]
+        clean = False
+    except Exception as e:
+        Misc.log('parseASCIIReply', 'unexpected Exception: %s' % (e))
+        KVs = OrderedDict()
+        KVs['UNPARSEDTEXT'] = [Misc.qstr(s)]
+        clean = False
+
+    # eatAString() silently closes a string which runs off the end of the line. That
+    # can only happen to the very last value, which then no longer ends the text.
+    #
+    if clean and KVs:
+        lastVal = next(reversed(KVs.values()))
+        if isinstance(lastVal, list):
+            lastVal = lastVal[-1] if lastVal else None
+        if lastVal and lastVal[0] in "\"'" and not s.rstrip().endswith(lastVal):
+            clean = False
+
+    return KVs, clean
+
+
+class LazyReply(dict):
+    """ A reply dictionary whose keys are only parsed when somebody asks for ['KVs'].
+
+    Until then, the unparsed keys text is available as ['rawKeys'].
+    """
+
+    def __missing__(self, key):
+        if key != 'KVs':
+            raise KeyError(key)
+
+        KVs, clean = parseReplyKeys(self['rawKeys'])
+        self['KVs'] = KVs
+        return KVs
+
+
+def parseASCIIReply(s, cidFirst=False, lazy=False):
     """ Try to parse a string into a dictionary containing:
          - mid   - the ICC's MID
          - cid   - the ICC's CID
@@ -254,6 +499,9 @@ def parseASCIIReply(s, cidFirst=False):
         If a reply line cannot be parsed at all, insert the entire line into the key 'RawLine'.
         If a reply line cannot be completely parsed, insert the unparsed section
         into the key 'UNPARSEDTEXT'.
+
+        If lazy is True, only the header is parsed: a LazyReply is returned, with
+        the keys text in 'rawKeys'.
     """
 
     if cidFirst:
@@ -274,23 +522,14 @@ def parseASCIIReply(s, cidFirst=False):
         return d
 
     d = match.groupdict()
-
-    try:
-        KVs = parseKVs(d['rest'])
-    except ParseException as e:
-        KVs = e.KVs
-        leftoverText = e.leftoverText
-
-        # In this case, quote the offending text.
-        KVs['UNPARSEDTEXT'] = [Misc.qstr(leftoverText)]
-    except Exception as e:
-        Misc.log('parseASCIIReply', 'unexpected Exception: %s' % (e))
-        KVs = OrderedDict()
-        KVs['UNPARSEDTEXT'] = [Misc.qstr(d['rest'])]
-
-    d['KVs'] = KVs
+    rest = d.pop('rest')
     d['RawText'] = s
-    del d['rest']
+
+    if lazy:
+        d = LazyReply(d)
+        d['rawKeys'] = rest.strip()
+    else:
+        d['KVs'], clean = parseReplyKeys(rest)
 
     return d
 
@@ -322,9 +561,12 @@ def testParsing():
     NGtests = ("'", "abc'=1", "shortString='abcd", 'eol=2,3,')
 
     for t in OKtests:
-        r = parseKVs(t)
         print('OKtest = %s' % (t))
-        print('output = %s' % (r))
+        try:
+            r = parseKVs(t)
+            print('output = %s' % (r))
+        except Exception as e:
+            print('exception = %s' % (e))
         print()
 
     for t in NGtests:
@@ -338,10 +580,155 @@ def testParsing():
         print()
 
 
+# Golden parseKVs() results: (input, ('ok', items)) or (input, ('exc', leftoverText, items)).
+# These are the results of the original, character-by-character, parser.
+#
+GOLDEN = (
+    ('', ('ok', [])),
+    ('a', ('ok', [('a', None)])),
+    ('a ; b ;', ('ok', [('a', None), ('b', None)])),
+    ('a= ', ('ok', [('a', [])])),
+    ('a = 1 , 2,3', ('ok', [('a', ['1', '2', '3'])])),
+    ('a=1,', ('ok', [('a', '1')])),
+    ('a=1, ', ('ok', [('a', ['1', ''])])),
+    ('a=,1', ('ok', [('a', ['', '1'])])),
+    ('a=;b=2', ('ok', [('a', ''), ('b', '2')])),
+    ('a=1,;b=2', ('ok', [('a', ['1', '']), ('b', '2')])),
+    ('a=1 2', ('exc', '2', [('a', '1')])),
+    ("a='x'y", ('ok', [('a', "'x'"), ('y', None)])),
+    ("a=x'y", ('ok', [('a', "x'y")])),
+    ('a="he said \\"hi\\""', ('ok', [('a', '"he said \\"hi\\""')])),
+    ("a='it''s'", ('exc', "'s'", [('a', "'it'")])),
+    ('a="unterminated', ('ok', [('a', '"unterminated"')])),
+    ('a="ends in backslash\\', ('ok', [('a', '"ends in backslash\\\\"')])),
+    ('a="ends in escaped backslash\\\\', ('ok', [('a', '"ends in escaped backslash\\\\"')])),
+    ('text="a; b=c"; d=4', ('ok', [('text', '"a; b=c"'), ('d', '4')])),
+    ('1=2', ('exc', '1=2', [])),
+    ('a=1; =2', ('exc', '=2', [('a', '1')])),
+    ('a=1;;b=2', ('exc', ';b=2', [('a', '1')])),
+    ('a=\xa01', ('ok', [('a', '1')])),
+    ('a=1\x1cb', ('ok', [('a', '1\x1cb')])),
+    ('a=1\x0bb=2', ('ok', [('a', '1'), ('b', '2')])),
+    ("a=1,'two, three';b=\"x;y\"", ('ok', [('a', ['1', "'two, three'"]), ('b', '"x;y"')])),
+    ('a=-1.5e+3,nan,0x1F', ('ok', [('a', ['-1.5e+3', 'nan', '0x1F'])])),
+)
+
+
+def _parseResult(parser, s):
+    try:
+        return ('ok', list(parser(s).items()))
+    except ParseException as e:
+        return ('exc', e.leftoverText, list(e.KVs.items()))
+
+
+def testGolden():
+    """ Check parseKVs() against the GOLDEN results and, on random input, against
+    the original parser. """
+
+    import random
+
+    for s, expected in GOLDEN:
+        assert _parseResult(parseKVs, s) == expected, (s, _parseResult(parseKVs, s), expected)
+
+    alphabet = list('ab_=;,"\'\\ \t1.-') + ['\xa0', '\x1c', '\r', '\x0b', '\u212a', '\xe9']
+    rng = random.Random(0)
+    for i in range(20000):
+        s = ''.join(rng.choice(alphabet) for _ in range(rng.randrange(25)))
+        assert _parseResult(parseKVs, s) == _parseResult(_parseKVsSlow, s), s
+
+    print('%d golden and 20000 random parses OK' % (len(GOLDEN)))
+
+
+def benchmark():
+    import time
+
+    lines = (('status', 'ccdTemp=-100.2,-99.8; shutter="closed"; text="all is well"'),
+             ('tcc', 'AxePos=121.234567,45.678901,12.345678; TCCStatus="TTT","NNN"; '
+              'text="tracking \\"M31\\""'),
+             ('100 values', 'robotIds=%s' % (','.join(map(str, range(100))))),
+             ('1000 values',
+              'positions=%s' % (','.join(['%0.6f' % (i * 0.1) for i in range(1000)]))))
+
+    for name, line in lines:
+        n = max(20, 20000 // len(line))
+        times = []
+        for parser in _parseKVsSlow, parseKVs:
+            t0 = time.time()
+            for i in range(n):
+                parser(line)
+            times.append((time.time() - t0) / n)
+        print('%-12s %6d chars: old %8.1fus new %8.1fus  x%0.1f' %
+              (name, len(line), times[0] * 1e6, times[1] * 1e6, times[0] / times[1]))
+
+
+def replayedBodies(filenames):
+    """ Return the reply bodies from nub log files, or some synthetic traffic if there are none.
+
+    In the nub logs, replies from actors are the lines with a "<" note, e.g.:
+       2022-01-07 03:02:01,234Z < APO.Jim 12 i text="all is well"
+    """
+
+    import random
+
+    bodies = []
+    for fname in filenames:
+        with open(fname, 'r', errors='replace') as f:
+            for line in f:
+                parts = line.rstrip('\n').split(' < ', 1)
+                if len(parts) == 2:
+                    reply = parseASCIIReply(parts[1], cidFirst=True, lazy=True)
+                    if 'rawKeys' in reply:
+                        bodies.append(reply['rawKeys'])
+    if bodies:
+        return bodies
+
+    # A night of mostly-repeated heartbeats, with some values which always change.
+    #
+    rng = random.Random(1)
+    heartbeats = ['text="all is well"', 'shutter="closed"; lampsOn=F,F,F,F',
+                  'TCCStatus="TTT","NNN"; axisCmdState="Tracking","Tracking","Tracking"',
+                  'ccdState="idle"; exposureState="idle",0.0,0.0', 'version="5.0.1"',
+                  'fps_status=0x1004; robotsFolded=T', 'ffsStatus=01,01,01,01,01,01,01,01']
+    heartbeats += ['actorStatus=%d,"ok"' % (i) for i in range(40)]
+    for i in range(100000):
+        if rng.random() < 0.8:
+            bodies.append(rng.choice(heartbeats))
+        else:
+            bodies.append('ccdTemp=%0.2f,%0.2f; AxePos=%0.6f,%0.6f,%0.6f' %
+                          (rng.gauss(-100, 1), rng.gauss(-100, 1), rng.uniform(0, 360),
+                           rng.uniform(0, 90), rng.uniform(-180, 180)))
+    return bodies
+
+
+def benchmarkCache(filenames):
+    import time
+
+    bodies = replayedBodies(filenames)
+
+    times = []
+    for size in 0, 4096:
+        setParseCacheSize(size)
+        t0 = time.time()
+        for s in bodies:
+            parseReplyKeys(s)
+        times.append(time.time() - t0)
+
+    stats = parseCacheStats()
+    hitRate = stats['hits'] / len(bodies)
+    print('%d bodies: uncached %0.3fs, cached %0.3fs (hit rate %0.3f): saved %0.0f%% of parsing' %
+          (len(bodies), times[0], times[1], hitRate, 100 * (1 - times[1] / times[0])))
+    setParseCacheSize(0)
+
+
 def testMatching():
     pass
 
 
 if __name__ == '__main__':
+    import sys
+
     testParsing()
     testMatching()
+    testGolden()
+    benchmark()
+    benchmarkCache(sys.argv[1:])
@@ -47,12 +47,11 @@ class InternalCmd(object):
         self.totalCommands += 1
 
         cmd.parseArgs()
-        words = list(cmd.argDict.keys())
-        if len(words) == 0:
+        cmdWord = next(iter(cmd.argDict), None)
+        if cmdWord is None:
             cmd.finish('')
             return
 
-        cmdWord = words[0]
         cmdHandler = self.commands.get(cmdWord, None)
         if cmdHandler is None:
             cmd.fail('%sTxt=%s' %
@@ -83,3 +82,13 @@ class InternalCmd(object):
 
     def shutdown(self, notifyHub=None):
         pass
+
+    def failQueuedCommands(self, why):
+        """ We run commands as they arrive, so never hold any. """
+
+        pass
+
+    def failOurCommands(self, why):
+        """ Our commands never wait on anybody else. """
+
+        pass
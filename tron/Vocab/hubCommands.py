@@ -1,11 +1,11 @@
 __all__ = ['hubCommands']
 
 import sys
+from collections import OrderedDict
 
 import Vocab.InternalCmd as InternalCmd
 
-from tron import Misc, g, hub
-from tron.Hub.KV.KVDict import kvAsASCII
+from tron import Misc, Parsing, g, hub
 
 
 class hubCommands(InternalCmd.InternalCmd):
@@ -18,8 +18,12 @@ class hubCommands(InternalCmd.InternalCmd):
     etc.
     """
 
+    listenArgs = Parsing.ArgMatcher([('listen', None), ('addActors', None), ('delActors', None),
+                                     ('changedOnly', None), ('allKeys', None)])
+
     def __init__(self, **argv):
-        argv['safeCmds'] = r'^\s*(actors|commanders|actorInfo|version|status|ping)\s*$'
+        argv['safeCmds'] = (r'^\s*(actors|commanders|actorInfo|version|status|ping|pending'
+                            r'|parseStats|(cmdStats|keyStats|memStats|sync)(\s+\S+)*)\s*$')
         argv['needsAuth'] = True
         InternalCmd.InternalCmd.__init__(self, 'hub', **argv)
 
@@ -39,6 +43,13 @@ class hubCommands(InternalCmd.InternalCmd):
             'version': self.version,
             'ping': self.status,
             'relog': self.relog,
+            'cmdTrace': self.cmdTrace,
+            'pending': self.pending,
+            'cmdStats': self.cmdStats,
+            'parseStats': self.parseStats,
+            'keyStats': self.keyStats,
+            'sync': self.sync,
+            'memStats': self.memStats,
         }
 
     def version(self, cmd, finish=True):
@@ -53,10 +64,16 @@ class hubCommands(InternalCmd.InternalCmd):
             cmd.inform(vString)
 
     def doListen(self, cmd):
-        """ Change what replies get sent to us. """
+        """ Change what replies get sent to us.
+
+        Usage:
+           listen addActors a1 [a2 ...]
+           listen delActors a1 [a2 ...]
+           listen changedOnly   - leave unchanged keys out of other commanders' replies.
+           listen allKeys       - send all keys again.
+        """
 
-        matched, unmatched, leftovers = cmd.match([('listen', None), ('addActors', None),
-                                                   ('delActors', None)])
+        matched, unmatched, leftovers = cmd.match(self.listenArgs)
 
         cmdr = cmd.cmdr()
         if not cmdr:
@@ -77,6 +94,12 @@ class hubCommands(InternalCmd.InternalCmd):
             # cmd.inform('text="%s"' % (Misc.qstr("removing actors: %s" % (actors))))
             cmdr.taster.removeFromFilter(actors, [], actors)
             cmd.finish()
+        elif 'changedOnly' in matched:
+            cmdr.changedOnly = True
+            cmd.finish()
+        elif 'allKeys' in matched:
+            cmdr.changedOnly = False
+            cmd.finish()
         else:
             cmd.fail('text="unknown listen command"')
 
@@ -231,13 +254,126 @@ class hubCommands(InternalCmd.InternalCmd):
         matched, unmatched = g.KVs.getValues(src, keys)
         Misc.log('hub.getKeys', 'matched=%s unmatched=%s' % (matched, unmatched))
         for k, v in matched.items():
-            kvString = kvAsASCII(k, v)
-            cmd.inform(kvString, src='hub.%s' % (src))
+            cmd.inform(OrderedDict([(k, v.val)]), asciiKeys=v.asASCII(), src='hub.%s' % (src))
         if unmatched:
             cmd.warn('text=%s' % (Misc.qstr('unmatched %s keys: %s' %
                                             (src, ', '.join(unmatched)))))
         cmd.finish('')
 
+    def cmdTrace(self, cmd):
+        """ Query or set the command trace sampling.
+
+        Every Nth command generates CmdTrace keywords (source cmdTrace) and log entries
+        as it goes through the hub, whether or not anybody listens to the cmds source.
+
+        Usage:
+           cmdTrace [N]    - N=0 turns tracing off.
+        """
+
+        args = cmd.cmd.split()[1:]
+        if len(args) > 1:
+            cmd.fail('cmdError="usage: cmdTrace [N]"')
+            return
+
+        if args:
+            try:
+                sample = int(args[0])
+            except ValueError:
+                cmd.fail('cmdError=%s' % (Misc.qstr('invalid sampling value: %s' % (args[0]))))
+                return
+            g.cmdTraceSample = max(sample, 0)
+
+        cmd.finish('cmdTraceSample=%d' % (g.cmdTraceSample))
+
+    def pending(self, cmd):
+        """ List the commands which have been sent to actors but have not yet finished.
+
+        Generates pendingCmds=N,nTimedOut then, for each command,
+        pendingCmd=xid,cmdrCid,cmdrMid,actor,cmd,age,secondsLeft
+        """
+
+        g.pendingCommands.listSelf(cmd)
+        cmd.finish('')
+
+    def cmdStats(self, cmd):
+        """ Show the command latency histograms, optionally for only some actors.
+
+        Usage:
+           cmdStats [actor ...]
+        """
+
+        actors = cmd.cmd.split()[1:]
+        g.cmdStats.listSelf(cmd, actors=actors or None)
+        cmd.finish('')
+
+    def parseStats(self, cmd):
+        """ Report on the reply parse cache.
+
+        Generates parseStats=hits,misses,uncached,size,maxSize,hitRate
+        """
+
+        stats = Parsing.parseCacheStats()
+        lookups = stats['hits'] + stats['misses'] + stats['uncached']
+        hitRate = stats['hits'] / lookups if lookups else 0.0
+
+        cmd.finish('parseStats=%d,%d,%d,%d,%d,%0.3f' %
+                   (stats['hits'], stats['misses'], stats['uncached'], stats['size'],
+                    stats['maxSize'], hitRate))
+
+    def keyStats(self, cmd):
+        """ Report how many keys each source set, and how many of those did not change.
+
+        Usage:
+           keyStats [src ...]
+
+        Generates keyStats="src",nKeys,nUnchanged,nSuppressed,unchangedFraction, where
+        nSuppressed counts the unchanged keys left out of replies to "listen changedOnly"
+        commanders.
+        """
+
+        sources = cmd.cmd.split()[1:]
+        g.KVs.listKeyStats(cmd, sources=sources or None)
+        cmd.finish('')
+
+    def memStats(self, cmd):
+        """ Report roughly how much memory the keys of each source take.
+
+        Usage:
+           memStats [src ...]
+
+        Generates memStats="src",nKeys,nMetas,bytes for each source, where nMetas is the
+        number of distinct replies the keys were last set by, then
+        memTotal=nSources,nKeys,bytes.
+        """
+
+        sources = cmd.cmd.split()[1:]
+        g.KVs.listMemStats(cmd, sources=sources or None)
+        cmd.finish('')
+
+    def sync(self, cmd):
+        """ Send the current keys of some or all sources to just the commander.
+
+        Usage:
+           sync [src ...]
+
+        Each source's keys come in one reply from that source, all in a single write,
+        followed by syncedKeys=nSources,nKeys. Unknown sources, or sources without
+        keys, are listed in a syncMissing warning.
+        """
+
+        cmdr = cmd.cmdr()
+        if not cmdr:
+            cmd.fail('text=%s' % (Misc.qstr('no commander to sync keys to')))
+            return
+
+        sources = cmd.cmd.split()[1:]
+        nSources, nKeys, missing = cmdr.syncKeys(cmd, sources=sources or None)
+        Misc.log('hub.sync', 'sent %d keys from %d sources to %s' % (nKeys, nSources, cmdr.name))
+
+        if missing:
+            cmd.warn('syncMissing=%s' % (','.join([Misc.qstr(m) for m in missing])), bcast=False)
+        cmd.finish('syncedKeys=%d,%d' % (nSources, nKeys), bcast=False)
+
     def reallyReallyRestart(self, cmd):
         """ Restart the entire MC. Which among other things kills us now. """
 
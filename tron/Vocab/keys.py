@@ -1,9 +1,11 @@
 __all__ = ['keys']
 
+from collections import OrderedDict
+
 from Vocab.InternalCmd import InternalCmd
 
-from tron import Misc, g
-from tron.Hub.KV.KVDict import kvAsASCII
+from tron import Misc, Parsing, g
+from tron.Hub.KV.KVDict import valAsASCII
 
 
 class keys(InternalCmd):
@@ -11,16 +13,29 @@ class keys(InternalCmd):
         To wit:
 
         keys getFor=actor K1 [K2 [K3 ...]]
+        keys history src.key [since=T] [n=N]
+        keys query [regex] pattern [pattern ...]
 
         Keywords returned:
            The requested keywords. But the src of the keywords is keys_actor
-           instead of the actual actor.
+           instead of the actual actor. Keys which were restored from the
+           hub's snapshot and have not been set since are listed in a
+           staleKeys="K1","K2",... keyword.
+
+           keyHistory="src","key",N,t1,"value1",t2,"value2",...
+           keyQuery=N,"src1","key1","value1","src2","key2","value2",...
     """
 
+    getForArgs = Parsing.ArgMatcher([('getFor', str)])
+    historyArgs = Parsing.ArgMatcher([('history', None), ('since', float), ('n', int)])
+    queryArgs = Parsing.ArgMatcher([('query', None), ('regex', None)])
+
     def __init__(self, **argv):
         InternalCmd.__init__(self, 'keys', **argv)
 
-        self.commands = {'getFor': self.getFor}
+        self.commands = {'getFor': self.getFor,
+                         'history': self.history,
+                         'query': self.query}
 
     def getFor(self, cmd, finish=True):
         """ Fetch keywords for a given actor
@@ -29,7 +44,7 @@ class keys(InternalCmd):
            getFor=actor K1 [K2 ... ]
         """
 
-        matched, unmatched, leftovers = cmd.match([('getFor', str)])
+        matched, unmatched, leftovers = cmd.match(self.getForArgs)
 
         try:
             actor = matched['getFor']
@@ -52,15 +67,95 @@ class keys(InternalCmd):
             failed = [Misc.qstr(x) for x in unmatchedKeys]
             cmd.warn('unmatchedKeys=%s' % (','.join(failed)), bcast=False)
 
+        # The stored KVs keep their ASCII forms, so the reply need not build them again.
+        KVs = OrderedDict()
         values = []
+        stale = []
         for k, v in matchedKeys.items():
-            values.append(kvAsASCII(k, v))
+            KVs[k] = v.val
+            values.append(v.asASCII())
+            if g.KVs.isStale(actor, k):
+                stale.append(Misc.qstr(k))
+        if stale:
+            KVs['staleKeys'] = stale
+            values.append('staleKeys=%s' % (','.join(stale)))
 
         if values:
-            cmd.inform('; '.join(values),
+            cmd.inform(KVs,
+                       asciiKeys='; '.join(values),
                        noRegister=True,
                        src='keys_%s' % (actor),
                        bcast=False,
                        debug=9)
         if finish:
             cmd.finish(bcast=False)
+
+    def history(self, cmd, finish=True):
+        """ Return the kept recent values of a key, in a single keyword. See KVDict.
+
+        Usage:
+           history src.key [since=T] [n=N]
+
+           T is a Unix time. N limits the reply to the last N values.
+        """
+
+        try:
+            matched, unmatched, leftovers = cmd.match(self.historyArgs)
+        except Exception as e:
+            cmd.fail('keysTxt=%s' % (Misc.qstr(e)))
+            return
+
+        names = list(leftovers.keys())
+        if len(names) != 1 or '.' not in names[0]:
+            cmd.fail('keysTxt="usage: history src.key [since=T] [n=N]"')
+            return
+
+        src, _, key = names[0].rpartition('.')
+        values = g.KVs.getHistory(src, key, since=matched.get('since'), n=matched.get('n'))
+        if values is None:
+            cmd.fail('keysTxt=%s' % (Misc.qstr('no history is kept for %s' % (names[0]))))
+            return
+
+        history = [Misc.qstr(src), Misc.qstr(key), str(len(values))]
+        history.extend(['%0.3f,%s' % (t, Misc.qstr(valAsASCII(v))) for t, v in values])
+        cmd.inform('keyHistory=%s' % (','.join(history)),
+                   noRegister=True,
+                   src='keys_%s' % (src),
+                   bcast=False)
+        if finish:
+            cmd.finish(bcast=False)
+
+    def query(self, cmd, finish=True):
+        """ Return the keys of any sources which match some patterns, in a single keyword.
+
+        Usage:
+           query [regex] pattern [pattern ...]
+
+           Patterns are matched case-insensitively against src.key names. They are
+           glob patterns (tcc.Axe*, *.text) or, with regex, regular expressions
+           (^tcc\\.axe, pos$). Patterns cannot contain spaces or '='.
+        """
+
+        matched, unmatched, leftovers = cmd.match(self.queryArgs)
+
+        patterns = list(leftovers.keys())
+        if not patterns:
+            cmd.fail('keysTxt="usage: query [regex] pattern [pattern ...]"')
+            return
+
+        try:
+            found = g.KVs.query(patterns, regex='regex' in matched)
+        except Exception as e:
+            cmd.fail('keysTxt=%s' % (Misc.qstr('bad pattern: %s' % (e))))
+            return
+
+        values = [str(len(found))]
+        for src, kv in found:
+            values.append('%s,%s,%s' % (Misc.qstr(src), Misc.qstr(kv.key),
+                                        Misc.qstr(valAsASCII(kv.val))))
+        cmd.inform('keyQuery=%s' % (','.join(values)),
+                   noRegister=True,
+                   src='keys',
+                   bcast=False)
+        if finish:
+            cmd.finish(bcast=False)
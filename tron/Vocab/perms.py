@@ -1,6 +1,6 @@
 __all__ = ['perms']
 
-from tron import g
+from tron import Parsing, g
 
 from .InternalCmd import InternalCmd
 
@@ -31,6 +31,10 @@ class perms(InternalCmd):
           lockedActors=a1,a2
     """
 
+    setArgs = Parsing.ArgMatcher([('set', None), ('program', str)])
+    addArgs = Parsing.ArgMatcher([('add', None), ('program', str)])
+    dropArgs = Parsing.ArgMatcher([('drop', None), ('program', str)])
+
     def __init__(self, **argv):
         argv['needsAuth'] = True
         argv['safeCmds'] = r'^\s*status\s*$'
@@ -186,7 +190,7 @@ class perms(InternalCmd):
            set prog=p [a1 ...]
         """
 
-        matched, unmatched, leftovers = cmd.match([('set', None), ('program', str)])
+        matched, unmatched, leftovers = cmd.match(self.setArgs)
 
         try:
             program = matched['program']
@@ -206,7 +210,7 @@ class perms(InternalCmd):
            add program=p [a1 ...]
         """
 
-        matched, unmatched, leftovers = cmd.match([('add', None), ('program', str)])
+        matched, unmatched, leftovers = cmd.match(self.addArgs)
 
         try:
             program = matched['program']
@@ -226,7 +230,7 @@ class perms(InternalCmd):
            drop program=p [a1 ...]
         """
 
-        matched, unmatched, leftovers = cmd.match([('drop', None), ('program', str)])
+        matched, unmatched, leftovers = cmd.match(self.dropArgs)
 
         try:
             program = matched['program']
@@ -0,0 +1,429 @@
+__all__ = ['BENCHMARKS', 'runBenchmarks', 'saveResults', 'loadResults', 'compareResults']
+
+""" bench.py -- microbenchmarks for the hub's hot paths.
+
+    Every reply from every actor goes through the reply parser, the keyword dictionary,
+    each commander's taster and, for most of them, an ASCII encoder. Every command goes
+    through the argument parser. This times each of those steps on its own, against a
+    fixed corpus of typical lines, so that changes to them can be measured.
+
+    Misc.log() is timed for a disabled system, with the message formatted by the
+    caller and with the formatting left to Misc.log(). Enabled logging writes
+    files, so it is timed by python -m tron.Misc.hub_log instead.
+
+    Usage:
+       python -m tron.bench [-k PATTERN] [--save FILE] [--compare OLD.json [NEW.json]]
+
+       -k PATTERN      only run the benchmarks whose names contain PATTERN.
+       --save FILE     write the results, as JSON, to FILE.
+       --compare OLD   compare OLD with NEW, or with a fresh run if NEW is not given.
+
+    Results are the best of several repeats, in microseconds per operation.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import timeit
+from collections import OrderedDict
+
+from tron import Misc, Parsing
+from tron.Hub.KV.KVDict import KVDict, kvAsASCII
+from tron.Hub.Reply.Encoders.ASCIIReplyEncoder import ASCIIReplyEncoder
+from tron.Hub.Reply.Reply import Reply
+from tron.Hub.Reply.ReplyTaster import ReplyTaster
+from tron.Misc.cdict import cdict
+
+
+# Typical reply key texts: status heartbeats, positions, text, and a long array.
+#
+REPLY_KEYS = (
+    'AxePos=121.8734,63.4521,-12.0032; AxisCmdState=Tracking,Tracking,Tracking',
+    'TCCStatus="TTT","NNN"; TCCPos=121.87,63.45,-12.00; SecFocus=123.4',
+    'text="Exposure 12 of 20 finished, 00:04:32 left"',
+    'exposureState=integrating,900.0,482.3; shutter=open; ccdTemp=-110.2,-109.8',
+    'alive; timeStamp=2458871.2341; version="5.0.1"; cmdrs="APO.Jim","APO.Jane"',
+    'fiberPositions=%s' % (','.join(['%0.4f' % (i * 0.3719) for i in range(300)])),
+    'loadedCart=17; loadedPlate=9211,"APOGEE-2&MaNGA",1; gotoField=done',
+    'badQuote="it said \\"no\\" twice"; ok',
+)
+
+REPLY_LINES = tuple('APO.Jim %d i %s' % (i + 1, k) for i, k in enumerate(REPLY_KEYS))
+
+COMMAND_ARGS = (
+    'listen addActors tcc mcp apogee',
+    'login program="APO" password="3f2a9c" username="jim" type=tui version=1.3',
+    'getFor=tcc AxePos TCCStatus SecFocus',
+    'set program=APO tcc mcp boss',
+    'track 121.5,63.2 icrs /rotType=obj /rotAng=0.0',
+    'expose time=900.0 object name="MaNGA field 12"',
+)
+
+QUOTABLE = ('AxePos', 'Exposure 12 of 20 finished', 'it said "no" twice',
+            'C:\\path\\to\\file', "it's")
+
+
+class BenchCmd(object):
+    """ Just enough of a Command for Replys, tasters and encoders. """
+
+    def __init__(self, cmdrName='APO.Jim', actorName='tcc', mid=1):
+        self.cmdrName = cmdrName
+        self.cmdrID = cmdrName
+        self.cmdrCid = cmdrName
+        self.cmdrMid = mid
+        self.xid = mid
+        self.actorName = actorName
+        self.actorCid = 0
+        self.actorMid = mid
+
+
+def _replies(raw=False):
+    """ Return a Reply for each of REPLY_KEYS, as an ActorNub would create them. """
+
+    replies = []
+    for i, keys in enumerate(REPLY_KEYS):
+        cmd = BenchCmd(mid=i + 1)
+        if raw:
+            r = Reply(cmd, 'i', None, rawKeys=keys)
+            r.KVs
+        else:
+            r = Reply(cmd, 'i', keys)
+        replies.append(r)
+
+    return replies
+
+
+def benchParseASCIIReply():
+    lines = REPLY_LINES
+    parse = Parsing.parseASCIIReply
+
+    def run():
+        for line in lines:
+            parse(line, cidFirst=True)
+    return run, len(lines)
+
+
+def benchParseASCIIReplyCached():
+    run, n = benchParseASCIIReply()
+
+    def setup():
+        Parsing.setParseCacheSize(4096)
+        run()
+    return run, n, setup
+
+
+def benchParseArgs():
+    lines = COMMAND_ARGS
+    parse = Parsing.parseArgs
+
+    def run():
+        for line in lines:
+            parse(line)
+    return run, len(lines)
+
+
+def benchArgMatcher():
+    matcher = Parsing.ArgMatcher([('program', Parsing.dequote), ('password', Parsing.dequote),
+                                  ('username', Parsing.dequote), ('type', Parsing.dequote),
+                                  ('version', Parsing.dequote), ('platform', Parsing.dequote)])
+    argv = Parsing.parseArgs(COMMAND_ARGS[1])
+
+    def run():
+        matcher.match(argv)
+    return run, 1
+
+
+def benchKvAsASCII():
+    KVs = []
+    for keys in REPLY_KEYS:
+        KVs.extend(Parsing.parseKVs(keys).items())
+
+    def run():
+        for k, v in KVs:
+            kvAsASCII(k, v, escape='\n')
+    return run, len(KVs)
+
+
+def benchQstr():
+    strings = QUOTABLE
+    qstr = Misc.qstr
+
+    def run():
+        for s in strings:
+            qstr(s)
+    return run, len(strings)
+
+
+def benchDequote():
+    strings = [Misc.qstr(s) for s in QUOTABLE] + list(QUOTABLE)
+    dequote = Parsing.dequote
+
+    def run():
+        for s in strings:
+            dequote(s)
+    return run, len(strings)
+
+
+def benchCdictGet():
+    d = cdict(dictType=OrderedDict)
+    names = ['key%03d' % (i) for i in range(200)]
+    for n in names:
+        d[n] = n
+    lookups = [n.upper() for n in names[::10]] + ['missing%d' % (i) for i in range(5)]
+
+    def run():
+        for n in lookups:
+            d.get(n)
+    return run, len(lookups)
+
+
+def benchCdictFetch():
+    d = cdict(dictType=OrderedDict)
+    names = ['key%03d' % (i) for i in range(200)]
+    for n in names:
+        d[n] = n
+    lookups = names[::10]
+
+    def run():
+        for n in lookups:
+            d.fetch(n)
+    return run, len(lookups)
+
+
+def benchKVDictSetKVsFromReply():
+    d = KVDict()
+    replies = _replies()
+
+    def run():
+        for r in replies:
+            d.setKVsFromReply(r)
+    return run, sum([len(r.KVs) for r in replies])
+
+
+def benchKVDictSetKVsFromReplyEphemeral():
+    d = KVDict(ephemeral=['tcc.axe*', 'tcc.fiberPositions', 'tcc.timeStamp', 'tcc.ccdTemp'])
+    replies = _replies()
+
+    def run():
+        for r in replies:
+            d.setKVsFromReply(r)
+    return run, sum([len(r.KVs) for r in replies])
+
+
+def benchKVDictGetValues():
+    d = KVDict()
+    replies = _replies()
+    for r in replies:
+        d.setKVsFromReply(r)
+    keys = ['AxePos', 'TCCStatus', 'secfocus', 'noSuchKey', 'ccdTemp', 'fiberPositions']
+
+    def run():
+        d.getValues('tcc', keys)
+    return run, len(keys)
+
+
+def benchKVDictStoredKeysReply():
+    """ A keys getFor reply for every stored key of a source, encoded once. """
+
+    d = KVDict()
+    for r in _replies():
+        d.setKVsFromReply(r)
+    kvs = d.sources['tcc'].values()
+    cmd = BenchCmd()
+    encoder = ASCIIReplyEncoder(CIDfirst=True, rawKeys=True)
+
+    def run():
+        r = Reply(cmd, 'i', OrderedDict([(kv.key, kv.val) for kv in kvs]), src='keys_tcc',
+                  asciiKeys='; '.join([kv.asASCII() for kv in kvs]))
+        encoder.encode(r, None)
+    return run, len(kvs)
+
+
+def benchReplyTasterTaste():
+    tasters = []
+    for i in range(10):
+        t = ReplyTaster()
+        t.setFilter(['actor%d' % (i), 'mcp'], ['APO.Other%d' % (i)], ['hub', 'cmds'])
+        tasters.append(t)
+    tasters[-1].setFilter(['tcc'], [], [])
+    replies = _replies()
+
+    def run():
+        for r in replies:
+            for t in tasters:
+                t.taste(r)
+    return run, len(replies) * len(tasters)
+
+
+def benchLogDisabledEager():
+    Misc.disableLoggingFor('bench.log')
+    actorName, tgt = 'tcc', BenchCmd()
+
+    def run():
+        Misc.log('bench.log', 'actorName %s target = %s' % (actorName, tgt))
+    return run, 1
+
+
+def benchLogDisabledLazy():
+    Misc.disableLoggingFor('bench.log')
+    actorName, tgt = 'tcc', BenchCmd()
+
+    def run():
+        Misc.log('bench.log', 'actorName %s target = %s', actorName, tgt)
+    return run, 1
+
+
+def _benchEncoder(**argv):
+    encoder = ASCIIReplyEncoder(**argv)
+    replies = _replies(raw=argv.get('rawKeys', False))
+
+    def run():
+        # Drop the cached renderings, so that every commander pays for them.
+        for r in replies:
+            r.asciiKeys.clear()
+            encoder.encode(r, None)
+    return run, len(replies)
+
+
+def benchASCIIReplyEncoderSimple():
+    return _benchEncoder(CIDfirst=True)
+
+
+def benchASCIIReplyEncoderFull():
+    return _benchEncoder(simple=False)
+
+
+def benchASCIIReplyEncoderRawKeys():
+    return _benchEncoder(CIDfirst=True, rawKeys=True)
+
+
+BENCHMARKS = OrderedDict((
+    ('parse.parseASCIIReply', benchParseASCIIReply),
+    ('parse.parseASCIIReply.cached', benchParseASCIIReplyCached),
+    ('parse.parseArgs', benchParseArgs),
+    ('parse.ArgMatcher.match', benchArgMatcher),
+    ('quote.kvAsASCII', benchKvAsASCII),
+    ('quote.qstr', benchQstr),
+    ('quote.dequote', benchDequote),
+    ('cdict.get', benchCdictGet),
+    ('cdict.fetch', benchCdictFetch),
+    ('KVDict.setKVsFromReply', benchKVDictSetKVsFromReply),
+    ('KVDict.setKVsFromReply.ephemeral', benchKVDictSetKVsFromReplyEphemeral),
+    ('KVDict.getValues', benchKVDictGetValues),
+    ('KVDict.storedKeysReply', benchKVDictStoredKeysReply),
+    ('ReplyTaster.taste', benchReplyTasterTaste),
+    ('log.disabled.eager', benchLogDisabledEager),
+    ('log.disabled.lazy', benchLogDisabledLazy),
+    ('encode.ASCIIReplyEncoder.simple', benchASCIIReplyEncoderSimple),
+    ('encode.ASCIIReplyEncoder.full', benchASCIIReplyEncoderFull),
+    ('encode.ASCIIReplyEncoder.rawKeys', benchASCIIReplyEncoderRawKeys),
+))
+
+
+def runBenchmarks(pattern=None, repeat=5, minTime=0.2, out=sys.stdout):
+    """ Run the benchmarks, and return a dictionary of results.
+
+    Args:
+       pattern  - only run the benchmarks whose names contain this.
+       repeat   - how many times to time each benchmark. The best time is kept.
+       minTime  - the minimum duration of each timing, in seconds.
+       out      - where to print progress. None to be quiet.
+    """
+
+    results = OrderedDict()
+    for name, bench in BENCHMARKS.items():
+        if pattern and pattern not in name:
+            continue
+
+        # Benchmarks return (run, opsPerRun) or (run, opsPerRun, setup).
+        b = bench()
+        run, nOps = b[:2]
+        setup = b[2] if len(b) > 2 else None
+
+        # Each benchmark starts from the default parse cache setting.
+        Parsing.setParseCacheSize(0)
+        if setup:
+            setup()
+
+        timer = timeit.Timer(run)
+        number = 1
+        while timer.timeit(number) < minTime:
+            number *= 2
+        best = min(timer.repeat(repeat, number))
+        usPerOp = best / (number * nOps) * 1e6
+
+        results[name] = {'usPerOp': usPerOp, 'ops': number * nOps}
+        if out:
+            out.write('%-36s %10.3f us/op\n' % (name, usPerOp))
+            out.flush()
+
+    Parsing.setParseCacheSize(0)
+
+    return {'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'results': results}
+
+
+def saveResults(results, filename):
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=2)
+        f.write('\n')
+
+
+def loadResults(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def compareResults(old, new, out=sys.stdout):
+    """ Print the per-benchmark times of two runs, and the new/old ratios. """
+
+    oldResults = old['results']
+    newResults = new['results']
+
+    out.write('%-36s %10s %10s %8s\n' % ('benchmark', 'old us/op', 'new us/op', 'new/old'))
+    for name in list(oldResults) + [n for n in newResults if n not in oldResults]:
+        o = oldResults.get(name)
+        n = newResults.get(name)
+        if o is None or n is None:
+            out.write('%-36s %10s %10s\n' % (name,
+                                             '%0.3f' % (o['usPerOp']) if o else '-',
+                                             '%0.3f' % (n['usPerOp']) if n else '-'))
+            continue
+        out.write('%-36s %10.3f %10.3f %8.2f\n' % (name, o['usPerOp'], n['usPerOp'],
+                                                   n['usPerOp'] / o['usPerOp']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m tron.bench',
+                                     description='time the hub hot paths.')
+    parser.add_argument('-k', dest='pattern', default=None,
+                        help='only run the benchmarks whose names contain PATTERN')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='how many timings to take the best of')
+    parser.add_argument('--save', metavar='FILE', default=None,
+                        help='save the results to FILE, as JSON')
+    parser.add_argument('--compare', metavar='FILE', nargs='+', default=None,
+                        help='compare OLD with NEW, or with a fresh run')
+    opts = parser.parse_args(argv)
+
+    if opts.compare and len(opts.compare) > 2:
+        parser.error('--compare takes one or two files')
+
+    if opts.compare and len(opts.compare) == 2:
+        new = loadResults(opts.compare[1])
+    else:
+        new = runBenchmarks(pattern=opts.pattern, repeat=opts.repeat,
+                            out=None if opts.compare else sys.stdout)
+        if opts.save:
+            saveResults(new, opts.save)
+
+    if opts.compare:
+        compareResults(loadResults(opts.compare[0]), new)
+
+
+if __name__ == '__main__':
+    main()
@@ -33,8 +33,9 @@ from collections import OrderedDict
 import tron.Auth
 import tron.Hub.Command.Command
 import tron.Hub.KV.KVDict
+import tron.Hub.KV.KVSnapshot
 import tron.IO
-from tron import Misc, __version__, g
+from tron import Misc, Parsing, __version__, g
 from tron.Misc.cdict import cdict
 
 
@@ -59,8 +60,16 @@ def init(programsFile=None):
     g.logDir = os.path.expandvars(Misc.cfg.get('hub', 'logDir'))
     Misc.setLogdir(g.logDir)
     Misc.setID('hub')
+    for system, enabled in Misc.cfg.get('hub', 'logSystems', {}).items():
+        Misc.setLoggingFor(system, enabled)
     Misc.log('hub.init', 'logger started...')
 
+    # Write the log from a background thread, every logFlushInterval seconds.
+    logFlushInterval = Misc.cfg.get('hub', 'logFlushInterval', 0)
+    if logFlushInterval > 0:
+        Misc.startLogWriter(flushInterval=logFlushInterval,
+                            queueSize=Misc.cfg.get('hub', 'logQueueSize', 10000))
+
     #   - a globally unique ID generator for Commands.
     g.xids = Misc.ID()
     g.nubIDs = Misc.ID()
@@ -70,11 +79,22 @@ def init(programsFile=None):
     #   All of these are in the global namespace "g".
     #
     #   - A dictionary of KVs
-    g.KVs = tron.Hub.KV.KVDict.KVDict(debug=5)
+    g.KVs = tron.Hub.KV.KVDict.KVDict(debug=5,
+                                      history=Misc.cfg.get('hub', 'keyHistory', {}),
+                                      ephemeral=Misc.cfg.get('hub', 'ephemeralKeys', []))
 
     g.commanders = cdict()
     g.actors = cdict()
 
+    #   - whether any commander listens to a given reply source. See isHeard().
+    g.heardSources = {}
+
+    #   - trace one out of every cmdTraceSample commands. 0 disables tracing.
+    g.cmdTraceSample = Misc.cfg.get('hub', 'cmdTraceSample', 0)
+
+    #   - keep the parsed keys of the parseCacheSize most recent reply bodies.
+    Parsing.setParseCacheSize(Misc.cfg.get('hub', 'parseCacheSize', 4096))
+
     g.hubcmd = None
     g.hubcmd = tron.Hub.Command.Command(
         '.hub',
@@ -102,7 +122,9 @@ def init(programsFile=None):
     Misc.log('hub.init', 'loading programs ...')
     loadPrograms()
 
-    #   - A dictionary of Commander Nubs, indexed by unique ID.
+    #   - A dictionary of Commander Nubs, indexed by unique ID, and an index
+    #     of the same nubs by name. CmdrDict keeps the latter up to date.
+    g.commanderNames = {}
     g.commanders = CmdrDict('Commanders')
     # g.listeners = g.commanders
 
@@ -113,12 +135,23 @@ def init(programsFile=None):
     #   - dictionary of PollAcceptors, waiting for for new connections.
     g.acceptors = cdict()
 
-    #   - dictionary of active commands, indexed by XID.
-    g.pendingCommands = {}
+    #   - registry of commands sent to actors, indexed by XID.
+    g.pendingCommands = tron.Hub.Command.PendingCommands(
+        timeouts=Misc.cfg.get('hub', 'commandTimeouts', {}))
 
     #   - A PollHandler
     g.poller = tron.IO.PollHandler(debug=1)
 
+    #   - command latency histograms, optionally generated every cmdStatsInterval seconds.
+    g.cmdStats = tron.Hub.Command.CommandStats()
+    g.cmdStats.setInterval(Misc.cfg.get('hub', 'cmdStatsInterval', 0))
+
+    #   - the keys as of the last run, kept on disk every kvSnapshotInterval seconds.
+    g.kvSnapshot = tron.Hub.KV.KVSnapshot.KVSnapshot(
+        g.KVs, filename=os.path.expandvars(Misc.cfg.get('hub', 'kvSnapshotFile', '')))
+    g.kvSnapshot.load()
+    g.kvSnapshot.setInterval(Misc.cfg.get('hub', 'kvSnapshotInterval', 0))
+
     Misc.log('hub.init', 'loading internal vocabulary...')
     loadWords(None)
 
@@ -177,12 +210,12 @@ def _loadWords(wordlist):
         if w == 'hub':
             modName = 'tron.Vocab.hubCommands'
         try:
-            Misc.log('hub.loadVocab', 'trying to (re-)load vocabulary word %s' % (w,))
+            Misc.log('hub.loadVocab', 'trying to (re-)load vocabulary word %s', w)
             mod = importlib.import_module(modName)
         except ImportError as e:
             raise Exception('Import of %s failed: %s' % (modName, e))
 
-        Misc.log('hub.loadWords', 'loading vocabulary word %s from %s...' % (w, modName))
+        Misc.log('hub.loadWords', 'loading vocabulary word %s from %s...', w, modName)
 
         cmdSet = getattr(mod, 'hubCommands' if w == 'hub' else w)()
         try:
@@ -193,7 +226,7 @@ def _loadWords(wordlist):
 
         addActor(cmdSet)
 
-        Misc.log('hub.loadWords', 'vocabulary: %s' % (g.vocabulary))
+        Misc.log('hub.loadWords', 'vocabulary: %s', g.vocabulary)
 
 
 def shutdown():
@@ -213,6 +246,7 @@ def restart():
         pass
 
     Misc.log('hub.restart', 'for real......................................')
+    Misc.stopLogWriter()
     time.sleep(1)
     os.execlp('tron', 'tron', 'restart')
 
@@ -220,6 +254,12 @@ def restart():
 def _shutdown():
     sys.stderr.write('final cleanup; deleting hub pieces...\n')
 
+    sys.stderr.write('       saving keys...\n')
+    try:
+        g.kvSnapshot.write()
+    except BaseException:
+        pass
+
     sys.stderr.write('       deleting acceptors...\n')
     for aname, acceptor in list(g.acceptors.items()):
         try:
@@ -247,7 +287,7 @@ def run():
     """
     while True:
         try:
-            Misc.log('hub.run', 'actors id=%r' % (id(g.actors)))
+            Misc.log('hub.run', 'actors id=%r', id(g.actors))
             g.poller.run()
         except (SystemExit, KeyboardInterrupt):
             Misc.log('Hub.run', 'Normal exit."')
@@ -292,6 +332,25 @@ class CmdrDict(NubDict):
     the state of the nub's isUser attribute.
     """
 
+    def __setitem__(self, k, v):
+        g.heardSources = {}
+        g.commanderNames[v.name] = v
+        NubDict.__setitem__(self, k, v)
+
+    def __delitem__(self, k):
+        g.heardSources = {}
+        nub = self[k]
+        if g.commanderNames.get(nub.name) is nub:
+            del g.commanderNames[nub.name]
+        NubDict.__delitem__(self, k)
+
+        # Names are not necessarily unique, so let another commander take this one over.
+        if nub.name not in g.commanderNames:
+            for other in self.values():
+                if other.name == nub.name:
+                    g.commanderNames[other.name] = other
+                    break
+
     def listSelf(self, cmd=None):
         if not cmd:
             cmd = g.hubcmd
@@ -301,7 +360,7 @@ class CmdrDict(NubDict):
             names.append(Misc.qstr(n.name))
             if n.isUser:
                 userNames.append(Misc.qstr(n.name))
-            Misc.log('listCommanders', 'n=%s has info=%s' % (n, n.userInfo))
+            Misc.log('listCommanders', 'n=%s has info=%s', n, n.userInfo)
             if n.userInfo:
                 cmd.inform(n.userInfo)
 
@@ -315,23 +374,23 @@ def addNubToDict(nub, nubDict):
 
     existingNub = findNubInDict(nub.ID, nubDict)
     if existingNub is not None:
-        Misc.log('Hub.nubs', 'nub %s already exists; not overwriting' % (nub.ID))
+        Misc.log('Hub.nubs', 'nub %s already exists; not overwriting', nub.ID)
         return
 
     nubDict[nub.ID] = nub
-    Misc.log('Hub.nubs', 'added nub %s to %s' % (nub, nubDict))
+    Misc.log('Hub.nubs', 'added nub %s to %s', nub, nubDict)
 
 
 def dropNubFromDict(nub, nubDict, doShutdown=True):
     """ Close an existing nub. The nub must, of course, be in the given nub dict. """
 
-    Misc.log('Hub.nubs', 'dropping nub=%s shutdown=%s' % (nub, doShutdown))
+    Misc.log('Hub.nubs', 'dropping nub=%s shutdown=%s', nub, doShutdown)
     if doShutdown:
         nub.shutdown(notifyHub=False)
 
     nub = findNubInDict(nub.ID, nubDict)
     if nub is None:
-        Misc.log('Hub.nubs', 'nub %s is not registered; not dropping it' % (nub.ID))
+        Misc.log('Hub.nubs', 'nub %s is not registered; not dropping it', nub.ID)
         return
 
     del nubDict[nub.ID]
@@ -352,6 +411,9 @@ def addActor(nub):
 
 def dropActor(nub):
     # g.perms.dropActors([nub.name])
+    why = 'the target named %s has been disconnected' % (nub.name)
+    nub.failQueuedCommands(why)
+    nub.failOurCommands(why)
     g.KVs.clearSource(nub.name)
     dropNubFromDict(nub, g.actors)
 
@@ -361,12 +423,12 @@ def findActor(id):
 
 
 def addCommander(nub):
-    Misc.log('hub.addCommander', 'adding %s' % (nub.name))
+    Misc.log('hub.addCommander', 'adding %s', nub.name)
     addNubToDict(nub, g.commanders)
 
 
 def dropCommander(nub, doShutdown=True):
-    Misc.log('hub.dropCommander', 'dropping %s' % (nub.name))
+    Misc.log('hub.dropCommander', 'dropping %s', nub.name)
     dropNubFromDict(nub, g.commanders, doShutdown=doShutdown)
 
 
@@ -374,6 +436,21 @@ def findCommander(id):
     return findNubInDict(id, g.commanders)
 
 
+def findCommanderByName(name):
+    """ Return the registered commander with the given name, or None. """
+
+    return g.commanderNames.get(name, None)
+
+
+def commanderRenamed(nub, oldName):
+    """ Keep the commander name index correct after a commander changes its name. """
+
+    if g.commanderNames.get(oldName) is nub:
+        del g.commanderNames[oldName]
+    if g.commanders.get(nub.ID) is nub:
+        g.commanderNames[nub.name] = nub
+
+
 def addAcceptor(nub):
     addNubToDict(nub, g.acceptors)
 
@@ -406,8 +483,8 @@ def dropNub(nub):
         dropAcceptor(nub)
     else:
         Misc.log('hub.dropNub',
-                 'nub %s (%s) is neither in g.actors (%s) or g.commanders (%s)' %
-                 (nub.ID, nub, g.actors, g.commanders))
+                 'nub %s (%s) is neither in g.actors (%s) or g.commanders (%s)',
+                 nub.ID, nub, g.actors, g.commanders)
 
 
 def listActors(match):
@@ -418,6 +495,28 @@ def listActors(match):
     return actors
 
 
+def isHeard(src):
+    """ Return whether any commander would accept a hub reply from the given source.
+
+    Lets us skip building Replies which nobody would ever see. The answer is cached
+    until some commander comes or goes, or changes what it listens to.
+    """
+
+    try:
+        return g.heardSources[src]
+    except KeyError:
+        pass
+
+    heard = False
+    for c in g.commanders.values():
+        if c.taster.tastes(g.hubcmd, src):
+            heard = True
+            break
+
+    g.heardSources[src] = heard
+    return heard
+
+
 def validateCommanderNames(nub, programName, username):
     """ Transform a proposed CommanderNub name into a unique CommanderNub name.
 
@@ -439,16 +538,9 @@ def validateCommanderNames(nub, programName, username):
 
     n = 2
     proposedName = fullName
-    ok = False
-    while not ok:
-        ok = True
-        for c in g.commanders.values():
-            if c.name == proposedName:
-                ok = False
-                break
-        if not ok:
-            proposedName = '%s_%d' % (fullName, n)
-            n += 1
+    while proposedName in g.commanderNames:
+        proposedName = '%s_%d' % (fullName, n)
+        n += 1
 
     return proposedName
 
@@ -466,7 +558,7 @@ def getActor(cmd):
         # Misc.log("hub.getActor", "looking for vocabulary word %s" % (actorName))
         tgt = g.vocabulary.get(actorName, None)
 
-    Misc.log('hub.getActor', 'actornName %s target = %s' % (actorName, tgt))
+    Misc.log('hub.getActor', 'actornName %s target = %s', actorName, tgt)
     return tgt
 
 
@@ -482,7 +574,7 @@ def addCommand(cmd):
           - Provide some throttling to avoid idiocy when, say, the tcc password is changed.
     """
 
-    Misc.log('hub.addCommand', 'new cmd=%s' % (cmd))
+    Misc.log('hub.addCommand', 'new cmd=%s', cmd)
 
     if cmd.actorName == 'dbg':
         runCmd(cmd)
@@ -512,7 +604,7 @@ def addCommand(cmd):
 
 def runCmd(c):
     cmd = c.cmd.strip()
-    Misc.log('hub.runCmd', 'cmd = %r' % (cmd))
+    Misc.log('hub.runCmd', 'cmd = %r', cmd)
     if cmd == '':
         c.finish('Eval=%s' % (Misc.qstr('')),
                  src='hub')
@@ -526,7 +618,7 @@ def runCmd(c):
         raise
 
     c.finish('Eval=%s' % (Misc.qstr(ret)), src='hub')
-    Misc.log('hub.runCmd', 'ret = %r' % (ret))
+    Misc.log('hub.runCmd', 'ret = %r', ret)
 
 
 def forceReload(name):
@@ -534,7 +626,7 @@ def forceReload(name):
 
     """
     try:
-        Misc.log('hub.forceReload', 'trying to (re-)load %s' % (name))
+        Misc.log('hub.forceReload', 'trying to (re-)load %s', name)
         mod = importlib.import_module(f'tron.Nubs.{name}')
     except BaseException:
         raise
@@ -554,13 +646,13 @@ def startNub(name):
     (Re-)Loads a module named 'name' from the Nubs folder and calls the start function.
     """
 
-    Misc.log('hub.startNub', 'trying to start %s' % (name))
+    Misc.log('hub.startNub', 'trying to start %s', name)
 
     mod = importlib.import_module(f'tron.Nubs.{name}')
 
     # And call the start() function.
     #
-    Misc.log('hub.startNub', 'starting Nub %s...' % (name))
+    Misc.log('hub.startNub', 'starting Nub %s...', name)
     mod.start(g.poller)
 
 